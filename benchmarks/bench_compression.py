@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark response compression for the large JSON endpoints
+Reports bytes on the wire and CPU cost per encoding, and the cost of a
+cache hit that reuses precompressed bytes
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from flask import Flask
+from utils.json_provider import FastJSONProvider
+from middleware.compression import PrecompressedBody, available_encodings, compress
+
+REPEAT = int(os.getenv('BENCH_REPEAT', 50))
+
+def contribution_history(rows):
+    start = datetime(2024, 1, 1)
+    return {'contributions': [{
+        'id': i,
+        'stockvel_id': 7,
+        'user_id': i % 12,
+        'amount': Decimal('250.00'),
+        'contribution_date': start + timedelta(days=i),
+        'description': 'Monthly contribution',
+        'payment_method': 'bank_transfer',
+        'status': 'confirmed',
+        'user_name': f'member{i % 12}'
+    } for i in range(rows)]}
+
+def member_roster(rows):
+    return {'members': [{
+        'user_id': i,
+        'user_name': f'Member {i}',
+        'email': f'member{i}@example.com',
+        'is_admin': i == 0,
+        'joined_date': datetime(2024, 1, 1) + timedelta(days=i),
+        'total_contributed': Decimal('1500.00'),
+        'last_contribution_date': datetime(2024, 6, 1)
+    } for i in range(rows)]}
+
+def timed(fn):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        result = fn()
+    return (time.perf_counter() - started) / REPEAT, result
+
+if __name__ == '__main__':
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    payloads = {
+        'contributions x50': contribution_history(50),
+        'contributions x1000': contribution_history(1000),
+        'members x30': member_roster(30),
+    }
+
+    print(f"{'payload':<22} {'encoding':<9} {'bytes':>10} {'ratio':>7} {'compress':>11} {'cache hit':>11}")
+    with app.app_context():
+        for name, payload in payloads.items():
+            raw = PrecompressedBody.from_json(payload).data
+            print(f"{name:<22} {'identity':<9} {len(raw):>10,} {'1.00':>7} {'-':>11} {'-':>11}")
+            for encoding in available_encodings():
+                elapsed, body = timed(lambda: compress(raw, encoding))
+                cached = PrecompressedBody(raw)
+                cached.variant(encoding)
+                hit, _ = timed(lambda: cached.variant(encoding))
+                print(f"{'':<22} {encoding:<9} {len(body):>10,} {len(raw) / len(body):>7.2f} "
+                      f"{elapsed * 1e6:>9.0f}us {hit * 1e6:>9.2f}us")
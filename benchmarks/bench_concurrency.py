@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Benchmark the read endpoints under many concurrent connections, sync vs async
+Starts one single-process server per mode against the same seeded database:
+
+  sync   gunicorn, 1 worker x BENCH_THREADS threads (main:app)
+  async  uvicorn, 1 worker (asgi:app)
+
+and reports requests/sec, latency and requests per CPU-second of the server
+process (i.e. per core). Set BENCH_DATABASE_URL to a PostgreSQL database to
+measure the case that matters; the default SQLite file only checks the setup.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(ROOT, 'src')
+sys.path.insert(0, SRC)
+
+CONNECTIONS = int(os.getenv('BENCH_CONNECTIONS', 200))
+DURATION = float(os.getenv('BENCH_DURATION', 10))
+THREADS = int(os.getenv('BENCH_THREADS', 8))
+PORT = int(os.getenv('BENCH_PORT', 5055))
+GROUPS = int(os.getenv('BENCH_GROUPS', 10))
+MEMBERS = int(os.getenv('BENCH_MEMBERS', 12))
+PATHS = ['/api/stockvels/', '/api/stockvels/{id}', '/api/stockvels/{id}/members', '/api/stockvels/{id}/contributions', '/api/auth/profile']
+
+def seed(env):
+    """Create GROUPS stockvels of MEMBERS members with a year of contributions; return (token, stockvel id)"""
+    os.environ.update(env)
+    from main import app
+    from services.database_service import db
+    from models.user import User
+    from models.stockvel import Stockvel, StockvelMember, Contribution
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        users = [User(email=f'bench{i}@example.com', display_name=f'Bench {i}') for i in range(MEMBERS)]
+        for user in users:
+            user.set_password('password123')
+        db.session.add_all(users)
+        db.session.flush()
+
+        first_id = None
+        for g in range(GROUPS):
+            stockvel = Stockvel(name=f'Bench group {g}', contribution_amount=Decimal('250.00'), frequency='Monthly',
+                                max_members=MEMBERS, start_date=datetime(2024, 1, 1), admin_user_id=users[0].id)
+            db.session.add(stockvel)
+            db.session.flush()
+            first_id = first_id or stockvel.id
+            for position, user in enumerate(users):
+                db.session.add(StockvelMember(stockvel_id=stockvel.id, user_id=user.id, is_admin=position == 0, position=position))
+                for month in range(12):
+                    db.session.add(Contribution(stockvel_id=stockvel.id, user_id=user.id, amount=Decimal('250.00'),
+                                                contribution_date=datetime(2024, 1, 1) + timedelta(days=30 * month)))
+        db.session.commit()
+        return create_access_token(identity=str(users[0].id)), first_id
+
+def cpu_seconds(pid):
+    """utime + stime of a process and its children (gunicorn's worker) from /proc (Linux)"""
+    total = 0.0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return total
+
+def server_command(mode):
+    if mode == 'sync':
+        return ['gunicorn', '--chdir', SRC, '-w', '1', '--threads', str(THREADS), '-b', f'127.0.0.1:{PORT}', '--log-level', 'warning', 'main:app']
+    return ['uvicorn', '--app-dir', SRC, '--host', '127.0.0.1', '--port', str(PORT), '--log-level', 'warning', '--no-access-log', 'asgi:app']
+
+async def wait_ready(client):
+    for _ in range(100):
+        try:
+            await client.get('/')
+            return
+        except Exception:
+            await asyncio.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+async def drive(token, stockvel_id):
+    import httpx
+
+    limits = httpx.Limits(max_connections=CONNECTIONS, max_keepalive_connections=CONNECTIONS)
+    headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': 'gzip'}
+    paths = [path.format(id=stockvel_id) for path in PATHS]
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{PORT}', limits=limits, timeout=30, headers=headers) as client:
+        await wait_ready(client)
+        deadline = time.perf_counter() + DURATION
+
+        async def connection(n):
+            nonlocal errors
+            i = n
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(paths[i % len(paths)])
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+                i += 1
+
+        await asyncio.gather(*(connection(n) for n in range(CONNECTIONS)))
+    return latencies, errors
+
+def run(mode, env, token, stockvel_id):
+    server = subprocess.Popen(server_command(mode), env={**os.environ, **env}, cwd=ROOT)
+    try:
+        time.sleep(1)
+        cpu_before = cpu_seconds(server.pid)
+        started = time.perf_counter()
+        latencies, errors = asyncio.run(drive(token, stockvel_id))
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(server.pid) - cpu_before
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{mode:<6} {len(latencies) / elapsed:>9.0f} {len(latencies) / cpu if cpu else 0:>12.0f} "
+          f"{p(0.5):>8.1f} {p(0.99):>8.1f} {errors:>7}")
+
+if __name__ == '__main__':
+    database_url = os.getenv('BENCH_DATABASE_URL') or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    env = {
+        'FLASK_ENV': 'production',
+        'DATABASE_URL': database_url,
+        'JWT_SECRET_KEY': 'bench-secret',
+        'COMPRESS_MIN_SIZE': '1024',
+    }
+    token, stockvel_id = seed(env)
+
+    print(f"{CONNECTIONS} connections for {DURATION:.0f}s per mode against {database_url.split('@')[-1]}")
+    print(f"{'mode':<6} {'req/s':>9} {'req/cpu-s':>12} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in sys.argv[1:] or ['sync', 'async']:
+        run(mode, env, token, stockvel_id)
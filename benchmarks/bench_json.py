@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark JSON serialization of the large list endpoints
+Compares the old path (to_dict converting floats/isoformat + Flask's default provider)
+with raw to_dict values serialized by FastJSONProvider
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from utils.json_provider import FastJSONProvider, orjson
+
+ROWS = int(os.getenv('BENCH_ROWS', 10000))
+REPEAT = int(os.getenv('BENCH_REPEAT', 20))
+
+def make_rows():
+    start = datetime(2024, 1, 1)
+    return [{
+        'id': i,
+        'stockvel_id': i % 50,
+        'user_id': i % 400,
+        'amount': Decimal('250.00') + i % 7,
+        'contribution_date': start + timedelta(hours=i),
+        'description': 'Monthly contribution',
+        'payment_method': 'bank_transfer',
+        'status': 'confirmed',
+        'user_name': f'member{i % 400}'
+    } for i in range(ROWS)]
+
+def legacy_dict(row):
+    """What to_dict returned before: floats and isoformat strings, field by field"""
+    data = dict(row)
+    data['amount'] = float(row['amount'])
+    data['contribution_date'] = row['contribution_date'].isoformat()
+    return data
+
+def bench(label, fn):
+    fn()  # warm up
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        size = len(fn())
+    elapsed = (time.perf_counter() - started) / REPEAT
+    print(f"{label:<40} {elapsed * 1000:8.2f} ms/response  {ROWS / elapsed:12,.0f} rows/s  {size:,} bytes")
+    return elapsed
+
+if __name__ == '__main__':
+    app = Flask(__name__)
+    default_provider = DefaultJSONProvider(app)
+    fast_provider = FastJSONProvider(app)
+    rows = make_rows()
+
+    print(f"Serializing {ROWS:,} contributions, {REPEAT} runs (orjson {'available' if orjson else 'NOT installed'})")
+    with app.app_context():
+        legacy = bench('legacy to_dict + default provider',
+                       lambda: default_provider.response({'contributions': [legacy_dict(r) for r in rows]}).get_data())
+        fast = bench('raw to_dict + FastJSONProvider',
+                     lambda: fast_provider.response({'contributions': rows}).get_data())
+    print(f"Speed-up: {legacy / fast:.1f}x")
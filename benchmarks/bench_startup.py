@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark worker cold start
+Each run is a fresh interpreter that imports main, builds the app and serves its
+first authenticated request, with and without the warm-up, and the report ends
+with a `-X importtime` summary of the modules that dominate the import.
+Pass --json to print the results as one JSON object for tracking over time.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+RUNS = int(os.getenv('BENCH_RUNS', 5))
+TOP = int(os.getenv('BENCH_TOP_MODULES', 15))
+
+def child(warm):
+    """Runs in the fresh interpreter; prints the timings of one cold start as JSON"""
+    timings = {}
+    started = time.perf_counter()
+
+    sys.path.insert(0, SRC)
+    import main
+    timings['import'] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    app = main.get_app()
+    timings['create_app'] = time.perf_counter() - mark
+
+    from services.database_service import db
+    from models.user import User
+    from flask_jwt_extended import create_access_token
+    with app.app_context():
+        db.create_all()
+        user = User.query.filter_by(email='bench@example.com').first()
+        if user is None:
+            user = User(email='bench@example.com', display_name='Bench')
+            user.password_hash = 'x'
+            db.session.add(user)
+            db.session.commit()
+        token = create_access_token(identity=str(user.id))
+        db.session.remove()
+        db.engine.dispose()
+
+    timings['warm_up'] = 0.0
+    if warm:
+        from services.warmup_service import warm_up
+        mark = time.perf_counter()
+        warm_up(app)
+        timings['warm_up'] = time.perf_counter() - mark
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    for label in ('first_request', 'second_request'):
+        mark = time.perf_counter()
+        response = client.get('/api/stockvels/', headers=headers)
+        timings[label] = time.perf_counter() - mark
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    print(json.dumps(timings))
+
+def run_child(warm, env):
+    args = [sys.executable, os.path.abspath(__file__), '--child'] + (['--warm'] if warm else [])
+    output = subprocess.run(args, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def importtime(env):
+    """Parse `-X importtime` output into per-module self/cumulative microseconds"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main; main.get_app()'],
+        cwd=SRC, env=env, capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self_us': int(self_us),
+            'cumulative_us': int(cumulative_us),
+        })
+
+    # Self time grouped by top-level package shows who pays, wherever it was imported from
+    packages = {}
+    for module in modules:
+        package = module['module'].split('.')[0]
+        packages[package] = packages.get(package, 0) + module['self_us']
+
+    return {
+        'total_us': sum(m['cumulative_us'] for m in modules if m['depth'] == 0),
+        'top_cumulative': sorted(
+            (m for m in modules if m['depth'] == 0), key=lambda m: m['cumulative_us'], reverse=True
+        )[:TOP],
+        'top_packages': sorted(
+            ({'package': p, 'self_us': us} for p, us in packages.items()), key=lambda p: p['self_us'], reverse=True
+        )[:TOP],
+    }
+
+def summarize(runs):
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        child('--warm' in sys.argv)
+        sys.exit(0)
+
+    env = dict(os.environ)
+    env.setdefault('FLASK_ENV', 'production')
+    env.setdefault('JWT_SECRET_KEY', 'bench-jwt-secret-key-0123456789abcdef')
+    env.setdefault('DATABASE_URL', os.getenv(
+        'BENCH_DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_startup.db')}"
+    ))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    run_child(False, env)  # Create the schema and bytecode before measuring
+    results = {
+        'cold': summarize([run_child(False, env) for _ in range(RUNS)]),
+        'warmed': summarize([run_child(True, env) for _ in range(RUNS)]),
+        'importtime': importtime(env),
+    }
+
+    if '--json' in sys.argv:
+        print(json.dumps(results, indent=2))
+        sys.exit(0)
+
+    print(f"Cold start, median of {RUNS} fresh interpreters (ms)")
+    print(f"{'':<10} {'import':>10} {'create_app':>12} {'warm_up':>10} {'1st request':>12} {'2nd request':>12}")
+    for label in ('cold', 'warmed'):
+        t = results[label]
+        print(f"{label:<10} {t['import'] * 1000:10.1f} {t['create_app'] * 1000:12.1f} {t['warm_up'] * 1000:10.1f} "
+              f"{t['first_request'] * 1000:12.1f} {t['second_request'] * 1000:12.1f}")
+
+    report = results['importtime']
+    print()
+    print(f"-X importtime: {report['total_us'] / 1000:.1f} ms for `import main; main.get_app()`")
+    print(f"{'top-level import':<45} {'cumulative ms':>14}")
+    for module in report['top_cumulative']:
+        print(f"{module['module']:<45} {module['cumulative_us'] / 1000:14.1f}")
+    print()
+    print(f"{'package':<45} {'self ms':>14}")
+    for package in report['top_packages']:
+        print(f"{package['package']:<45} {package['self_us'] / 1000:14.1f}")
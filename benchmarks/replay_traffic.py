@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Replay captured traffic against a seeded local instance
+    python benchmarks/replay_traffic.py captures/*.ndjson.gz [--json]
+
+Record the traffic with TRAFFIC_CAPTURE=true (middleware/traffic_capture.py).
+The replay seeds REPLAY_USERS users and REPLAY_GROUPS stockvels into
+DATABASE_URL, which must be the database of the server at REPLAY_TARGET
+(rows from an earlier run are reused), and signs tokens with its
+JWT_SECRET_KEY. It then sends the captured requests at their original
+spacing divided by REPLAY_SPEEDUP.
+
+Pseudonymous users, groups and invite codes in the capture map onto seeded
+rows in order of first appearance. Bodies are rebuilt from their recorded
+shape with a random generator seeded by REPLAY_SEED, so every run sends the
+same requests in the same order at the same offsets, which lets two
+versions of the app be compared on a real load shape (e.g. the morning
+login burst). Requests that would revoke tokens or delete data are skipped.
+Turn rate limiting off on the target (RATE_LIMIT_ENABLED=false) unless it
+is what you are measuring.
+
+Reports latency percentiles per endpoint next to the latency captured in
+production, and how far sending fell behind the schedule.
+"""
+import asyncio
+import gzip
+import json
+import os
+import random
+import re
+import string
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from urllib.parse import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(ROOT, 'src')
+sys.path.insert(0, SRC)
+
+TARGET = os.getenv('REPLAY_TARGET', 'http://127.0.0.1:5000').rstrip('/')
+SPEEDUP = float(os.getenv('REPLAY_SPEEDUP', 1))
+USERS = int(os.getenv('REPLAY_USERS', 50))
+GROUPS = int(os.getenv('REPLAY_GROUPS', 20))
+MEMBERS = int(os.getenv('REPLAY_MEMBERS', 8))
+CONCURRENCY = int(os.getenv('REPLAY_CONCURRENCY', 64))
+SEED = int(os.getenv('REPLAY_SEED', 1))
+LIMIT = int(os.getenv('REPLAY_LIMIT', 0))  # Requests replayed; 0 = all
+PASSWORD = 'replay-password'
+
+# Replaying these would revoke the replay's tokens, change its passwords or delete seeded rows
+SKIP_ENDPOINTS = {
+    'auth.logout', 'auth.revoke_sessions', 'auth.change_password', 'auth.debug_jwt', 'test_auth',
+    'stockvels.leave_stockvel',
+}
+RULE_ARG = re.compile(r'<(?:[^:<>]+:)?(\w+)>')
+
+def load(paths):
+    records = []
+    for path in paths:
+        with (gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # Last line of a capture that was still being written
+    records.sort(key=lambda record: record['t'])
+    records = [
+        record for record in records
+        if record['endpoint'] not in SKIP_ENDPOINTS
+        and not (record['endpoint'].startswith('admin.') and record['method'] != 'GET')
+    ]
+    return records[:LIMIT] if LIMIT else records
+
+def seed():
+    """Create (or reuse) the replay users and groups; return their ids, emails, invite codes and tokens"""
+    from main import get_app
+    from services.database_service import db
+    from models.user import User
+    from models.stockvel import Stockvel, StockvelMember, Contribution
+    from flask_jwt_extended import create_access_token
+
+    app = get_app()
+    with app.app_context():
+        db.create_all()
+        users = User.query.filter(User.email.like('replay%@example.com')).order_by(User.id).all()
+        if len(users) < USERS:
+            template = User(email='template@example.com')
+            template.set_password(PASSWORD)
+            for i in range(len(users), USERS):
+                db.session.add(User(email=f'replay{i}@example.com', display_name=f'Replay {i}', password_hash=template.password_hash))
+            db.session.commit()
+            users = User.query.filter(User.email.like('replay%@example.com')).order_by(User.id).all()
+        users = users[:USERS]
+
+        groups = Stockvel.query.filter(Stockvel.name.like('Replay group %')).order_by(Stockvel.id).all()
+        for g in range(len(groups), GROUPS):
+            members = [users[(g + m) % len(users)] for m in range(min(MEMBERS, len(users)))]
+            stockvel = Stockvel(name=f'Replay group {g}', contribution_amount=Decimal('250.00'), frequency='Monthly',
+                                max_members=MEMBERS * 2, start_date=datetime(2024, 1, 1), created_at=datetime(2024, 1, 1),
+                                admin_user_id=members[0].id)
+            db.session.add(stockvel)
+            db.session.flush()
+            for position, user in enumerate(members):
+                db.session.add(StockvelMember(stockvel_id=stockvel.id, user_id=user.id, is_admin=position == 0, position=position))
+                for month in range(6):
+                    db.session.add(Contribution(stockvel_id=stockvel.id, user_id=user.id, amount=Decimal('250.00'),
+                                                contribution_date=datetime(2024, 1, 1) + timedelta(days=30 * month)))
+            groups.append(stockvel)
+        db.session.commit()
+
+        return {
+            'users': [(user.id, user.email, create_access_token(identity=str(user.id))) for user in users],
+            'groups': [(group.id, group.invite_code) for group in groups[:GROUPS]]
+        }
+
+class Mapper:
+    """Pseudonyms and captured ids onto seeded rows, in order of first appearance"""
+
+    def __init__(self, seeded):
+        self.users = seeded['users']
+        self.groups = seeded['groups']
+        self.user_slots = {}
+        self.group_slots = {}
+        self.next_user = 0
+
+    def user(self, pseudonym, alias=None):
+        slot = self.user_slots.get(pseudonym, self.user_slots.get(alias))
+        if slot is None:
+            slot = self.next_user % len(self.users)
+            self.next_user += 1
+        self.user_slots[pseudonym] = slot
+        if alias:
+            self.user_slots[alias] = slot
+        return self.users[slot]
+
+    def group(self, key):
+        slot = self.group_slots.setdefault(key, len(self.group_slots) % len(self.groups))
+        return self.groups[slot]
+
+def fake_text(rng, length):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(max(1, length)))
+
+NUMBERS = {'amount': (100, 250, 500), 'contribution_amount': (250,), 'max_members': (10,), 'months_paid': (1,)}
+STRINGS = {
+    'password': PASSWORD, 'old_password': PASSWORD, 'new_password': PASSWORD,
+    'frequency': 'Monthly', 'payment_method': 'advance_payment', 'status': 'Upcoming'
+}
+
+def build(shape, rng, mapper, field=None):
+    """A value of the recorded shape"""
+    if isinstance(shape, dict):
+        return {key: build(value, rng, mapper, key) for key, value in shape.items()}
+    if isinstance(shape, list):
+        return [build(shape[0], rng, mapper, field) for _ in range(shape[1])] if shape else []
+    if shape == 'bool':
+        return rng.random() < 0.5
+    if shape == 'num':
+        return rng.choice(NUMBERS.get(field, range(1, 10)))
+    if shape == 'null':
+        return None
+    kind, _, value = shape.partition(':')
+    if kind == 'e':
+        return mapper.user(shape)[1]
+    if kind == 'u':
+        return mapper.user(shape)[0]
+    if kind == 'i':
+        return mapper.group(shape)[1]
+    if field in STRINGS:
+        return STRINGS[field]
+    if field == 'start_date':
+        return date.today().isoformat()
+    return fake_text(rng, int(value))
+
+def prepare(records, seeded):
+    """The captured requests as (offset seconds, endpoint, method, url, headers, body), deterministically"""
+    mapper = Mapper(seeded)
+    rng = random.Random(SEED)
+    run_id = f'{int(time.time())}'
+    start = records[0]['t']
+    requests = []
+    for n, record in enumerate(records):
+        endpoint = record['endpoint']
+        headers = {}
+        email = record['body'].get('email') if isinstance(record.get('body'), dict) else None
+        if record.get('user') and endpoint != 'auth.login':
+            headers['Authorization'] = f"Bearer {mapper.user(record['user'])[2]}"
+        elif endpoint == 'auth.login' and email:
+            mapper.user(email, record.get('user'))
+
+        args = {}
+        for key, value in record['args'].items():
+            if key == 'stockvel_id':
+                value = mapper.group(value)[0]
+            elif isinstance(value, str) and value.startswith('u:'):
+                value = mapper.user(value)[0]
+            args[key] = value
+        path = RULE_ARG.sub(lambda match: str(args.get(match.group(1), '')), record['rule'])
+
+        query = {
+            key: ('Replay group'[:int(value[4:])] if key == 'q' else fake_text(rng, int(value[4:])))
+            if isinstance(value, str) and value.startswith('str:') else value
+            for key, value in record['query'].items()
+        }
+        url = TARGET + path + (f'?{urlencode(query)}' if query else '')
+
+        body = build(record['body'], rng, mapper) if record.get('body') is not None else None
+        if endpoint == 'auth.register' and isinstance(body, dict):
+            body['email'] = f'replay-new-{run_id}-{n}@example.com'
+            body['password'] = PASSWORD
+        requests.append(((record['t'] - start) / SPEEDUP, endpoint, record['method'], url, headers, body, record.get('ms')))
+    return requests
+
+async def replay(requests):
+    import httpx
+
+    results = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        async def send(due, started, endpoint, method, url, headers, body, captured_ms):
+            async with semaphore:
+                sent = time.perf_counter()
+                try:
+                    response = await client.request(method, url, headers=headers, json=body)
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                results.append({
+                    'endpoint': endpoint,
+                    'status': status,
+                    'ms': (time.perf_counter() - sent) * 1000,
+                    'lag_ms': (sent - started - due) * 1000,
+                    'captured_ms': captured_ms
+                })
+
+        started = time.perf_counter()
+        tasks = []
+        for request in requests:
+            delay = request[0] - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(request[0], started, *request[1:])))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+def percentile(values, q):
+    values = sorted(value for value in values if value is not None)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+def summarize(results, elapsed, requests):
+    by_endpoint = {}
+    for result in results:
+        by_endpoint.setdefault(result['endpoint'], []).append(result)
+    return {
+        'target': TARGET,
+        'speedup': SPEEDUP,
+        'requests': len(results),
+        'elapsed_s': round(elapsed, 3),
+        'scheduled_s': round(requests[-1][0], 3) if requests else 0,
+        'rps': round(len(results) / elapsed, 1) if elapsed else 0,
+        'lag_p99_ms': round(percentile([r['lag_ms'] for r in results], 0.99) or 0, 1),
+        'lag_max_ms': round(max((r['lag_ms'] for r in results), default=0), 1),
+        'endpoints': {
+            endpoint: {
+                'count': len(rows),
+                'p50_ms': round(percentile([r['ms'] for r in rows], 0.5), 1),
+                'p95_ms': round(percentile([r['ms'] for r in rows], 0.95), 1),
+                'p99_ms': round(percentile([r['ms'] for r in rows], 0.99), 1),
+                'captured_p50_ms': percentile([r['captured_ms'] for r in rows], 0.5),
+                'client_errors': sum(1 for r in rows if 400 <= r['status'] < 500),
+                'server_errors': sum(1 for r in rows if r['status'] >= 500 or r['status'] == 0)
+            }
+            for endpoint, rows in sorted(by_endpoint.items(), key=lambda item: -len(item[1]))
+        }
+    }
+
+def print_summary(summary):
+    print(f"{summary['requests']} requests in {summary['elapsed_s']}s (scheduled {summary['scheduled_s']}s, "
+          f"x{summary['speedup']:g}) against {summary['target']}: {summary['rps']} req/s, "
+          f"send lag p99 {summary['lag_p99_ms']}ms, max {summary['lag_max_ms']}ms")
+    print(f"{'endpoint':<36} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'capt p50':>9} {'4xx':>6} {'5xx':>6}")
+    for endpoint, row in summary['endpoints'].items():
+        captured = f"{row['captured_p50_ms']:.1f}" if row['captured_p50_ms'] is not None else '-'
+        print(f"{endpoint:<36} {row['count']:>7} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} "
+              f"{captured:>9} {row['client_errors']:>6} {row['server_errors']:>6}")
+
+if __name__ == '__main__':
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not paths:
+        sys.exit(__doc__)
+    records = load(paths)
+    if not records:
+        sys.exit('No requests to replay')
+
+    requests = prepare(records, seed())
+    results, elapsed = asyncio.run(replay(requests))
+    summary = summarize(results, elapsed, requests)
+    if '--json' in sys.argv:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
@@ -0,0 +1,65 @@
+"""
+Gunicorn configuration for SaveTogether Backend
+
+    gunicorn -c gunicorn.conf.py
+
+With GUNICORN_PRELOAD=true the app is imported and built once in the master
+and forked into the workers, so a worker boot only pays for the warm-up; the
+inherited database connections are discarded after the fork. Every worker
+opens its pool and compiles the hot queries in post_worker_init, before it
+accepts its first request.
+
+Workers are recycled after GUNICORN_MAX_REQUESTS requests (with jitter), and
+after any request that leaves them above WORKER_MAX_RSS_MB of resident
+memory, so a leak is contained to one worker's lifetime.
+"""
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'False').lower() == 'true'
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+max_rss_mb = int(os.getenv('WORKER_MAX_RSS_MB', 0))
+rss_check_every = int(os.getenv('WORKER_RSS_CHECK_EVERY', 20))  # Requests between RSS checks
+
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+pythonpath = chdir
+wsgi_app = 'main:app'
+
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the workers
+    if preload_app:
+        from main import get_app
+        from services.database_service import db
+        with get_app().app_context():
+            db.engine.dispose(close=False)
+
+def post_worker_init(worker):
+    from main import get_app
+    from services.warmup_service import warm_up
+    timings = warm_up(get_app())
+    worker.log.info(f"Worker {worker.pid} warmed up in {sum(timings.values()):.3f}s: {timings}")
+
+def worker_exit(server, worker):
+    # Write buffered last_login timestamps before the worker goes away
+    from services.write_behind_service import flush_pending
+    flushed = flush_pending()
+    if flushed:
+        worker.log.info(f"Worker {worker.pid} wrote {flushed} buffered timestamps on exit")
+
+def post_request(worker, req, environ, resp):
+    if not max_rss_mb or worker.nr % rss_check_every:
+        return
+    from services.memory_service import rss_bytes
+    rss_mb = rss_bytes() / 1048576
+    if rss_mb > max_rss_mb and worker.alive:
+        # Finish in-flight requests and exit; the arbiter starts a fresh worker
+        worker.log.warning(f"Worker {worker.pid} at {rss_mb:.0f}MB RSS (limit {max_rss_mb}MB) after {worker.nr} requests; recycling")
+        worker.alive = False
@@ -17,22 +17,42 @@ print("=" * 60)
 print("🗄️  Initializing SaveTogether Database")
 print("=" * 60)
 
-from main import app
+from main import get_app
 from services.database_service import db
 
 # Import all models to ensure they're registered
 from models.user import User
 from models.stockvel import Stockvel, StockvelMember, Contribution
+from models.job import Job
+from models.token_revocation import TokenRevocation
+from models.activity_event import ActivityEvent
+from models.idempotency_key import IdempotencyKey
+from models.stockvel_archive import StockvelArchive, ArchivedStockvelMember
+from models.outbound_email import OutboundEmail
+from models.stats_snapshot import StatsSnapshot
+from models.identity_invalidation import IdentityInvalidation
+from models.schema_migration import SchemaMigration
 
 if __name__ == '__main__':
+    app = get_app()
     with app.app_context():
+        from sqlalchemy import inspect
+        fresh = not inspect(db.engine).has_table('users')
+
         print("Creating all database tables...")
         db.create_all()
         print("✅ All tables created successfully!")
+
+        # create_all builds the current schema, so a new database has nothing to migrate
+        if fresh:
+            from services.migration_service import MigrationRunner
+            versions = MigrationRunner(db.engine, app.config).baseline()
+            print(f"✅ Recorded migrations {', '.join(versions)} as applied")
+        else:
+            print("ℹ️  Existing database: run `python migrate.py up` to apply pending migrations")
         
         # List all tables
         try:
-            from sqlalchemy import inspect
             inspector = inspect(db.engine)
             tables = inspector.get_table_names()
             
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Apply the versioned migrations in migrations/ (see src/services/migration_service.py)
+
+    python migrate.py                   show which migrations have run
+    python migrate.py up [VERSION]      apply pending migrations (up to VERSION)
+    python migrate.py baseline [VERSION]  record migrations as applied without running them
+"""
+import os
+import sys
+
+# Add the src directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+if not os.getenv('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = 'postgresql://savetogether_user:savetogetherwithabsa@db:5432/savetogether'
+
+def print_status(runner):
+    for row in runner.status():
+        notes = []
+        if not row['applies']:
+            notes.append(f'not for {runner.dialect}')
+        if not row['transactional']:
+            notes.append('no transaction')
+        if row['changed']:
+            notes.append('FILE CHANGED SINCE IT RAN')
+        applied_at = row['applied_at'].strftime('%Y-%m-%d %H:%M') if row['applied_at'] else ''
+        print(f"  {row['version']}  {row['state']:<9} {applied_at:<16}  {row['name']}" + (f"  ({', '.join(notes)})" if notes else ''))
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    target = sys.argv[2] if len(sys.argv) > 2 else None
+    if command not in ('status', 'up', 'baseline'):
+        print(__doc__)
+        sys.exit(2)
+
+    from main import get_app
+    from services.database_service import db
+    from services.migration_service import MigrationRunner
+
+    app = get_app()
+    with app.app_context():
+        runner = MigrationRunner(db.engine, app.config)
+        if command == 'up':
+            done = runner.upgrade(target)
+            print(f"✅ {len(done)} migration(s) run" if done else "✅ Nothing to migrate")
+        elif command == 'baseline':
+            done = runner.baseline(target)
+            print(f"✅ Recorded {len(done)} migration(s) as applied: {', '.join(done) or '-'}")
+        print_status(runner)
@@ -1,3 +1,4 @@
+-- migrate: postgresql
 -- Add CASCADE DELETE to foreign key constraints
 -- This ensures that when a user is deleted, their memberships and contributions are also deleted
 
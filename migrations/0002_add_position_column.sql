@@ -1,3 +1,4 @@
+-- migrate: postgresql
 -- Add position column to stockvel_members table for member ordering
 -- This allows admins to set and persist the payout rotation order
 
@@ -16,20 +17,4 @@ BEGIN
     END IF;
 END $$;
 
--- Initialize positions based on joined_at for existing members
--- This ensures existing stockvels have a default order
-WITH ranked_members AS (
-    SELECT id, 
-           ROW_NUMBER() OVER (PARTITION BY stockvel_id ORDER BY joined_at ASC) - 1 as pos
-    FROM stockvel_members
-    WHERE position IS NULL
-)
-UPDATE stockvel_members sm
-SET position = rm.pos
-FROM ranked_members rm
-WHERE sm.id = rm.id;
-
--- Verify the migration
-SELECT 'Migration completed. Updated ' || COUNT(*) || ' members with positions' 
-FROM stockvel_members 
-WHERE position IS NOT NULL;
+-- Existing members get their positions from 0003_backfill_member_positions.py, in batches of groups
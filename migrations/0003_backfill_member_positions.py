@@ -0,0 +1,27 @@
+"""
+Give existing members without a payout position one, by join date within each group.
+
+Runs over ranges of stockvel_id, one short transaction per range. Only rows
+whose position is NULL are written: they are numbered after the group's
+highest existing position, so positions admins have already set, and those of
+members who joined since (services/membership_service.add_member_if_room
+assigns one on join), are kept, and a resumed run has nothing left to redo.
+"""
+TRANSACTIONAL = False
+
+BACKFILL = """
+    WITH ranked AS (
+        SELECT m.id,
+               COALESCE(MAX(m.position) OVER (PARTITION BY m.stockvel_id), -1)
+               + ROW_NUMBER() OVER (PARTITION BY m.stockvel_id, m.position IS NULL ORDER BY m.joined_at ASC, m.id ASC) AS pos,
+               m.position
+        FROM stockvel_members m
+        WHERE m.stockvel_id > :lo AND m.stockvel_id <= :hi
+    )
+    UPDATE stockvel_members SET position = ranked.pos
+    FROM ranked
+    WHERE stockvel_members.id = ranked.id AND ranked.position IS NULL
+"""
+
+def upgrade(migration):
+    migration.backfill('positions', 'stockvel_members', BACKFILL, key='stockvel_id', batch_size=500)
@@ -0,0 +1,52 @@
+-- migrate: postgresql
+-- Add CASCADE DELETE to the stockvel foreign keys
+-- Complements 0001_add_cascade_delete.sql so deleting a stockvel also removes its members and contributions
+-- The admin purge endpoints delete children in batches first; the cascade only catches stragglers
+-- The indexes are built CONCURRENTLY, so the file runs outside a transaction (see services/migration_service.py);
+-- the constraint swap is its own transaction so the foreign keys are never missing
+
+BEGIN;
+
+-- Drop existing foreign key constraints
+ALTER TABLE stockvel_members DROP CONSTRAINT IF EXISTS stockvel_members_stockvel_id_fkey;
+ALTER TABLE contributions DROP CONSTRAINT IF EXISTS contributions_stockvel_id_fkey;
+
+-- Recreate with CASCADE DELETE
+ALTER TABLE stockvel_members 
+ADD CONSTRAINT stockvel_members_stockvel_id_fkey 
+FOREIGN KEY (stockvel_id) REFERENCES stockvels(id) ON DELETE CASCADE;
+
+ALTER TABLE contributions 
+ADD CONSTRAINT contributions_stockvel_id_fkey 
+FOREIGN KEY (stockvel_id) REFERENCES stockvels(id) ON DELETE CASCADE;
+
+COMMIT;
+
+-- Index the foreign keys so batched deletes and cascades don't scan the tables,
+-- without locking them against writes while they build. A failed build leaves an INVALID index that
+-- IF NOT EXISTS would keep, so drop any such index before retrying
+DO $$
+DECLARE
+    invalid TEXT;
+BEGIN
+    FOR invalid IN
+        SELECT indexrelid::regclass::text FROM pg_index
+        WHERE NOT indisvalid AND indexrelid::regclass::text IN (
+            'ix_contributions_stockvel_id', 'ix_contributions_user_id', 'ix_stockvel_members_user_id'
+        )
+    LOOP
+        EXECUTE format('DROP INDEX %s', invalid);
+    END LOOP;
+END $$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_contributions_stockvel_id ON contributions (stockvel_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_contributions_user_id ON contributions (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_stockvel_members_user_id ON stockvel_members (user_id);
+
+-- Verify constraints
+SELECT 
+    conname AS constraint_name,
+    conrelid::regclass AS table_name,
+    confdeltype AS delete_action
+FROM pg_constraint
+WHERE conname IN ('stockvel_members_stockvel_id_fkey', 'contributions_stockvel_id_fkey');
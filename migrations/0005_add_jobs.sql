@@ -0,0 +1,23 @@
+-- migrate: postgresql
+-- Background jobs enqueued by the app and run by run_worker.py (services/job_service.py)
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    payload TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_by VARCHAR(100),
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    result TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Workers claim queued jobs by priority and due time
+CREATE INDEX IF NOT EXISTS ix_jobs_dequeue ON jobs (status, priority, run_at);
@@ -0,0 +1,9 @@
+-- migrate: postgresql
+-- Admin statistics computed by one process at a time and shared by all of them (services/stats_service.py)
+
+CREATE TABLE IF NOT EXISTS stats_snapshots (
+    name VARCHAR(50) PRIMARY KEY,
+    body TEXT NOT NULL,
+    computed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    refreshing_since TIMESTAMP
+);
@@ -0,0 +1,11 @@
+-- migrate: postgresql
+-- Identity cache invalidations, so a purge or membership change in one process reaches every worker's cache
+-- Workers read rows after the last id they saw every IDENTITY_SYNC_INTERVAL seconds (services/identity_service.py)
+
+CREATE TABLE IF NOT EXISTS identity_invalidations (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_identity_invalidations_created_at ON identity_invalidations (created_at);
@@ -0,0 +1,16 @@
+-- migrate: postgresql
+-- Revoked access tokens and revoke-all cutoffs, mirrored into each worker's index (services/revocation_service.py)
+-- Rows are compacted away by the revocation.compact job once the tokens they cover have expired
+
+CREATE TABLE IF NOT EXISTS token_revocations (
+    id SERIAL PRIMARY KEY,
+    jti VARCHAR(64),
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    revoked_before TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_token_revocations_jti ON token_revocations (jti);
+CREATE INDEX IF NOT EXISTS ix_token_revocations_user_id ON token_revocations (user_id);
+CREATE INDEX IF NOT EXISTS ix_token_revocations_expires_at ON token_revocations (expires_at);
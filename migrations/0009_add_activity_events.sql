@@ -0,0 +1,18 @@
+-- migrate: postgresql
+-- Activity events for the server-sent event streams (/api/stockvels/<id>/events and /api/stockvels/events)
+-- Rows are written in the same transaction as the change they describe and announced with pg_notify('activity_events', ...)
+-- The id doubles as the SSE event id clients resume from with Last-Event-ID
+
+CREATE TABLE IF NOT EXISTS activity_events (
+    id SERIAL PRIMARY KEY,
+    stockvel_id INTEGER NOT NULL REFERENCES stockvels(id) ON DELETE CASCADE,
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    type VARCHAR(50) NOT NULL,
+    data TEXT,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Replay after Last-Event-ID per group, the per-user feed, and retention cleanup
+CREATE INDEX IF NOT EXISTS ix_activity_events_stockvel_id_id ON activity_events (stockvel_id, id);
+CREATE INDEX IF NOT EXISTS ix_activity_events_user_id ON activity_events (user_id);
+CREATE INDEX IF NOT EXISTS ix_activity_events_created_at ON activity_events (created_at);
@@ -0,0 +1,21 @@
+-- migrate: postgresql
+-- Idempotency-Key storage for make_contribution, create_stockvel and the join routes
+-- A retried request with the same key replays the stored response instead of writing again
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    key VARCHAR(255) NOT NULL,
+    fingerprint VARCHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'in_progress',
+    locked_until TIMESTAMP,
+    response_status INTEGER,
+    response_body TEXT,
+    response_mimetype VARCHAR(100),
+    created_at TIMESTAMP DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL,
+    CONSTRAINT unique_idempotency_key UNIQUE (user_id, key)
+);
+
+-- Expired keys are deleted in batches by the idempotency.compact job
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at);
@@ -0,0 +1,74 @@
+-- migrate: postgresql, no-transaction
+-- Convert contributions into a table range-partitioned by month on contribution_date (PostgreSQL 12+)
+-- Partitions are named contributions_pYYYYMM, with contributions_default catching anything outside them;
+-- the partitions.maintain job keeps creating the upcoming months (services/partition_service.py)
+-- Rows are copied into the new table in one transaction; run it in a maintenance window
+-- The file manages its own transaction, so the runner sends its statements one at a time (no-transaction)
+
+BEGIN;
+
+-- The partition key is part of the primary key, so check the existing rows first
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM contributions WHERE contribution_date IS NULL) THEN
+        RAISE EXCEPTION 'contributions with a NULL contribution_date must be dated before partitioning';
+    END IF;
+END $$;
+
+ALTER TABLE contributions RENAME TO contributions_unpartitioned;
+ALTER TABLE contributions_unpartitioned RENAME CONSTRAINT contributions_pkey TO contributions_unpartitioned_pkey;
+DROP INDEX IF EXISTS ix_contributions_stockvel_id;
+DROP INDEX IF EXISTS ix_contributions_user_id;
+DROP INDEX IF EXISTS ix_contributions_stockvel_id_contribution_date;
+
+CREATE TABLE contributions (
+    id INTEGER NOT NULL DEFAULT nextval('contributions_id_seq'),
+    stockvel_id INTEGER NOT NULL REFERENCES stockvels(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    amount NUMERIC(10, 2) NOT NULL,
+    contribution_date TIMESTAMP NOT NULL,
+    description VARCHAR(255),
+    payment_method VARCHAR(50),
+    status VARCHAR(20),
+    PRIMARY KEY (id, contribution_date)
+) PARTITION BY RANGE (contribution_date);
+
+-- Keep the existing id sequence; it would otherwise be dropped with the old table
+ALTER SEQUENCE contributions_id_seq OWNED BY contributions.id;
+
+CREATE TABLE contributions_default PARTITION OF contributions DEFAULT;
+
+-- One partition per month from the oldest contribution to three months ahead
+DO $$
+DECLARE
+    first_day DATE;
+BEGIN
+    FOR first_day IN
+        SELECT generate_series(
+            date_trunc('month', LEAST(COALESCE(bounds.oldest, NOW()), NOW())),
+            date_trunc('month', NOW()) + INTERVAL '3 months',
+            INTERVAL '1 month'
+        )::date
+        FROM (SELECT MIN(contribution_date) AS oldest FROM contributions_unpartitioned) bounds
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF contributions FOR VALUES FROM (%L) TO (%L)',
+            'contributions_p' || to_char(first_day, 'YYYYMM'), first_day, first_day + INTERVAL '1 month'
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO contributions (id, stockvel_id, user_id, amount, contribution_date, description, payment_method, status)
+SELECT id, stockvel_id, user_id, amount, contribution_date, description, payment_method, status
+FROM contributions_unpartitioned;
+
+-- Created on the parent, so every partition gets them, including future ones
+CREATE INDEX ix_contributions_stockvel_id ON contributions (stockvel_id);
+CREATE INDEX ix_contributions_user_id ON contributions (user_id);
+CREATE INDEX ix_contributions_stockvel_id_contribution_date ON contributions (stockvel_id, contribution_date);
+
+DROP TABLE contributions_unpartitioned;
+
+COMMIT;
+
+ANALYZE contributions;
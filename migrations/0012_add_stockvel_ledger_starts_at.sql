@@ -0,0 +1,24 @@
+-- migrate: postgresql
+-- Each stockvel's earliest contribution_date, the lower bound ledger queries put on contribution_date
+-- so the partitioned contributions table is pruned to the group's months (services/serialization_service.py)
+-- A trigger keeps it at or before every contribution however the row is written; the same trigger is
+-- declared on the model for databases created with create_all (models/stockvel.py)
+
+ALTER TABLE stockvels ADD COLUMN IF NOT EXISTS ledger_starts_at TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION contributions_extend_ledger_start() RETURNS trigger AS $$
+BEGIN
+    UPDATE stockvels SET ledger_starts_at = NEW.contribution_date
+    WHERE id = NEW.stockvel_id AND (ledger_starts_at IS NULL OR ledger_starts_at > NEW.contribution_date);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS contributions_extend_ledger_start ON contributions;
+CREATE TRIGGER contributions_extend_ledger_start
+    AFTER INSERT OR UPDATE OF contribution_date, stockvel_id ON contributions
+    FOR EACH ROW EXECUTE FUNCTION contributions_extend_ledger_start();
+
+-- Existing rows, after the trigger is in place so nothing written meanwhile is missed
+UPDATE stockvels SET ledger_starts_at = LEAST(COALESCE(stockvels.ledger_starts_at, bounds.oldest), bounds.oldest)
+FROM (SELECT stockvel_id, MIN(contribution_date) AS oldest FROM contributions GROUP BY stockvel_id) bounds
+WHERE bounds.stockvel_id = stockvels.id;
@@ -0,0 +1,33 @@
+-- migrate: postgresql
+-- Archive of closed stockvels (inactive, or ended more than ARCHIVE_AFTER_DAYS ago)
+-- Each row is a tombstone with the group, members and contributions packed as gzip-compressed JSON in payload;
+-- the live rows are deleted in the same transaction (services/archive_service.py)
+
+CREATE TABLE IF NOT EXISTS stockvel_archives (
+    id SERIAL PRIMARY KEY,
+    stockvel_id INTEGER NOT NULL UNIQUE,
+    name VARCHAR(100) NOT NULL,
+    admin_user_id INTEGER,
+    status VARCHAR(20),
+    reason VARCHAR(20) NOT NULL,
+    start_date TIMESTAMP,
+    end_date TIMESTAMP,
+    member_count INTEGER NOT NULL DEFAULT 0,
+    contribution_count INTEGER NOT NULL DEFAULT 0,
+    total_contributed NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    archived_at TIMESTAMP DEFAULT NOW(),
+    restored_at TIMESTAMP,
+    payload BYTEA NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_stockvel_archives_archived_at ON stockvel_archives (archived_at);
+
+-- Lets members list and read the groups they belonged to
+CREATE TABLE IF NOT EXISTS stockvel_archive_members (
+    id SERIAL PRIMARY KEY,
+    archive_id INTEGER NOT NULL REFERENCES stockvel_archives(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_stockvel_archive_members_archive_id ON stockvel_archive_members (archive_id);
+CREATE INDEX IF NOT EXISTS ix_stockvel_archive_members_user_id ON stockvel_archive_members (user_id);
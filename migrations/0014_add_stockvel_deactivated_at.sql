@@ -0,0 +1,7 @@
+-- migrate: postgresql
+-- When a stockvel was deactivated; archiving waits ARCHIVE_AFTER_DAYS from it (services/archive_service.py)
+-- Groups already inactive get the full grace period from now
+
+ALTER TABLE stockvels ADD COLUMN IF NOT EXISTS deactivated_at TIMESTAMP;
+
+UPDATE stockvels SET deactivated_at = NOW() WHERE is_active = FALSE AND deactivated_at IS NULL;
@@ -0,0 +1,23 @@
+-- migrate: postgresql
+-- Outbox of contribution receipts and payout reminders, sent in batches by the mail.deliver job (services/mail_service.py)
+
+CREATE TABLE IF NOT EXISTS outbound_emails (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    user_id INTEGER,
+    recipient VARCHAR(120) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    dedup_key VARCHAR(200) UNIQUE,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    send_after TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_by VARCHAR(100),
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_outbound_emails_user_id ON outbound_emails (user_id);
+CREATE INDEX IF NOT EXISTS ix_outbound_emails_dequeue ON outbound_emails (status, send_after);
@@ -0,0 +1,5 @@
+-- migrate: postgresql
+-- A key a queued job holds so the same work isn't queued twice, e.g. one pending mail.deliver (services/job_service.py)
+-- Cleared when a worker claims or an admin cancels the job
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS dedup_key VARCHAR(200) UNIQUE;
@@ -39,7 +39,13 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 # Now import and run the app
 if __name__ == '__main__':
-    from main import app
+    from main import get_app
+    app = get_app()
+    
+    # Open connections and compile the hot queries before taking traffic
+    if app.config.get('STARTUP_WARMUP'):
+        from services.warmup_service import warm_up
+        warm_up(app)
     
     # Run the Flask app
     app.run(
@@ -0,0 +1,585 @@
+"""
+ASGI entry point with an asyncio read path.
+
+The read-heavy GET endpoints (stockvel list/detail, members, contributions
+and the profile) are served here with async SQLAlchemy sessions, so a
+worker keeps serving other connections while it waits on the database.
+They run the same statements (serialization_service), JWT validation,
+revocation index and identity cache as the Flask blueprints and return the
+same JSON. The activity event streams (server-sent events) are served
+here as well, where an idle stream costs a queue instead of a thread.
+Every other request is handed to the Flask app through asgiref's WSGI
+adapter.
+
+The native routes still run inside a Flask request context built from the
+ASGI scope, with the app's before_request, after_request and teardown
+hooks: rate limiting and load shedding, request logging, traffic capture,
+profiling, compression and CORS apply exactly as on the WSGI path, and the
+slow-query log (an Engine-level listener) times the async engine's
+statements too. Event streams run the before_request hooks when they open
+(limits, logging), and the teardown hooks before they start streaming, so
+a long-lived stream holds no load-shedding slot; they are not captured and
+their profile only covers opening the stream.
+
+    uvicorn asgi:app --app-dir src
+"""
+from main import get_app
+from services.identity_service import current_user_query, build_current_user, get_cache, sync_invalidations
+from services.revocation_service import is_token_revoked, sync_revocations
+from services.serialization_service import (
+    member_count_query, current_total_query, user_totals_query, joined_group_ids_query,
+    members_query, users_query, member_totals_query, user_stockvels_query, membership_query,
+    roster_query, roster_entry, contributions_query, contribution_entry,
+    empty_aggregates, build_members, serialize_stockvels, serialize_users, add_user_totals,
+    USER_TOTAL_FIELDS
+)
+from services.event_service import (
+    get_broker, AsyncSubscription, CLOSED, events_after_query, format_event, parse_last_event_id, stream_settings
+)
+from models.stockvel import Stockvel
+from middleware.compression import available_encodings, compress
+from utils.fieldsets import parse_fieldset
+from asgiref.wsgi import WsgiToAsgi
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.http import parse_accept_header
+from urllib.parse import parse_qsl
+from io import BytesIO
+from decimal import Decimal
+import asyncio
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+def async_database_url(config):
+    """ASYNC_DATABASE_URL, or the sync database URL with its async driver"""
+    if config.get('ASYNC_DATABASE_URL'):
+        return config['ASYNC_DATABASE_URL']
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {backend}; set ASYNC_DATABASE_URL')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+def create_engine_for(config):
+    url = async_database_url(config)
+    options = {'pool_pre_ping': True}
+    if make_url(url).get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=config.get('ASYNC_POOL_SIZE', 20),
+            max_overflow=config.get('ASYNC_MAX_OVERFLOW', 10),
+            pool_recycle=300
+        )
+    return create_async_engine(url, **options)
+
+def wsgi_environ(scope):
+    """A WSGI environ for a bodiless ASGI request, so Flask can build a request context for it"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_NAME': scope['server'][0] if scope.get('server') else 'localhost',
+        'SERVER_PORT': str(scope['server'][1]) if scope.get('server') else '80',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+class HTTPError(Exception):
+    def __init__(self, status, body):
+        super().__init__(str(body))
+        self.status = status
+        self.body = body
+
+class AuthError(HTTPError):
+    """Mirrors the JWT error callbacks registered in main.create_app"""
+
+    def __init__(self, status, message, error):
+        super().__init__(status, {'message': message, 'error': error})
+
+class Request:
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']])
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.path_params = {}
+        self.user = None
+
+# Loaders: async versions of serialization_service's batched loaders
+
+async def load_aggregates(session, stockvel_ids, fieldset):
+    aggregates = empty_aggregates(stockvel_ids, fieldset)
+    if stockvel_ids and fieldset.wants('member_count'):
+        for stockvel_id, count in await session.execute(member_count_query(stockvel_ids)):
+            aggregates[stockvel_id]['member_count'] = count
+    if stockvel_ids and fieldset.wants('current_total'):
+        for stockvel_id, total in await session.execute(current_total_query(stockvel_ids)):
+            aggregates[stockvel_id]['current_total'] = total or Decimal('0')
+    return aggregates
+
+async def load_members(session, stockvel_ids):
+    if not stockvel_ids:
+        return {}
+    members = (await session.execute(members_query(stockvel_ids))).scalars().all()
+
+    user_ids = list({m.user_id for m in members})
+    users = (await session.execute(users_query(user_ids))).scalars().all() if user_ids else []
+    joined = {user_id: [] for user_id in user_ids}
+    if user_ids:
+        for user_id, stockvel_id in await session.execute(joined_group_ids_query(user_ids)):
+            joined[user_id].append(stockvel_id)
+    user_dicts = {user.id: data for user, data in zip(users, serialize_users(users, joined=joined))}
+
+    totals = {
+        (stockvel_id, user_id): total
+        for stockvel_id, user_id, total in await session.execute(member_totals_query(stockvel_ids))
+    }
+    return build_members(stockvel_ids, members, user_dicts, totals)
+
+async def serialize(session, stockvels, fieldset, default_include=()):
+    stockvel_ids = [stockvel.id for stockvel in stockvels]
+    aggregates = await load_aggregates(session, stockvel_ids, fieldset)
+
+    admins = None
+    if fieldset.includes('admin', 'admin' in default_include):
+        admin_ids = list({stockvel.admin_user_id for stockvel in stockvels})
+        admins = {user.id: user for user in (await session.execute(users_query(admin_ids))).scalars()} if admin_ids else {}
+
+    members = None
+    if fieldset.includes('members', 'members' in default_include):
+        members = await load_members(session, stockvel_ids)
+
+    return serialize_stockvels(stockvels, fieldset, default_include, aggregates=aggregates, admins=admins, members=members)
+
+async def is_member(session, stockvel_id, user_id):
+    return (await session.execute(membership_query(stockvel_id, user_id))).first() is not None
+
+# Handlers: same responses as the matching routes in routes/stockvels.py, auth.py and users.py
+
+async def get_stockvels(request, session):
+    fieldset = parse_fieldset(request.args)
+    stockvels = (await session.execute(user_stockvels_query(request.user.id))).scalars().all()
+    stockvels_data = await serialize(session, stockvels, fieldset)
+
+    if stockvels and any(fieldset.wants(field) for field in USER_TOTAL_FIELDS):
+        user_totals = dict((await session.execute(
+            user_totals_query([s.id for s in stockvels], request.user.id)
+        )).all())
+        add_user_totals(stockvels, stockvels_data, user_totals, fieldset)
+
+    return 200, {'stockvels': stockvels_data}
+
+async def get_stockvel(request, session):
+    stockvel_id = request.path_params['stockvel_id']
+    if not await is_member(session, stockvel_id, request.user.id):
+        return 403, {'error': 'Access denied'}
+
+    stockvel = await session.get(Stockvel, stockvel_id)
+    if not stockvel:
+        return 404, {'error': 'Stockvel not found'}
+
+    result = (await serialize(session, [stockvel], parse_fieldset(request.args), default_include=('members',)))[0]
+    return 200, {'stockvel': result}
+
+async def get_members(request, session):
+    stockvel_id = request.path_params['stockvel_id']
+    if not await is_member(session, stockvel_id, request.user.id):
+        return 403, {'error': 'Access denied'}
+
+    if not await session.get(Stockvel, stockvel_id):
+        return 404, {'error': 'Stockvel not found'}
+
+    members_data = [roster_entry(*row) for row in await session.execute(roster_query(stockvel_id))]
+    return 200, {'members': members_data}
+
+async def get_contributions(request, session):
+    stockvel_id = request.path_params['stockvel_id']
+    if not await is_member(session, stockvel_id, request.user.id):
+        return 403, {'error': 'Access denied'}
+
+    contributions_data = [contribution_entry(*row) for row in await session.execute(contributions_query(stockvel_id))]
+    return 200, {'contributions': contributions_data}
+
+async def get_auth_profile(request, session):
+    return 200, request.user.to_dict(fields=parse_fieldset(request.args).fields)
+
+async def get_users_profile(request, session):
+    return 200, {'user': request.user.to_dict(fields=parse_fieldset(request.args).fields)}
+
+# Event streams: resolve what a stream follows, same checks as the SSE routes in routes/stockvels.py
+
+async def stockvel_stream(request, session):
+    stockvel_id = request.path_params['stockvel_id']
+    if not await is_member(session, stockvel_id, request.user.id):
+        raise HTTPError(403, {'error': 'Access denied'})
+    return [stockvel_id], None
+
+async def user_stream(request, session):
+    return request.user.joined_group_ids, request.user.id
+
+def _error(label):
+    return lambda e: {'error': label, 'details': str(e)}
+
+# (pattern, handler, error body for unexpected exceptions); GET only
+ROUTES = [
+    (r'/api/stockvels/?', get_stockvels, _error('Failed to get stockvels')),
+    (r'/api/stockvels/(?P<stockvel_id>\d+)', get_stockvel, _error('Failed to get stockvel')),
+    (r'/api/stockvels/(?P<stockvel_id>\d+)/members', get_members, _error('Failed to get members')),
+    (r'/api/stockvels/(?P<stockvel_id>\d+)/contributions', get_contributions, _error('Failed to get contributions')),
+    (r'/api/auth/profile', get_auth_profile, lambda e: {'message': f'An error occurred: {str(e)}'}),
+    (r'/api/users/profile', get_users_profile, _error('Failed to get profile')),
+]
+
+# (pattern, scope resolver); GET only, matched before ROUTES
+STREAM_ROUTES = [
+    (r'/api/stockvels/(?P<stockvel_id>\d+)/events', stockvel_stream),
+    (r'/api/stockvels/events', user_stream),
+]
+
+class AsyncReadApp:
+    """Serve ROUTES and STREAM_ROUTES natively and delegate everything else to Flask"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.routes = [(re.compile(pattern + '$'), handler, on_error) for pattern, handler, on_error in ROUTES]
+        self.stream_routes = [(re.compile(pattern + '$'), resolve) for pattern, resolve in STREAM_ROUTES]
+        self.stream_settings = stream_settings(self.config)
+        self.engine = None
+        self.sessions = None
+        self._revocation_task = None
+        self._identity_task = None
+        self._started = None
+
+        with flask_app.app_context():
+            self.identity_cache = get_cache()
+
+        cors_origins = self.config.get('CORS_ORIGINS', '')
+        if isinstance(cors_origins, str):
+            cors_origins = cors_origins.split(',') if cors_origins else []
+        self.cors_origins = set(cors_origins)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, resolve in self.stream_routes:
+                match = pattern.match(scope['path'])
+                if match:
+                    return await self.handle_stream(scope, receive, send, match, resolve)
+            for pattern, handler, on_error in self.routes:
+                match = pattern.match(scope['path'])
+                if match:
+                    return await self.handle(scope, send, match, handler, on_error)
+
+        return await self.wsgi(scope, receive, send)
+
+    # Startup / shutdown
+
+    async def startup(self):
+        """Create the engine and load the revocation index; runs once per process"""
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._startup())
+        await asyncio.shield(self._started)
+
+    async def _startup(self):
+        self.engine = create_engine_for(self.config)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        with self.flask_app.app_context():
+            self.broker = get_broker()
+        if self.config.get('JWT_BLACKLIST_ENABLED'):
+            await asyncio.to_thread(self._sync_revocations, True)
+            self._revocation_task = asyncio.create_task(self._revocation_loop())
+        self._identity_task = asyncio.create_task(self._identity_loop())
+        if self.config.get('STARTUP_WARMUP'):
+            await self._warm_up()
+
+    async def _warm_up(self):
+        """Warm the Flask side's pool and query cache, then open the async pool's connections"""
+        from services.warmup_service import warm_up
+        await asyncio.to_thread(warm_up, self.flask_app)
+        size = self.config.get('WARMUP_POOL_CONNECTIONS') or getattr(self.engine.pool, 'size', lambda: 1)()
+        connections = []
+        try:
+            for _ in range(size):
+                connection = await self.engine.connect()
+                await connection.execute(text('SELECT 1'))
+                connections.append(connection)
+        except Exception as e:
+            logger.warning(f"Async pool warm-up failed: {str(e)}")
+        finally:
+            for connection in connections:
+                await connection.close()
+
+    async def shutdown(self):
+        if self._revocation_task:
+            self._revocation_task.cancel()
+        if self._identity_task:
+            self._identity_task.cancel()
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error(f"ASGI startup failed: {str(e)}", exc_info=True)
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _sync_revocations(self, force=False):
+        with self.flask_app.app_context():
+            sync_revocations(force=force)
+
+    async def _revocation_loop(self):
+        """Keep the revocation index fresh off the event loop, instead of syncing inside requests"""
+        interval = self.config.get('REVOCATION_SYNC_INTERVAL', 5)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self._sync_revocations)
+            except Exception as e:
+                logger.error(f"Revocation sync failed: {str(e)}", exc_info=True)
+
+    def _sync_identities(self):
+        with self.flask_app.app_context():
+            sync_invalidations(force=True)
+
+    async def _identity_loop(self):
+        """Apply identity invalidations from other processes (e.g. purges in the job worker)"""
+        interval = self.config.get('IDENTITY_SYNC_INTERVAL', 2) or 1
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self._sync_identities)
+            except Exception as e:
+                logger.error(f"Identity invalidation sync failed: {str(e)}", exc_info=True)
+
+    # Requests
+
+    async def handle(self, scope, send, match, handler, on_error):
+        await self.startup()
+        request = Request(scope)
+        request.path_params = {key: int(value) for key, value in match.groupdict().items()}
+        flask_app = self.flask_app
+
+        # The Flask request hooks run around the handler, as for any other request
+        context = flask_app.request_context(wsgi_environ(scope))
+        context.push()
+        error = None
+        try:
+            response = flask_app.preprocess_request()
+            if response is None:
+                try:
+                    async with self.sessions() as session:
+                        request.user = await self.authenticate(request, session)
+                        status, body = await handler(request, session)
+                except HTTPError as e:
+                    status, body = e.status, e.body
+                except Exception as e:
+                    logger.error(f"Error in {scope['path']}: {str(e)}", exc_info=True)
+                    status, body = 500, on_error(e)
+                response = flask_app.response_class(flask_app.json.dumps(body) + '\n', status=status, mimetype='application/json')
+            response = flask_app.process_response(flask_app.make_response(response))
+            data = response.get_data()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            context.pop(error)
+
+        await self.send_response(send, response, data)
+
+    async def send_response(self, send, response, data):
+        headers = [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response.headers.items()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': data})
+
+    def open_stream_request(self, scope):
+        """Run the before_request and teardown hooks for a stream; returns a Flask response when a hook refuses it"""
+        flask_app = self.flask_app
+        with flask_app.request_context(wsgi_environ(scope)):
+            response = flask_app.preprocess_request()
+            if response is None:
+                return None
+            response = flask_app.process_response(flask_app.make_response(response))
+            return response, response.get_data()
+
+    async def handle_stream(self, scope, receive, send, match, resolve):
+        """Server-sent events; an idle stream is a queue in the broker and holds no connection or thread"""
+        await self.startup()
+        request = Request(scope)
+        request.path_params = {key: int(value) for key, value in match.groupdict().items()}
+        settings = self.stream_settings
+        subscription = None
+
+        refused = self.open_stream_request(scope)
+        if refused is not None:
+            return await self.send_response(send, *refused)
+
+        try:
+            async with self.sessions() as session:
+                request.user = await self.authenticate(request, session)
+                stockvel_ids, user_id = await resolve(request, session)
+
+                # Subscribe before replaying so nothing committed in between is missed
+                subscription = AsyncSubscription(
+                    asyncio.get_running_loop(), stockvel_ids, user_id, maxsize=settings['queue_size'], viewer_id=request.user.id
+                )
+                self.broker.subscribe(subscription)
+
+                backlog = []
+                last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+                if last_event_id is not None:
+                    rows = (await session.execute(
+                        events_after_query(last_event_id, stockvel_ids, user_id, settings['replay_limit'])
+                    )).scalars().all()
+                    backlog = [row.to_dict() for row in rows]
+        except Exception as e:
+            if subscription is not None:
+                self.broker.unsubscribe(subscription)
+            if isinstance(e, HTTPError):
+                return await self.respond(request, send, e.status, e.body)
+            logger.error(f"Error opening event stream: {str(e)}", exc_info=True)
+            return await self.respond(request, send, 500, {'error': 'Failed to open event stream', 'details': str(e)})
+
+        try:
+            await self.stream(request, receive, send, subscription, backlog)
+        finally:
+            self.broker.unsubscribe(subscription)
+
+    async def stream(self, request, receive, send, subscription, backlog):
+        settings = self.stream_settings
+        dumps = self.flask_app.json.dumps
+        stream_task = asyncio.current_task()
+        disconnected = False
+
+        async def watch_disconnect():
+            nonlocal disconnected
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected = True
+            stream_task.cancel()
+
+        headers = [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ] + self.cors_headers(request)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            chunk = f"retry: {settings['retry']}\n\n" + ''.join(format_event(event, dumps) for event in backlog)
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            replayed = {event['id'] for event in backlog}
+
+            while not subscription.overflowed:
+                event = await subscription.get(settings['heartbeat'])
+                if event is CLOSED:
+                    break
+                if event is None:
+                    chunk = ': keepalive\n\n'
+                elif event['id'] in replayed:
+                    continue
+                else:
+                    chunk = format_event(event, dumps)
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+            await send({'type': 'http.response.body', 'body': b''})
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+        finally:
+            watcher.cancel()
+
+    async def authenticate(self, request, session):
+        """Same checks as @jwt_required plus the user lookup loader"""
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            raise AuthError(401, 'Authorization token is missing: Missing Authorization Header', 'missing_token')
+        parts = auth_header.split()
+        if len(parts) != 2 or parts[0] != 'Bearer':
+            raise AuthError(401, "Invalid token: Bad Authorization header. Expected 'Authorization: Bearer <JWT>'", 'invalid_token')
+
+        try:
+            with self.flask_app.app_context():
+                payload = decode_token(parts[1])
+        except ExpiredSignatureError:
+            raise AuthError(401, 'Token has expired', 'token_expired')
+        except (InvalidTokenError, JWTExtendedException) as e:
+            raise AuthError(401, f'Invalid token: {e}', 'invalid_token')
+
+        if payload.get('type') != 'access':
+            raise AuthError(401, 'Invalid token: Only non-refresh tokens are allowed', 'invalid_token')
+        if self.config.get('JWT_BLACKLIST_ENABLED') and is_token_revoked(payload, sync=False):
+            raise AuthError(401, 'Token has been revoked', 'token_revoked')
+
+        user_id = int(payload['sub'])
+        current = self.identity_cache.get(user_id)
+        if current is None:
+            current = build_current_user((await session.execute(current_user_query(user_id))).all())
+            if current is None:
+                raise AuthError(404, 'User not found', 'user_not_found')
+            self.identity_cache.set(user_id, current)
+        return current
+
+    def cors_headers(self, request):
+        origin = request.headers.get('Origin')
+        if not origin or not ('*' in self.cors_origins or origin in self.cors_origins):
+            return []
+        allowed = '*' if '*' in self.cors_origins else origin
+        return [(b'access-control-allow-origin', allowed.encode('latin-1')), (b'vary', b'Origin')]
+
+    async def respond(self, request, send, status, body):
+        data = self.flask_app.json.dumps(body).encode('utf-8') + b'\n'
+        headers = [(b'content-type', b'application/json'), (b'vary', b'Accept-Encoding')]
+
+        if self.config.get('COMPRESS_ENABLED', True) and len(data) >= self.config.get('COMPRESS_MIN_SIZE', 1024):
+            encoding = parse_accept_header(request.headers.get('Accept-Encoding')).best_match(available_encodings())
+            if encoding:
+                with self.flask_app.app_context():
+                    data = compress(data, encoding)
+                headers.append((b'content-encoding', encoding.encode()))
+
+        headers += self.cors_headers(request)
+        headers.append((b'content-length', str(len(data)).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': data})
+
+app = AsyncReadApp(get_app())
@@ -1,7 +1,6 @@
 from flask import Flask, request
-from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from services.database_service import db
+from services.database_service import db, init_sqlite_pragmas
 from utils.config import config_by_name
 import os
 import logging
@@ -9,17 +8,36 @@ import logging
 # Initialize JWT extension
 jwt = JWTManager()
 
+# Built on first use by get_app(); importing this module doesn't construct the app
+_app = None
+
 def create_app():
+    # Imported here so that importing main stays cheap for code that never builds an app
+    from flask_cors import CORS
+    from utils.json_provider import FastJSONProvider
+    from middleware.compression import init_compression
+    from middleware.rate_limit import init_rate_limiting
+    from middleware.profiling import init_profiling
+    from middleware.traffic_capture import init_traffic_capture
+    from services.query_log_service import init_slow_query_log
+    from services.memory_service import init_memory_instrumentation
+    
     app = Flask(__name__)
     
     # Configuration
     config_name = os.getenv('FLASK_ENV', 'development')
     app.config.from_object(config_by_name[config_name])
     
+    # Serializes Decimal and datetime values returned by the models' to_dict
+    app.json = FastJSONProvider(app)
+    
     # Initialize extensions
     db.init_app(app)
     jwt.init_app(app)
     
+    # WAL and faster syncing for file-backed SQLite (development and tests)
+    init_sqlite_pragmas(app)
+    
     # JWT error handlers for better error messages
     @jwt.expired_token_loader
     def expired_token_callback(jwt_header, jwt_payload):
@@ -30,6 +48,32 @@ def create_app():
         print(f"Invalid token error: {error}")
         return {'message': f'Invalid token: {error}', 'error': 'invalid_token'}, 401
     
+    # Load the authenticated user once per request, cached across requests in this worker
+    @jwt.user_lookup_loader
+    def user_lookup_callback(jwt_header, jwt_payload):
+        from services.identity_service import load_current_user
+        return load_current_user(int(jwt_payload['sub']))
+    
+    @jwt.user_lookup_error_loader
+    def user_lookup_error_callback(jwt_header, jwt_payload):
+        return {'message': 'User not found', 'error': 'user_not_found'}, 404
+    
+    # Revoked tokens are checked against an in-memory index, not the database
+    if app.config.get('JWT_BLACKLIST_ENABLED'):
+        @jwt.additional_claims_loader
+        def additional_claims_callback(identity):
+            from services.revocation_service import issued_at_claims
+            return issued_at_claims()
+        
+        @jwt.token_in_blocklist_loader
+        def token_in_blocklist_callback(jwt_header, jwt_payload):
+            from services.revocation_service import is_token_revoked
+            return is_token_revoked(jwt_payload)
+    
+    @jwt.revoked_token_loader
+    def revoked_token_callback(jwt_header, jwt_payload):
+        return {'message': 'Token has been revoked', 'error': 'token_revoked'}, 401
+    
     @jwt.unauthorized_loader
     def unauthorized_callback(error):
         print(f"Unauthorized error: {error}")
@@ -42,6 +86,24 @@ def create_app():
     
     CORS(app, origins=cors_origins)
     
+    # Statements slower than SLOW_QUERY_MS are logged with their plan
+    init_slow_query_log(app)
+    
+    # Opt-in request profiling (PROFILE_ENABLED); first, so the other hooks are profiled too
+    init_profiling(app)
+    
+    # Per-worker RSS and tracemalloc reports, triggered from /api/admin/memory/snapshots
+    init_memory_instrumentation(app)
+    
+    # gzip/brotli for larger JSON responses, negotiated via Accept-Encoding
+    init_compression(app)
+    
+    # Sanitized request capture for benchmarks/replay_traffic.py (TRAFFIC_CAPTURE)
+    init_traffic_capture(app)
+    
+    # Token-bucket limits on login/register/search and load shedding; runs before the request hooks below
+    init_rate_limiting(app)
+    
     # Add request logging middleware
     @app.before_request
     def log_request_info():
@@ -87,14 +149,24 @@ def create_app():
     
     return app
 
-# Create app instance
-app = create_app()
+def get_app():
+    """The app for this process, created on first call"""
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+def __getattr__(name):
+    # Keeps `from main import app` and gunicorn's `main:app` working; the app is built on first access
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    with app.app_context():
-        # Import models to ensure they're registered
-        from models.user import User
-        from models.stockvel import Stockvel, StockvelMember, Contribution
+    app = get_app()
+    if app.config.get('STARTUP_WARMUP'):
+        from services.warmup_service import warm_up
+        warm_up(app)
         
     app.run(
         host=app.config.get('HOST', '0.0.0.0'),
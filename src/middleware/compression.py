@@ -0,0 +1,95 @@
+from flask import current_app, request
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+def available_encodings():
+    """Server preference order"""
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+def negotiate_encoding():
+    """Pick the best encoding the client accepts, or None for identity"""
+    return request.accept_encodings.best_match(available_encodings())
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config.get('COMPRESS_BROTLI_QUALITY', 5))
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=current_app.config.get('COMPRESS_LEVEL', 6))
+    raise ValueError(f'Unsupported encoding: {encoding}')
+
+def _add_vary(response):
+    response.vary.add('Accept-Encoding')
+
+class PrecompressedBody:
+    """A serialized response body that remembers its compressed variants.
+
+    Keep one of these next to a cached value so cache hits reuse the already
+    compressed bytes instead of recompressing on every request.
+    """
+
+    def __init__(self, data, mimetype='application/json'):
+        self.data = data
+        self.mimetype = mimetype
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(current_app.json.dumps(obj).encode('utf-8') + b'\n')
+
+    def variant(self, encoding):
+        body = self._variants.get(encoding)
+        if body is None:
+            with self._lock:
+                body = self._variants.get(encoding)
+                if body is None:
+                    body = compress(self.data, encoding)
+                    self._variants[encoding] = body
+        return body
+
+    def response(self, status=200):
+        encoding = negotiate_encoding() if len(self.data) >= current_app.config.get('COMPRESS_MIN_SIZE', 1024) else None
+        body = self.variant(encoding) if encoding else self.data
+
+        response = current_app.response_class(body, status=status, mimetype=self.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        _add_vary(response)
+        return response
+
+def init_compression(app):
+    """Compress eligible responses according to the request's Accept-Encoding"""
+    if not app.config.get('COMPRESS_ENABLED', True):
+        return
+
+    mimetypes = set(app.config.get('COMPRESS_MIMETYPES', ['application/json']))
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in mimetypes
+        ):
+            return response
+
+        # Below the threshold compression costs more CPU than it saves on the wire
+        if (response.content_length or 0) < app.config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+
+        _add_vary(response)
+        encoding = negotiate_encoding()
+        if not encoding:
+            return response
+
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
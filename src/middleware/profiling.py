@@ -0,0 +1,243 @@
+"""
+On-demand profiling of single requests.
+
+Disabled unless PROFILE_ENABLED is set, in which case nothing is installed
+and requests pay nothing. When enabled, a request is profiled if it is
+picked by PROFILE_SAMPLE_RATE, or if it carries an ``X-Profile`` header
+signed with PROFILE_SECRET (see ``profile_token``). A profiled request gets
+an ``X-Profile-Id`` response header and leaves in PROFILE_FOLDER:
+
+- ``<id>.pstats``: cProfile data, for ``python -m pstats`` or snakeviz
+- ``<id>.collapsed``: sampled stacks, one ``frame;frame;... count`` line per
+  stack, for flamegraph.pl or speedscope. Time spent waiting on the database
+  ends in a ``[sql]`` frame.
+- ``<id>.json``: the endpoint, wall time and SQL time, with the statements
+  that took the longest
+
+PROFILE_MODE picks 'cprofile', 'sampling' or 'both'. The profile runs from
+the first before_request hook to teardown, so it includes streamed bodies
+that keep the request context (stream_with_context).
+"""
+from flask import request, g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from collections import Counter
+import cProfile
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+HEADER = 'X-Profile'
+
+# The SQL accounting of the profile running on this thread, if any
+_active = threading.local()
+
+def profile_token(secret, ttl=300, now=None):
+    """``X-Profile`` header value valid for ``ttl`` seconds"""
+    expires = int((now or time.time()) + ttl)
+    signature = hmac.new(secret.encode('utf-8'), str(expires).encode('utf-8'), hashlib.sha256).hexdigest()
+    return f'{expires}.{signature}'
+
+def valid_token(secret, token, now=None):
+    expires, _, signature = token.partition('.')
+    if not expires.isdigit() or int(expires) < (now or time.time()):
+        return False
+    return hmac.compare_digest(profile_token(secret, 0, int(expires)), token)
+
+class SqlTimer:
+    """Time spent in cursor execution while a request is profiled"""
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+        self.statements = Counter()
+        self.in_sql = False
+
+    def start(self):
+        self.in_sql = True
+        self.started = time.perf_counter()
+
+    def stop(self, statement):
+        elapsed = time.perf_counter() - self.started
+        self.in_sql = False
+        self.total += elapsed
+        self.count += 1
+        self.statements[statement] += elapsed
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timer = getattr(_active, 'sql', None)
+    if timer is not None:
+        timer.start()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timer = getattr(_active, 'sql', None)
+    if timer is not None and timer.in_sql:
+        timer.stop(statement)
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+class StackSampler(threading.Thread):
+    """Samples one thread's stack every ``interval`` seconds into collapsed-stack counts"""
+
+    def __init__(self, thread_id, interval, sql):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.thread_id = thread_id
+        self.interval = interval
+        self.sql = sql
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.reverse()
+            if self.sql.in_sql:
+                stack.append('[sql]')
+            self.stacks[';'.join(stack)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.items())
+
+def profile_folder(config):
+    folder = config.get('PROFILE_FOLDER', 'profiles')
+    return folder if os.path.isabs(folder) else os.path.join(BASE_DIR, folder)
+
+def prune(folder, keep):
+    """Delete the oldest profiles beyond ``keep``"""
+    summaries = sorted(
+        (name for name in os.listdir(folder) if name.endswith('.json')),
+        key=lambda name: os.path.getmtime(os.path.join(folder, name))
+    )
+    for name in summaries[:max(0, len(summaries) - keep)]:
+        profile_id = name[:-len('.json')]
+        for suffix in ('.json', '.pstats', '.collapsed'):
+            try:
+                os.remove(os.path.join(folder, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+class RequestProfile:
+    def __init__(self, mode, interval):
+        self.sql = SqlTimer()
+        self.profiler = cProfile.Profile() if mode in ('cprofile', 'both') else None
+        self.sampler = StackSampler(threading.get_ident(), interval, self.sql) if mode in ('sampling', 'both') else None
+
+    def start(self):
+        _active.sql = self.sql
+        self.started = time.perf_counter()
+        if self.sampler:
+            self.sampler.start()
+        if self.profiler:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+        if self.sampler:
+            self.sampler.stop()
+        self.elapsed = time.perf_counter() - self.started
+        _active.sql = None
+
+    def write(self, folder, profile_id, details):
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, profile_id)
+        if self.profiler:
+            self.profiler.dump_stats(path + '.pstats')
+        if self.sampler:
+            with open(path + '.collapsed', 'w', encoding='utf-8') as f:
+                f.write(self.sampler.collapsed())
+        summary = dict(details, **{
+            'id': profile_id,
+            'wall_ms': round(self.elapsed * 1000, 3),
+            'sql_ms': round(self.sql.total * 1000, 3),
+            'sql_count': self.sql.count,
+            'slowest_sql': [
+                {'statement': statement, 'ms': round(seconds * 1000, 3)}
+                for statement, seconds in self.sql.statements.most_common(10)
+            ]
+        })
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+def init_profiling(app):
+    """Install the profiling hook when PROFILE_ENABLED; otherwise leave the app untouched"""
+    config = app.config
+    if not config.get('PROFILE_ENABLED'):
+        return
+
+    sample_rate = config.get('PROFILE_SAMPLE_RATE', 0.0)
+    secret = config.get('PROFILE_SECRET')
+    mode = config.get('PROFILE_MODE', 'both')
+    interval = config.get('PROFILE_SAMPLE_INTERVAL_MS', 5) / 1000
+    folder = profile_folder(config)
+    keep = config.get('PROFILE_KEEP', 200)
+    counter = iter(range(1, sys.maxsize))
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def wanted():
+        token = request.headers.get(HEADER)
+        if token and secret and valid_token(secret, token):
+            return True
+        return sample_rate > 0 and random.random() < sample_rate
+
+    @app.before_request
+    def start_profile():
+        if getattr(_active, 'sql', None) is not None or not wanted():
+            return
+        g.profile = RequestProfile(mode, interval)
+        g.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unknown'}-{os.getpid()}-{next(counter)}"
+        g.profile.start()
+
+    @app.after_request
+    def tag_profile(response):
+        if 'profile_id' in g:
+            response.headers['X-Profile-Id'] = g.profile_id
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.stop()
+        try:
+            summary = profile.write(folder, g.profile_id, {
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'error': repr(exc) if exc else None
+            })
+            prune(folder, keep)
+            logger.info(f"Profiled {request.method} {request.path}: {summary['wall_ms']}ms, {summary['sql_ms']}ms in {summary['sql_count']} queries ({g.profile_id})")
+        except OSError as e:
+            logger.warning(f"Could not write profile {g.profile_id}: {str(e)}")
+
+if __name__ == '__main__':
+    # Print an X-Profile header value: PROFILE_SECRET=... python src/middleware/profiling.py [ttl]
+    print(f"{HEADER}: {profile_token(os.environ['PROFILE_SECRET'], int(sys.argv[1]) if len(sys.argv) > 1 else 300)}")
@@ -0,0 +1,296 @@
+"""
+Token-bucket rate limiting and concurrency-based load shedding.
+
+Each rule in RATE_LIMITS gives its endpoints a bucket per client IP, per
+authenticated user or per route. A bucket holds ``requests`` tokens and
+refills at ``requests / per`` tokens a second; a request that finds any of
+its buckets empty gets 429 with Retry-After, and the tokens its other
+buckets gave are refunded, so a rejected request costs nothing.
+
+With RATE_LIMIT_STORAGE='shared' (the default on Linux) the buckets live in
+a memory-mapped file, normally on /dev/shm, so all gunicorn workers on the
+host draw from the same buckets. The file is a fixed-size table of
+(key hash, tokens, updated) slots in sets of ``WAYS``; a key lives in one
+set, and each set is guarded by a byte-range lock on the file plus a thread
+lock. When a set is full the least recently used bucket is recycled, which
+can only make limiting more lenient. 'local' keeps buckets per process.
+
+Load shedding answers 503 with Retry-After before a request does any work
+when the worker already handles LOAD_SHED_MAX_INFLIGHT requests, when
+LOAD_SHED_EXPENSIVE_MAX expensive requests (password hashing, ILIKE search)
+are already running, or when the request waited longer than
+LOAD_SHED_MAX_QUEUE_MS behind the proxy (X-Request-Start), since its client
+has probably given up.
+"""
+from flask import request, g, jsonify
+from flask_jwt_extended import decode_token
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no byte-range locks, buckets stay per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SLOT = struct.Struct('<Qdd')  # key hash, tokens, last update (epoch seconds)
+WAYS = 8
+LOCK_STRIPES = 64
+
+def _hash(key):
+    # 0 marks an empty slot
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+def _refill(tokens, updated, now, rate, capacity):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+def _spend(tokens, rate, cost):
+    """Remaining tokens and seconds to wait (0 when allowed)"""
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+def _give_back(tokens, cost, capacity):
+    return min(capacity, tokens + cost)
+
+class LocalBuckets:
+    """Buckets in this process only"""
+
+    def __init__(self, max_keys=65536):
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, capacity, cost=1.0, now=None):
+        now = now or time.time()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens, wait = _spend(_refill(tokens, updated, now, rate, capacity), rate, cost)
+            if len(self.buckets) >= self.max_keys and key not in self.buckets:
+                self.buckets.clear()
+            self.buckets[key] = (tokens, now)
+        return wait
+
+    def refund(self, key, capacity, cost=1.0):
+        """Return tokens taken by a request that was rejected after all"""
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets[key]
+                self.buckets[key] = (_give_back(tokens, cost, capacity), updated)
+
+class SharedBuckets:
+    """Buckets in a memory-mapped file shared by every process that opens the same path"""
+
+    def __init__(self, path, slots=16384):
+        self.sets = max(1, slots // WAYS)
+        self.set_size = WAYS * SLOT.size
+        size = self.sets * self.set_size
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # The first process sizes the file; the new bytes are zero, i.e. empty slots
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def take(self, key, rate, capacity, cost=1.0, now=None):
+        now = now or time.time()
+        key_hash = _hash(key)
+        index = key_hash % self.sets
+        start = index * self.set_size
+
+        with self.locks[index % LOCK_STRIPES]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.set_size, start)
+            try:
+                slot, tokens, updated = self._find(start, key_hash, capacity, now)
+                tokens, wait = _spend(_refill(tokens, updated, now, rate, capacity), rate, cost)
+                SLOT.pack_into(self.map, slot, key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.set_size, start)
+        return wait
+
+    def refund(self, key, capacity, cost=1.0):
+        """Return tokens taken by a request that was rejected after all"""
+        key_hash = _hash(key)
+        index = key_hash % self.sets
+        start = index * self.set_size
+
+        with self.locks[index % LOCK_STRIPES]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.set_size, start)
+            try:
+                for offset in range(start, start + self.set_size, SLOT.size):
+                    slot_hash, tokens, updated = SLOT.unpack_from(self.map, offset)
+                    if slot_hash == key_hash:
+                        SLOT.pack_into(self.map, offset, key_hash, _give_back(tokens, cost, capacity), updated)
+                        break
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.set_size, start)
+
+    def _find(self, start, key_hash, capacity, now):
+        """Offset of the key's slot with its state, or of a free/least recently used slot as a full bucket"""
+        oldest, oldest_updated = start, None
+        for offset in range(start, start + self.set_size, SLOT.size):
+            slot_hash, tokens, updated = SLOT.unpack_from(self.map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, updated
+            if slot_hash == 0:
+                return offset, capacity, now
+            if oldest_updated is None or updated < oldest_updated:
+                oldest, oldest_updated = offset, updated
+        return oldest, capacity, now
+
+class ConcurrencyLimit:
+    """Counts requests in progress in this worker; ``acquire`` fails instead of waiting"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+def default_shared_path():
+    folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(folder, 'savetogether-ratelimit')
+
+def create_buckets(config):
+    storage = config.get('RATE_LIMIT_STORAGE', 'shared')
+    if storage == 'shared' and fcntl is not None:
+        return SharedBuckets(config.get('RATE_LIMIT_SHARED_PATH') or default_shared_path(), config.get('RATE_LIMIT_SLOTS', 16384))
+    return LocalBuckets(config.get('RATE_LIMIT_SLOTS', 16384))
+
+def client_ip(trusted_proxies):
+    """The client address, taken from X-Forwarded-For when behind ``trusted_proxies`` proxies"""
+    if trusted_proxies:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return request.remote_addr or 'unknown'
+
+def token_identity():
+    """The user id of a valid bearer token, without the user lookup and revocation checks"""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        return str(decode_token(header[7:])['sub'])
+    except Exception:
+        return None
+
+def queue_wait_ms():
+    """Milliseconds since the proxy received the request, from X-Request-Start (t=<epoch>)"""
+    value = request.headers.get('X-Request-Start', '').removeprefix('t=')
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    # nginx sends seconds with a fraction, others milliseconds or microseconds
+    while started > 1e11:
+        started /= 1000
+    return (time.time() - started) * 1000
+
+def _retry_response(status, message, error, retry_after):
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({'message': message, 'error': error, 'retry_after': retry_after})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def init_rate_limiting(app):
+    """Install the rate limits and load shedding configured for ``app``"""
+    config = app.config
+    rules_by_endpoint = {}
+    if config.get('RATE_LIMIT_ENABLED', True):
+        for name, (endpoints, scope, requests, per) in config.get('RATE_LIMITS', {}).items():
+            for endpoint in endpoints:
+                rules_by_endpoint.setdefault(endpoint, []).append((name, scope, requests / per, requests))
+    buckets = create_buckets(config) if rules_by_endpoint else None
+    trusted_proxies = config.get('RATE_LIMIT_TRUSTED_PROXIES', 0)
+
+    max_inflight = config.get('LOAD_SHED_MAX_INFLIGHT', 0)
+    inflight = ConcurrencyLimit(max_inflight) if max_inflight else None
+    expensive_endpoints = set(config.get('LOAD_SHED_EXPENSIVE_ENDPOINTS', ()))
+    expensive_max = config.get('LOAD_SHED_EXPENSIVE_MAX', 0)
+    expensive = ConcurrencyLimit(expensive_max) if expensive_max and expensive_endpoints else None
+    max_queue_ms = config.get('LOAD_SHED_MAX_QUEUE_MS', 0)
+    shed_retry_after = config.get('LOAD_SHED_RETRY_AFTER', 1)
+    exempt = set(config.get('LOAD_SHED_EXEMPT_ENDPOINTS', ()))
+
+    if not (rules_by_endpoint or inflight or expensive or max_queue_ms):
+        return
+
+    def check_rate_limits(rules):
+        wait = 0.0
+        taken = []
+        for name, scope, rate, capacity in rules:
+            if scope == 'ip':
+                key = client_ip(trusted_proxies)
+            elif scope == 'user':
+                key = token_identity()
+                if key is None:
+                    continue  # Anonymous requests are covered by the ip rules
+            else:
+                key = request.endpoint
+            bucket_wait = buckets.take(f'{name}:{key}', rate, capacity)
+            if bucket_wait:
+                wait = max(wait, bucket_wait)
+            else:
+                taken.append((f'{name}:{key}', capacity))
+        # Rejected: the buckets that allowed it get their token back
+        if wait:
+            for key, capacity in taken:
+                buckets.refund(key, capacity)
+        return wait
+
+    @app.before_request
+    def limit_request():
+        if request.method == 'OPTIONS' or request.endpoint in exempt:
+            return None
+
+        if max_queue_ms:
+            waited = queue_wait_ms()
+            if waited is not None and waited > max_queue_ms:
+                logger.warning(f"Shedding {request.method} {request.path}: queued {waited:.0f}ms")
+                return _retry_response(503, 'Server is busy, please retry', 'overloaded', shed_retry_after)
+
+        rules = rules_by_endpoint.get(request.endpoint)
+        if rules:
+            wait = check_rate_limits(rules)
+            if wait:
+                return _retry_response(429, 'Too many requests, please retry later', 'rate_limited', wait)
+
+        if inflight:
+            if not inflight.acquire():
+                logger.warning(f"Shedding {request.method} {request.path}: {inflight.active} requests in progress")
+                return _retry_response(503, 'Server is busy, please retry', 'overloaded', shed_retry_after)
+            g.inflight_slot = inflight
+
+        if expensive and request.endpoint in expensive_endpoints:
+            if not expensive.acquire():
+                return _retry_response(503, 'Server is busy, please retry', 'overloaded', shed_retry_after)
+            g.expensive_slot = expensive
+        return None
+
+    @app.teardown_request
+    def release_slots(exc=None):
+        for name in ('expensive_slot', 'inflight_slot'):
+            slot = g.pop(name, None)
+            if slot is not None:
+                slot.release()
@@ -0,0 +1,163 @@
+"""
+Capture of sanitized traffic for replay (benchmarks/replay_traffic.py).
+
+With TRAFFIC_CAPTURE enabled, a TRAFFIC_CAPTURE_RATE fraction of requests is
+recorded to ``capture-<pid>-<start>.ndjson.gz`` in TRAFFIC_CAPTURE_FOLDER,
+one JSON object per request:
+
+    {"t": 1760000000.123, "method": "GET", "endpoint": "stockvels.get_stockvel",
+     "rule": "/api/stockvels/<int:stockvel_id>", "args": {"stockvel_id": 12},
+     "query": {"page": "2"}, "body": {"amount": "num", "description": "str:12"},
+     "user": "u:3f2a...", "status": 200, "ms": 8.4, "bytes": 5120}
+
+No values that identify anyone or carry money are kept: the body is reduced
+to its shape (keys and value types, strings as their length); emails,
+invite codes and user ids become HMAC pseudonyms keyed with
+TRAFFIC_CAPTURE_SECRET (the JWT secret by default), so the same person or
+group maps to the same pseudonym across requests and the replay can map
+them onto seeded rows; free-text query values keep only their length.
+"""
+from flask import request, g
+from flask_jwt_extended import decode_token
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# Values replaced by pseudonyms, so the replay can tell repeat visitors apart
+PSEUDONYM_FIELDS = {'email': 'e', 'invite_code': 'i', 'user_id': 'u'}
+# Query parameters kept as sent; everything else keeps only its length
+PLAIN_QUERY = {'page', 'per_page', 'limit', 'fields', 'format', 'background', 'sort', 'hours', 'after'}
+
+def capture_folder(config):
+    folder = config.get('TRAFFIC_CAPTURE_FOLDER', 'captures')
+    return folder if os.path.isabs(folder) else os.path.join(BASE_DIR, folder)
+
+class Pseudonymizer:
+    def __init__(self, secret):
+        self.key = secret.encode('utf-8')
+
+    def __call__(self, kind, value):
+        value = str(value).strip().lower()
+        return f'{kind}:' + hmac.new(self.key, value.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+def shape(value, pseudonym, field=None):
+    """Keys and value types of a JSON body, with pseudonyms for PSEUDONYM_FIELDS"""
+    if field in PSEUDONYM_FIELDS and isinstance(value, (str, int)) and not isinstance(value, bool):
+        return pseudonym(PSEUDONYM_FIELDS[field], value)
+    if isinstance(value, dict):
+        return {key: shape(item, pseudonym, key) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(value[0], pseudonym, field), len(value)] if value else []
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'num'
+    if isinstance(value, str):
+        return f'str:{len(value)}'
+    return 'null'
+
+class CaptureWriter:
+    """gzip NDJSON file of this process, opened on first use (so after a fork)"""
+
+    def __init__(self, folder, flush_every):
+        self.folder = folder
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.pid = None
+        self.file = None
+        self.pending = 0
+
+    def _open(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self.pid = os.getpid()
+        path = os.path.join(self.folder, f"capture-{self.pid}-{time.strftime('%Y%m%d%H%M%S')}.ndjson.gz")
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        atexit.register(self.close)
+        logger.info(f"Capturing traffic to {path}")
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.pid != os.getpid():
+                self._open()
+            self.file.write(line)
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self.file.flush()
+                self.pending = 0
+
+    def close(self):
+        with self.lock:
+            if self.file is not None and self.pid == os.getpid():
+                self.file.close()
+                self.file = None
+                self.pid = None
+
+def _identity():
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        return decode_token(header[7:])['sub']
+    except Exception:
+        return None
+
+def init_traffic_capture(app):
+    """Record sanitized requests when TRAFFIC_CAPTURE is set"""
+    config = app.config
+    if not config.get('TRAFFIC_CAPTURE'):
+        return
+
+    rate = config.get('TRAFFIC_CAPTURE_RATE', 1.0)
+    pseudonym = Pseudonymizer(config.get('TRAFFIC_CAPTURE_SECRET') or config['JWT_SECRET_KEY'])
+    writer = CaptureWriter(capture_folder(config), config.get('TRAFFIC_CAPTURE_FLUSH_EVERY', 100))
+
+    @app.before_request
+    def start_capture():
+        if rate >= 1 or random.random() < rate:
+            g.capture_started = (time.time(), time.perf_counter())
+
+    @app.after_request
+    def capture_request(response):
+        started = g.pop('capture_started', None)
+        if started is None or request.url_rule is None:
+            return response
+        try:
+            user = _identity()
+            if user is None and request.endpoint == 'auth.login' and response.status_code == 200:
+                # Ties the login's email pseudonym to the user the replay logs in as
+                user = (response.get_json(silent=True) or {}).get('user', {}).get('id')
+            body = request.get_json(silent=True) if request.is_json else None
+            writer.write({
+                't': round(started[0], 4),
+                'method': request.method,
+                'endpoint': request.endpoint,
+                'rule': request.url_rule.rule,
+                'args': {
+                    key: pseudonym(PSEUDONYM_FIELDS[key], value) if key in PSEUDONYM_FIELDS else value
+                    for key, value in (request.view_args or {}).items()
+                },
+                'query': {
+                    key: value if key in PLAIN_QUERY else f'str:{len(value)}'
+                    for key, value in request.args.items()
+                },
+                'body': shape(body, pseudonym) if body is not None else None,
+                'user': pseudonym('u', user) if user is not None else None,
+                'status': response.status_code,
+                'ms': round((time.perf_counter() - started[1]) * 1000, 3),
+                'bytes': response.calculate_content_length()
+            })
+        except Exception as e:
+            logger.warning(f"Could not capture {request.method} {request.path}: {str(e)}")
+        return response
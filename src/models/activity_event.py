@@ -0,0 +1,34 @@
+from services.database_service import db
+from datetime import datetime
+import json
+
+class ActivityEvent(db.Model):
+    """A change in a stockvel pushed to clients over server-sent events"""
+    __tablename__ = 'activity_events'
+
+    id = db.Column(db.Integer, primary_key=True)  # SSE event id; clients resume from it with Last-Event-ID
+    stockvel_id = db.Column(db.Integer, db.ForeignKey('stockvels.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True, index=True)  # Member the event is about
+    type = db.Column(db.String(50), nullable=False)  # contribution.created, member.joined, member.left, members.reordered
+    data = db.Column(db.Text, nullable=True)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.Index('ix_activity_events_stockvel_id_id', 'stockvel_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f"<ActivityEvent(id={self.id}, stockvel_id={self.stockvel_id}, type='{self.type}')>"
+
+    def get_data(self):
+        return json.loads(self.data) if self.data else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'stockvel_id': self.stockvel_id,
+            'user_id': self.user_id,
+            'type': self.type,
+            'data': self.get_data(),
+            'created_at': self.created_at
+        }
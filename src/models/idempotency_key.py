@@ -0,0 +1,24 @@
+from services.database_service import db
+from datetime import datetime
+
+class IdempotencyKey(db.Model):
+    """A client Idempotency-Key with the request it was first used for and the stored response"""
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of method, path and body
+    status = db.Column(db.String(20), nullable=False, default='in_progress')  # in_progress, completed
+    locked_until = db.Column(db.DateTime, nullable=True)  # An in-progress claim older than this is taken over
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    response_mimetype = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # After this the key can be reused
+
+    # Keys are scoped per user, so one client can't replay another's response
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='unique_idempotency_key'),)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(id={self.id}, user_id={self.user_id}, key='{self.key}', status='{self.status}')>"
@@ -0,0 +1,13 @@
+from services.database_service import db
+from datetime import datetime
+
+class IdentityInvalidation(db.Model):
+    """A cached-identity invalidation, replayed by every worker (services/identity_service.py)"""
+    __tablename__ = 'identity_invalidations'
+
+    id = db.Column(db.Integer, primary_key=True)  # Monotonic cursor used by workers to sync incrementally
+    user_id = db.Column(db.Integer, nullable=True)  # NULL drops every cached identity
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<IdentityInvalidation(id={self.id}, user_id={self.user_id})>"
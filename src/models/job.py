@@ -0,0 +1,55 @@
+from services.database_service import db
+from datetime import datetime
+import json
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)  # Registered task name, e.g. 'admin.purge_user'
+    payload = db.Column(db.Text, nullable=True)  # JSON encoded keyword arguments for the task
+    dedup_key = db.Column(db.String(200), unique=True, nullable=True)  # Held while queued; enqueueing it again is a no-op
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    priority = db.Column(db.Integer, nullable=False, default=0)  # Higher runs first
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not picked up before this time
+    locked_by = db.Column(db.String(100), nullable=True)  # Worker that claimed the job
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)  # JSON encoded return value or progress report
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # Dequeue scans queued jobs by priority and due time
+    __table_args__ = (
+        db.Index('ix_jobs_dequeue', 'status', 'priority', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, name='{self.name}', status='{self.status}')>"
+
+    def get_payload(self):
+        """Decode the stored task arguments"""
+        return json.loads(self.payload) if self.payload else {}
+
+    def get_result(self):
+        """Decode the stored task result"""
+        return json.loads(self.result) if self.result else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'priority': self.priority,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at,
+            'last_error': self.last_error,
+            'result': self.get_result(),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
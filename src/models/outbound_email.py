@@ -0,0 +1,30 @@
+from services.database_service import db
+from datetime import datetime
+
+class OutboundEmail(db.Model):
+    """A message in the outbox, delivered by the mail.deliver job (services/mail_service.py)"""
+    __tablename__ = 'outbound_emails'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # contribution_receipt, payout_reminder
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    dedup_key = db.Column(db.String(200), unique=True, nullable=True)  # Queuing the same message twice is a no-op
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    send_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not sent before this time (retry backoff)
+    locked_by = db.Column(db.String(100), nullable=True)  # Delivery batch that claimed the message
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    # Delivery claims due messages in order
+    __table_args__ = (
+        db.Index('ix_outbound_emails_dequeue', 'status', 'send_after'),
+    )
+
+    def __repr__(self):
+        return f"<OutboundEmail(id={self.id}, kind='{self.kind}', status='{self.status}')>"
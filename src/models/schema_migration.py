@@ -0,0 +1,18 @@
+from services.database_service import db
+from datetime import datetime
+
+class SchemaMigration(db.Model):
+    """A migration from migrations/ that has run (or is running) against this database"""
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.String(20), primary_key=True)  # Numeric file prefix, e.g. '0003'
+    name = db.Column(db.String(200), nullable=False)
+    checksum = db.Column(db.String(64), nullable=False)  # sha256 of the file when it ran
+    state = db.Column(db.String(20), nullable=False, default='running')  # running, applied, skipped, baseline
+    checkpoint = db.Column(db.Text, nullable=True)  # JSON {step: last key} of an unfinished backfill
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    applied_at = db.Column(db.DateTime, nullable=True)
+    duration_ms = db.Column(db.Integer, nullable=True)
+
+    def __repr__(self):
+        return f"<SchemaMigration(version='{self.version}', name='{self.name}', state='{self.state}')>"
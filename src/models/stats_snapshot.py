@@ -0,0 +1,14 @@
+from services.database_service import db
+from datetime import datetime
+
+class StatsSnapshot(db.Model):
+    """A serialized statistics snapshot shared by every process (services/stats_service.py)"""
+    __tablename__ = 'stats_snapshots'
+
+    name = db.Column(db.String(50), primary_key=True)  # e.g. 'admin'
+    body = db.Column(db.Text, nullable=False)  # JSON response body
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    refreshing_since = db.Column(db.DateTime, nullable=True)  # Set by the one process recomputing it
+
+    def __repr__(self):
+        return f"<StatsSnapshot(name='{self.name}', computed_at={self.computed_at})>"
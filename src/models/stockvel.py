@@ -1,6 +1,8 @@
 from services.database_service import db
+from services.partition_service import partitioned
 from datetime import datetime
-from sqlalchemy import Numeric
+from sqlalchemy import Numeric, DDL, event
+from decimal import Decimal
 import random
 import string
 
@@ -20,10 +22,13 @@ class Stockvel(db.Model):
     admin_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # adminUser from Flutter
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # createdAt from Flutter
     is_active = db.Column(db.Boolean, default=True)
+    deactivated_at = db.Column(db.DateTime, nullable=True)  # Set when is_active turns false; archival counts from it
+    ledger_starts_at = db.Column(db.DateTime, nullable=True)  # Earliest contribution_date; kept by a trigger on contributions
     
     # Relationships
-    members = db.relationship('StockvelMember', backref='stockvel', lazy=True, cascade='all, delete-orphan')
-    contributions = db.relationship('Contribution', backref='stockvel', lazy=True, cascade='all, delete-orphan')
+    # passive_deletes leaves child rows to the database's ON DELETE CASCADE instead of loading them
+    members = db.relationship('StockvelMember', backref='stockvel', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    contributions = db.relationship('Contribution', backref='stockvel', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -43,42 +48,69 @@ class Stockvel(db.Model):
     def __repr__(self):
         return f"<Stockvel(id={self.id}, name='{self.name}', invite_code='{self.invite_code}')>"
 
-    def to_dict(self):
-        """Convert stockvel object to dictionary"""
-        # Calculate expected contribution per member (each member pays contribution × max_members)
-        expected_per_member = float(self.contribution_amount) * self.max_members
-        
-        # Calculate total expected from ALL members (each member contributes expected_per_member)
-        total_expected_all_members = expected_per_member * self.max_members
-        
-        # Calculate total contributions so far
-        total_contributed = sum(float(c.amount) for c in self.contributions)
-        
-        return {
+    # Computed rather than stored; member_count and current_total need related rows
+    DERIVED_FIELDS = ('member_count', 'target_amount', 'current_total')
+
+    def to_dict(self, fields=None, aggregates=None):
+        """Convert stockvel object to dictionary (money as Decimal, dates as datetime; see FastJSONProvider)
+
+        ``fields`` limits the output to those keys (``id`` is always kept) and skips
+        derived values nobody asked for. ``aggregates`` carries precomputed
+        ``member_count``/``current_total`` so lists don't load every member and
+        contribution (see serialization_service.load_stockvel_aggregates).
+        """
+        aggregates = aggregates or {}
+        data = {
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'contribution_amount': float(self.contribution_amount),
+            'contribution_amount': self.contribution_amount,
             'frequency': self.frequency,
             'max_members': self.max_members,
-            'start_date': self.start_date.isoformat() if self.start_date else None,
-            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
             'status': self.status,
             'invite_code': self.invite_code,
             'admin_user_id': self.admin_user_id,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'is_active': self.is_active,
-            'member_count': len(self.members),
-            'target_amount': total_expected_all_members,
-            'current_total': total_contributed
+            'created_at': self.created_at,
+            'is_active': self.is_active
         }
+        if fields is not None:
+            data = {key: value for key, value in data.items() if key == 'id' or key in fields}
+        
+        if fields is None or 'member_count' in fields:
+            data['member_count'] = aggregates['member_count'] if 'member_count' in aggregates else len(self.members)
+        
+        if fields is None or 'target_amount' in fields:
+            # Calculate expected contribution per member (each member pays contribution × max_members)
+            expected_per_member = self.contribution_amount * self.max_members
+            
+            # Calculate total expected from ALL members (each member contributes expected_per_member)
+            data['target_amount'] = expected_per_member * self.max_members
+        
+        if fields is None or 'current_total' in fields:
+            # Calculate total contributions so far
+            if 'current_total' in aggregates:
+                data['current_total'] = aggregates['current_total']
+            else:
+                data['current_total'] = sum((c.amount for c in self.contributions), Decimal('0'))
+        
+        return data
+
+@event.listens_for(Stockvel.is_active, 'set')
+def _track_deactivation(stockvel, value, oldvalue, initiator):
+    """Stamp deactivated_at, which archival's grace period counts from"""
+    if not value and oldvalue is not False:
+        stockvel.deactivated_at = datetime.utcnow()
+    elif value:
+        stockvel.deactivated_at = None
 
 class StockvelMember(db.Model):
     __tablename__ = 'stockvel_members'
 
     id = db.Column(db.Integer, primary_key=True)
-    stockvel_id = db.Column(db.Integer, db.ForeignKey('stockvels.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    stockvel_id = db.Column(db.Integer, db.ForeignKey('stockvels.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_admin = db.Column(db.Boolean, default=False)  # Track if this member is admin
     is_active = db.Column(db.Boolean, default=True)
@@ -92,7 +124,7 @@ class StockvelMember(db.Model):
             'id': self.id,
             'stockvel_id': self.stockvel_id,
             'user_id': self.user_id,
-            'joined_at': self.joined_at.isoformat() if self.joined_at else None,
+            'joined_at': self.joined_at,
             'is_admin': self.is_admin,
             'is_active': self.is_active,
             'position': self.position
@@ -102,22 +134,55 @@ class Contribution(db.Model):
     __tablename__ = 'contributions'
 
     id = db.Column(db.Integer, primary_key=True)
-    stockvel_id = db.Column(db.Integer, db.ForeignKey('stockvels.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    stockvel_id = db.Column(db.Integer, db.ForeignKey('stockvels.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     amount = db.Column(Numeric(10, 2), nullable=False)
-    contribution_date = db.Column(db.DateTime, default=datetime.utcnow)
+    contribution_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Partition key on PostgreSQL
     description = db.Column(db.String(255), nullable=True)
     payment_method = db.Column(db.String(50), nullable=True)  # bank_transfer, cash, etc.
     status = db.Column(db.String(20), default='confirmed')  # pending, confirmed, failed
 
+    __table_args__ = (
+        db.Index('ix_contributions_stockvel_id_contribution_date', 'stockvel_id', 'contribution_date'),
+        # Monthly partitions on PostgreSQL (see services/partition_service.py); a plain table elsewhere
+        {'postgresql_partition_by': 'RANGE (contribution_date)'},
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
             'stockvel_id': self.stockvel_id,
             'user_id': self.user_id,
-            'amount': float(self.amount),
-            'contribution_date': self.contribution_date.isoformat() if self.contribution_date else None,
+            'amount': self.amount,
+            'contribution_date': self.contribution_date,
             'description': self.description,
             'payment_method': self.payment_method,
             'status': self.status
-        }
\ No newline at end of file
+        }
+
+partitioned(Contribution.__table__, 'contribution_date')
+
+# Keeps stockvels.ledger_starts_at at or before every contribution of the group, however the row is
+# written (ORM, bulk insert, restore, import). Ledger queries bound contribution_date by it
+# (serialization_service.ledger_bound), which lets PostgreSQL skip the months before it.
+_EXTEND_LEDGER_START = (
+    "UPDATE stockvels SET ledger_starts_at = NEW.contribution_date "
+    "WHERE id = NEW.stockvel_id AND (ledger_starts_at IS NULL OR ledger_starts_at > NEW.contribution_date)"
+)
+
+event.listen(Contribution.__table__, 'after_create', DDL(
+    "CREATE OR REPLACE FUNCTION contributions_extend_ledger_start() RETURNS trigger AS $$ "
+    f"BEGIN {_EXTEND_LEDGER_START}; RETURN NULL; END $$ LANGUAGE plpgsql"
+).execute_if(dialect='postgresql'))
+event.listen(Contribution.__table__, 'after_create', DDL(
+    "CREATE TRIGGER contributions_extend_ledger_start AFTER INSERT OR UPDATE OF contribution_date, stockvel_id "
+    "ON contributions FOR EACH ROW EXECUTE FUNCTION contributions_extend_ledger_start()"
+).execute_if(dialect='postgresql'))
+event.listen(Contribution.__table__, 'after_create', DDL(
+    f"CREATE TRIGGER contributions_extend_ledger_start_insert AFTER INSERT ON contributions "
+    f"BEGIN {_EXTEND_LEDGER_START}; END"
+).execute_if(dialect='sqlite'))
+event.listen(Contribution.__table__, 'after_create', DDL(
+    f"CREATE TRIGGER contributions_extend_ledger_start_update AFTER UPDATE OF contribution_date, stockvel_id ON contributions "
+    f"BEGIN {_EXTEND_LEDGER_START}; END"
+).execute_if(dialect='sqlite'))
@@ -0,0 +1,55 @@
+from services.database_service import db
+from datetime import datetime
+
+class StockvelArchive(db.Model):
+    """Tombstone for a closed stockvel moved out of the live tables.
+
+    The group, its members and its contributions are kept as one compressed
+    JSON document in ``payload`` (see services/archive_service.py); the other
+    columns are the summary shown without unpacking it.
+    """
+    __tablename__ = 'stockvel_archives'
+
+    id = db.Column(db.Integer, primary_key=True)
+    stockvel_id = db.Column(db.Integer, nullable=False, unique=True)  # Original id, reused on restore
+    name = db.Column(db.String(100), nullable=False)
+    admin_user_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=True)
+    reason = db.Column(db.String(20), nullable=False)  # inactive, ended, manual
+    start_date = db.Column(db.DateTime, nullable=True)
+    end_date = db.Column(db.DateTime, nullable=True)
+    member_count = db.Column(db.Integer, nullable=False, default=0)
+    contribution_count = db.Column(db.Integer, nullable=False, default=0)
+    total_contributed = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    restored_at = db.Column(db.DateTime, nullable=True)  # Set while the group is back in the live tables
+    payload = db.Column(db.LargeBinary, nullable=False)  # gzip-compressed JSON
+
+    members = db.relationship('ArchivedStockvelMember', backref='archive', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+
+    def __repr__(self):
+        return f"<StockvelArchive(stockvel_id={self.stockvel_id}, name='{self.name}', reason='{self.reason}')>"
+
+    def to_dict(self):
+        return {
+            'stockvel_id': self.stockvel_id,
+            'name': self.name,
+            'admin_user_id': self.admin_user_id,
+            'status': self.status,
+            'reason': self.reason,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'member_count': self.member_count,
+            'contribution_count': self.contribution_count,
+            'total_contributed': self.total_contributed,
+            'archived_at': self.archived_at,
+            'restored_at': self.restored_at
+        }
+
+class ArchivedStockvelMember(db.Model):
+    """Who belonged to an archived stockvel, so members can find and read it"""
+    __tablename__ = 'stockvel_archive_members'
+
+    id = db.Column(db.Integer, primary_key=True)
+    archive_id = db.Column(db.Integer, db.ForeignKey('stockvel_archives.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)  # No foreign key: outlives purged users
@@ -0,0 +1,16 @@
+from services.database_service import db
+from datetime import datetime
+
+class TokenRevocation(db.Model):
+    """A revoked access token (jti) or a revoke-all-sessions cutoff for a user"""
+    __tablename__ = 'token_revocations'
+
+    id = db.Column(db.Integer, primary_key=True)  # Monotonic cursor used by workers to sync incrementally
+    jti = db.Column(db.String(64), nullable=True, index=True)  # Set when a single token is revoked
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    revoked_before = db.Column(db.DateTime, nullable=True)  # Set for revoke-all: tokens issued earlier are invalid
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # After this the entry is compacted away
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<TokenRevocation(id={self.id}, user_id={self.user_id}, jti='{self.jti}')>"
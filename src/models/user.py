@@ -16,8 +16,8 @@ class User(db.Model):
     last_login = db.Column(db.DateTime, nullable=True)
     
     # Relationships with cascade delete
-    stockvel_memberships = db.relationship('StockvelMember', backref='user', lazy=True, cascade='all, delete-orphan')
-    contributions = db.relationship('Contribution', backref='user', lazy=True, cascade='all, delete-orphan')
+    stockvel_memberships = db.relationship('StockvelMember', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    contributions = db.relationship('Contribution', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f"<User(id={self.id}, email='{self.email}', display_name='{self.display_name}')>"
@@ -34,19 +34,31 @@ class User(db.Model):
         """Get list of stockvel IDs this user is a member of (matches Flutter's joinedGroupIds)"""
         return [membership.stockvel_id for membership in self.stockvel_memberships if membership.is_active]
 
-    def to_dict(self):
-        """Convert user object to dictionary"""
-        return {
+    def to_dict(self, joined_group_ids=None, fields=None):
+        """Convert user object to dictionary
+
+        Pass ``joined_group_ids`` when already known to avoid loading memberships.
+        ``fields`` limits the output to those keys (``id`` is always kept).
+        """
+        data = {
             'id': self.id,
             'email': self.email,
             'display_name': self.display_name,
             'phone': self.phone,
             'profile_image': self.profile_image,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': self.created_at,
             'is_active': self.is_active,
-            'last_login': self.last_login.isoformat() if self.last_login else None,
-            'joined_group_ids': self.get_joined_group_ids()  # matches Flutter's joinedGroupIds
+            'last_login': self.last_login
         }
+        if fields is not None:
+            data = {key: value for key, value in data.items() if key == 'id' or key in fields}
+        
+        if fields is None or 'joined_group_ids' in fields:
+            if joined_group_ids is None:
+                joined_group_ids = self.get_joined_group_ids()
+            data['joined_group_ids'] = joined_group_ids  # matches Flutter's joinedGroupIds
+        
+        return data
     
     def to_public_dict(self):
         """Public version for showing in group member lists"""
@@ -1,10 +1,27 @@
-from flask import Blueprint, jsonify, render_template
+from flask import Blueprint, jsonify, render_template, request, current_app
 from models.user import User
 from models.stockvel import Stockvel, StockvelMember
+from models.stockvel_archive import StockvelArchive
 from services.database_service import db
+from services import job_service, admin_service, stats_service, archive_service, query_log_service, memory_service
+from services.identity_service import invalidate_all
+from services.serialization_service import serialize_users, serialize_stockvels
+from utils.fieldsets import parse_fieldset
+from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__)
 
+def run_in_background():
+    """Whether the caller asked for the operation to be queued as a job"""
+    return request.args.get('background', '').lower() in ('1', 'true', 'yes')
+
+def queued_response(job, message):
+    return jsonify({
+        'message': message,
+        'job_id': job.id,
+        'status_url': f'/api/admin/jobs/{job.id}'
+    }), 202
+
 @admin_bp.route('/panel')
 def admin_panel():
     """Serve the admin HTML page"""
@@ -12,17 +29,9 @@ def admin_panel():
 
 @admin_bp.route('/stats', methods=['GET'])
 def get_stats():
-    """Get database statistics"""
+    """Get database statistics (cached snapshot, refreshed in the background)"""
     try:
-        total_users = User.query.count()
-        active_users = User.query.filter_by(is_active=True).count()
-        total_stockvels = Stockvel.query.count()
-        
-        return jsonify({
-            'total_users': total_users,
-            'active_users': active_users,
-            'total_stockvels': total_stockvels
-        }), 200
+        return stats_service.get_stats_body().response()
         
     except Exception as e:
         return jsonify({'message': f'Error getting stats: {str(e)}'}), 500
@@ -33,7 +42,7 @@ def get_all_users():
     try:
         users = User.query.order_by(User.created_at.desc()).all()
         return jsonify({
-            'users': [user.to_dict() for user in users]
+            'users': serialize_users(users, parse_fieldset(request.args))
         }), 200
         
     except Exception as e:
@@ -50,14 +59,25 @@ def delete_user(user_id):
         
         email = user.email
         
-        # Delete user (cascade will handle related records if configured)
-        db.session.delete(user)
-        db.session.commit()
+        # Refused up front, so a queued purge doesn't fail later
+        if admin_service.administered_stockvels(user_id):
+            return jsonify({'message': f'User {email} is the admin of a stockvel; delete it or transfer admin rights first'}), 409
+        
+        if run_in_background():
+            job = job_service.enqueue('admin.purge_user', {'user_id': user_id}, priority=job_service.PRIORITY_LOW)
+            return queued_response(job, f'Deletion of user {email} queued')
+        
+        # Batched deletes instead of loading every related row through the ORM
+        deleted = admin_service.purge_user(user_id)
         
         return jsonify({
-            'message': f'User {email} deleted successfully'
+            'message': f'User {email} deleted successfully',
+            'deleted': deleted
         }), 200
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Error deleting user: {str(e)}'}), 500
@@ -66,19 +86,15 @@ def delete_user(user_id):
 def delete_all_users():
     """Delete all users - USE WITH CAUTION"""
     try:
-        # First delete all stockvel members
-        StockvelMember.query.delete()
+        if run_in_background():
+            job = job_service.enqueue('admin.purge_all_users', priority=job_service.PRIORITY_LOW)
+            return queued_response(job, 'Deletion of all users queued')
         
-        # Then delete all stockvels
-        Stockvel.query.delete()
-        
-        # Finally delete all users
-        num_deleted = User.query.delete()
-        
-        db.session.commit()
+        deleted = admin_service.purge_all_users()
         
         return jsonify({
-            'message': f'Successfully deleted {num_deleted} users and all related data'
+            'message': f"Successfully deleted {deleted.get('users', 0)} users and all related data",
+            'deleted': deleted
         }), 200
         
     except Exception as e:
@@ -91,15 +107,8 @@ def get_all_stockvels():
     try:
         stockvels = Stockvel.query.order_by(Stockvel.created_at.desc()).all()
         
-        stockvels_data = []
-        for stockvel in stockvels:
-            stockvel_dict = stockvel.to_dict()
-            # Add admin user info
-            admin = User.query.get(stockvel.admin_user_id)
-            stockvel_dict['admin'] = admin.to_dict() if admin else None
-            # Add member count
-            stockvel_dict['member_count'] = len(stockvel.members)
-            stockvels_data.append(stockvel_dict)
+        # Admin user info and member counts are loaded in bulk, not per stockvel
+        stockvels_data = serialize_stockvels(stockvels, parse_fieldset(request.args), default_include=('admin',))
         
         return jsonify({
             'stockvels': stockvels_data
@@ -119,15 +128,15 @@ def delete_stockvel(stockvel_id):
         
         name = stockvel.name
         
-        # Delete related records first
-        StockvelMember.query.filter_by(stockvel_id=stockvel_id).delete()
+        if run_in_background():
+            job = job_service.enqueue('admin.purge_stockvel', {'stockvel_id': stockvel_id}, priority=job_service.PRIORITY_LOW)
+            return queued_response(job, f'Deletion of stockvel "{name}" queued')
         
-        # Delete stockvel
-        db.session.delete(stockvel)
-        db.session.commit()
+        deleted = admin_service.purge_stockvel(stockvel_id)
         
         return jsonify({
-            'message': f'Stockvel "{name}" deleted successfully'
+            'message': f'Stockvel "{name}" deleted successfully',
+            'deleted': deleted
         }), 200
         
     except Exception as e:
@@ -138,19 +147,185 @@ def delete_stockvel(stockvel_id):
 def delete_all_stockvels():
     """Delete all stockvels - USE WITH CAUTION"""
     try:
-        # First delete all members
-        StockvelMember.query.delete()
+        if run_in_background():
+            job = job_service.enqueue('admin.purge_all_stockvels', priority=job_service.PRIORITY_LOW)
+            return queued_response(job, 'Deletion of all stockvels queued')
+        
+        deleted = admin_service.purge_all_stockvels()
         
-        # Then delete all stockvels
-        num_deleted = Stockvel.query.delete()
+        return jsonify({
+            'message': f"Successfully deleted {deleted.get('stockvels', 0)} stockvels and all related data",
+            'deleted': deleted
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error deleting stockvels: {str(e)}'}), 500
+
+@admin_bp.route('/archives', methods=['GET'])
+def get_archives():
+    """Get archived stockvels (tombstones only, without the packed ledgers)"""
+    try:
+        archives = StockvelArchive.query.order_by(StockvelArchive.archived_at.desc()).all()
+        return jsonify({
+            'archives': [archive.to_dict() for archive in archives]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Error getting archives: {str(e)}'}), 500
+
+@admin_bp.route('/stockvels/archive-closed', methods=['POST'])
+def archive_closed_stockvels():
+    """Move inactive and long-ended stockvels out of the live tables"""
+    try:
+        if run_in_background():
+            job = job_service.enqueue('archive.closed_stockvels', priority=job_service.PRIORITY_LOW)
+            return queued_response(job, 'Archival of closed stockvels queued')
+        
+        result = archive_service.archive_closed_stockvels()
+        
+        return jsonify({
+            'message': f"Archived {result['archived']} stockvels",
+            **result
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error archiving stockvels: {str(e)}'}), 500
+
+@admin_bp.route('/stockvels/<int:stockvel_id>/archive', methods=['POST'])
+def archive_stockvel(stockvel_id):
+    """Archive a specific stockvel now, whether or not it has closed"""
+    try:
+        archive = archive_service.archive_stockvel(stockvel_id)
+        
+        if not archive:
+            return jsonify({'message': 'Stockvel not found'}), 404
         
         db.session.commit()
+        invalidate_all()
         
         return jsonify({
-            'message': f'Successfully deleted {num_deleted} stockvels and all related data'
+            'message': f'Stockvel "{archive.name}" archived successfully',
+            'archive': archive.to_dict()
         }), 200
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'message': f'Error deleting stockvels: {str(e)}'}), 500
+        return jsonify({'message': f'Error archiving stockvel: {str(e)}'}), 500
 
+@admin_bp.route('/archives/<int:stockvel_id>/restore', methods=['POST'])
+def restore_stockvel(stockvel_id):
+    """Move an archived stockvel back into the live tables"""
+    try:
+        stockvel = archive_service.restore_stockvel(stockvel_id)
+        
+        if not stockvel:
+            return jsonify({'message': 'Archived stockvel not found'}), 404
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': f'Stockvel "{stockvel.name}" restored successfully',
+            'stockvel': stockvel.to_dict()
+        }), 200
+        
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error restoring stockvel: {str(e)}'}), 500
+
+@admin_bp.route('/slow-queries', methods=['GET'])
+def get_slow_queries():
+    """Get the slowest logged statements, grouped by fingerprint (?limit=20&sort=total|max|count|mean&hours=)"""
+    try:
+        log = current_app.extensions.get('slow_query_log')
+        if log is None:
+            return jsonify({'message': 'Slow-query log is disabled (SLOW_QUERY_MS=0)', 'queries': []}), 200
+        
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        hours = request.args.get('hours', type=float)
+        since = datetime.utcnow() - timedelta(hours=hours) if hours else None
+        return jsonify({
+            'threshold_ms': current_app.config.get('SLOW_QUERY_MS'),
+            'queries': query_log_service.top_slow_queries(log, limit, request.args.get('sort', 'total'), since)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Error getting slow queries: {str(e)}'}), 500
+
+@admin_bp.route('/memory', methods=['GET'])
+def get_memory():
+    """Get the latest memory report of every worker on this host"""
+    try:
+        return jsonify({
+            'max_rss_mb': current_app.config.get('WORKER_MAX_RSS_MB') or None,
+            'workers': memory_service.worker_reports()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Error getting memory reports: {str(e)}'}), 500
+
+@admin_bp.route('/memory/snapshots', methods=['POST'])
+def trigger_memory_snapshot():
+    """Ask every worker (or ?pid=) to take a tracemalloc snapshot, or to stop tracing with {"action": "stop"}"""
+    try:
+        data = request.get_json(silent=True) or {}
+        action = data.get('action', 'snapshot')
+        if action not in ('snapshot', 'stop'):
+            return jsonify({'message': 'action must be snapshot or stop'}), 400
+        
+        trigger = memory_service.trigger(action, request.args.get('pid', type=int))
+        return jsonify({
+            'message': f'Workers will {action} on their next request',
+            'trigger': trigger,
+            'status_url': '/api/admin/memory'
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'message': f'Error triggering memory snapshot: {str(e)}'}), 500
+
+@admin_bp.route('/jobs/metrics', methods=['GET'])
+def get_job_metrics():
+    """Get background job queue metrics"""
+    try:
+        return jsonify(job_service.get_job_metrics()), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Error getting job metrics: {str(e)}'}), 500
+
+@admin_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status and result of a background job"""
+    try:
+        job = job_service.get_job(job_id)
+        
+        if not job:
+            return jsonify({'message': 'Job not found'}), 404
+        
+        return jsonify({'job': job.to_dict()}), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Error getting job: {str(e)}'}), 500
+
+@admin_bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a background job that no worker has picked up yet"""
+    try:
+        job = job_service.get_job(job_id)
+        
+        if not job:
+            return jsonify({'message': 'Job not found'}), 404
+        
+        if not job_service.cancel_job(job_id):
+            db.session.refresh(job)
+            return jsonify({'message': f'Job is already {job.status}', 'job': job.to_dict()}), 409
+        
+        db.session.refresh(job)
+        return jsonify({'message': 'Job cancelled', 'job': job.to_dict()}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error cancelling job: {str(e)}'}), 500
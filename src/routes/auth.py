@@ -1,7 +1,12 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
+from flask_jwt_extended import jwt_required, create_access_token, current_user, get_jwt
 from models.user import User
 from services.database_service import db
+from services.identity_service import invalidate_user
+from services.revocation_service import revoke_token, revoke_all_sessions
+from services import avatar_service
+from services.write_behind_service import record_activity
+from utils.fieldsets import parse_fieldset
 import re
 import logging
 
@@ -107,11 +112,10 @@ def login():
         if not user.is_active:
             return jsonify({'message': 'Account is deactivated'}), 401
         
-        # Update last login
-        from datetime import datetime
+        # Update last login; written behind in bulk rather than on this request
         import os
-        user.last_login = datetime.utcnow()
-        db.session.commit()
+        user_data = user.to_dict()
+        user_data['last_login'] = record_activity(user.id, 'last_login')
         
         # Generate access token
         access_token = create_access_token(identity=str(user.id))
@@ -123,7 +127,7 @@ def login():
         return jsonify({
             'message': 'Login successful',
             'access_token': access_token,
-            'user': user.to_dict(),
+            'user': user_data,
             'debug_jwt_secret_preview': jwt_secret[:10] + '...'
         }), 200
         
@@ -135,14 +139,9 @@ def login():
 def get_profile():
     """Get current user's profile"""
     try:
-        user_id = int(get_jwt_identity())  # Convert string back to int
-        logger.info(f"Profile request from user_id: {user_id}")
-        user = User.query.get(user_id)
-        
-        if not user:
-            return jsonify({'message': 'User not found'}), 404
-        
-        return jsonify(user.to_dict()), 200
+        # Loaded once per request by the JWT user lookup (see main.create_app)
+        logger.info(f"Profile request from user_id: {current_user.id}")
+        return jsonify(current_user.to_dict(fields=parse_fieldset(request.args).fields)), 200
         
     except Exception as e:
         return jsonify({'message': f'An error occurred: {str(e)}'}), 500
@@ -152,8 +151,7 @@ def get_profile():
 def update_profile():
     """Update current user's profile"""
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
-        user = User.get_by_id(current_user_id)
+        user = User.get_by_id(current_user.id)
         
         if not user:
             return jsonify({'message': 'User not found'}), 404
@@ -166,9 +164,13 @@ def update_profile():
         if 'phone' in data:
             user.phone = data['phone'].strip() if data['phone'] else None
         if 'profile_image' in data:
-            user.profile_image = data['profile_image']
+            # Images are uploaded with POST /api/users/profile/image; only its URLs (or none) are accepted here
+            if data['profile_image'] and not avatar_service.stored_name(data['profile_image']):
+                return jsonify({'message': 'Upload profile images with POST /api/users/profile/image'}), 400
+            user.profile_image = data['profile_image'] or None
             
         db.session.commit()
+        invalidate_user(user.id)
         
         return jsonify({
             'message': 'Profile updated successfully',
@@ -184,8 +186,7 @@ def update_profile():
 def change_password():
     """Change user password"""
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
-        user = User.get_by_id(current_user_id)
+        user = User.get_by_id(current_user.id)
         
         if not user:
             return jsonify({'message': 'User not found'}), 404
@@ -206,7 +207,38 @@ def change_password():
         user.set_password(new_password)
         db.session.commit()
         
-        return jsonify({'message': 'Password changed successfully'}), 200
+        # Sign out every other device; this one continues with a fresh token
+        revoke_all_sessions(user.id)
+        access_token = create_access_token(identity=str(user.id))
+        
+        return jsonify({
+            'message': 'Password changed successfully',
+            'access_token': access_token
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'An error occurred: {str(e)}'}), 500
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """Revoke the access token used for this request"""
+    try:
+        revoke_token(get_jwt())
+        return jsonify({'message': 'Logged out successfully'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'An error occurred: {str(e)}'}), 500
+
+@auth_bp.route('/revoke-all-sessions', methods=['POST'])
+@jwt_required()
+def revoke_sessions():
+    """Revoke every access token issued to the current user, including this one"""
+    try:
+        revoke_all_sessions(current_user.id)
+        return jsonify({'message': 'All sessions have been signed out'}), 200
         
     except Exception as e:
         db.session.rollback()
@@ -1,9 +1,24 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, current_user
 from models.stockvel import Stockvel, StockvelMember, Contribution
 from models.user import User
 from services.database_service import db
+from services.identity_service import invalidate_user
+from services.idempotency_service import idempotent
+from services.membership_service import add_member_if_room
+from services.archive_service import get_archive, user_archives_query, is_archived_member, load_archive
+from services import export_service, mail_service
+from services.event_service import (
+    emit_event, event_stream_response, parse_last_event_id,
+    CONTRIBUTION_CREATED, MEMBER_JOINED, MEMBER_LEFT, MEMBERS_REORDERED
+)
+from services.serialization_service import (
+    serialize_stockvels, add_user_totals, user_stockvels_query, user_totals_query,
+    roster_query, roster_entry, contributions_query, contribution_entry, ledger_bound, USER_TOTAL_FIELDS
+)
+from utils.fieldsets import parse_fieldset
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, date
 from decimal import Decimal
 import logging
@@ -13,10 +28,11 @@ logger = logging.getLogger(__name__)
 
 @stockvels_bp.route('/', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_stockvel():
     """Create a new stockvel/group"""
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
+        current_user_id = current_user.id
         data = request.get_json()
         
         logger.info(f"Create stockvel request from user {current_user_id}")
@@ -60,17 +76,19 @@ def create_stockvel():
         member = StockvelMember(
             stockvel_id=stockvel.id,
             user_id=current_user_id,
-            is_admin=True
+            is_admin=True,
+            position=0  # First in the payout rotation
         )
         db.session.add(member)
         db.session.commit()
+        invalidate_user(current_user_id)
         
         logger.info(f"Stockvel {stockvel.id} created successfully")
         
         return jsonify({
             'message': 'Group created successfully',
             'invite_code': stockvel.invite_code,
-            'stockvel': stockvel.to_dict()
+            'stockvel': serialize_stockvels([stockvel], parse_fieldset(request.args))[0]
         }), 201
         
     except Exception as e:
@@ -82,42 +100,25 @@ def create_stockvel():
 @jwt_required()
 def get_stockvels():
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
+        current_user_id = current_user.id
         logger.info(f"Get stockvels request from user_id: {current_user_id}")
         logger.info(f"Authorization header: {request.headers.get('Authorization', 'MISSING')[:50]}...")
         
         # Get stockvels where user is a member
-        user_stockvels = db.session.query(Stockvel).join(StockvelMember).filter(
-            StockvelMember.user_id == current_user_id,
-            Stockvel.is_active == True
-        ).all()
+        user_stockvels = db.session.execute(user_stockvels_query(current_user_id)).scalars().all()
         
         logger.info(f"Found {len(user_stockvels)} stockvels for user {current_user_id}")
         
+        fieldset = parse_fieldset(request.args)
+        stockvels_data = serialize_stockvels(user_stockvels, fieldset)
+        
         # Add user-specific contribution data to each stockvel
-        stockvels_data = []
-        for stockvel in user_stockvels:
-            stockvel_dict = stockvel.to_dict()
-            
-            # Get user's total contributions to this stockvel
-            user_contributions = db.session.query(Contribution).filter(
-                Contribution.stockvel_id == stockvel.id,
-                Contribution.user_id == current_user_id,
-                Contribution.status == 'confirmed'
-            ).all()
-            
-            user_total_contributed = sum(float(c.amount) for c in user_contributions)
-            
-            # Calculate expected contribution for this user (contribution_amount * max_members for full cycle)
-            # But user only needs to contribute their share: contribution_amount * max_members
-            user_expected_total = float(stockvel.contribution_amount) * stockvel.max_members
-            
-            # Add user-specific data
-            stockvel_dict['user_contributed'] = user_total_contributed
-            stockvel_dict['user_expected'] = user_expected_total
-            stockvel_dict['user_progress_percentage'] = (user_total_contributed / user_expected_total * 100) if user_expected_total > 0 else 0
-            
-            stockvels_data.append(stockvel_dict)
+        if any(fieldset.wants(field) for field in USER_TOTAL_FIELDS):
+            # Get user's total confirmed contributions to all these stockvels in one query
+            user_totals = dict(db.session.execute(
+                user_totals_query([s.id for s in user_stockvels], current_user_id)
+            ).all()) if user_stockvels else {}
+            add_user_totals(user_stockvels, stockvels_data, user_totals, fieldset)
         
         return jsonify({
             'stockvels': stockvels_data
@@ -131,7 +132,7 @@ def get_stockvels():
 @jwt_required()
 def get_stockvel(stockvel_id):
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
+        current_user_id = current_user.id
         
         # Check if user is a member
         member = StockvelMember.query.filter_by(
@@ -146,32 +147,57 @@ def get_stockvel(stockvel_id):
         if not stockvel:
             return jsonify({'error': 'Stockvel not found'}), 404
         
-        # Get members and their details
-        members_data = []
-        for member in stockvel.members:
-            user = User.get_by_id(member.user_id)
-            members_data.append({
-                'id': member.id,
-                'user': user.to_dict() if user else None,
-                'joined_at': member.joined_at.isoformat() if member.joined_at else None,
-                'is_admin': member.is_admin,
-                'total_contributed': float(member.total_contributed)
-            })
-        
-        result = stockvel.to_dict()
-        result['members'] = members_data
+        # Members and their details are embedded unless the caller chose other includes
+        result = serialize_stockvels([stockvel], parse_fieldset(request.args), default_include=('members',))[0]
         
         return jsonify({'stockvel': result}), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to get stockvel', 'details': str(e)}), 500
 
+@stockvels_bp.route('/<int:stockvel_id>/events', methods=['GET'])
+@jwt_required()
+def stockvel_events(stockvel_id):
+    """Server-sent events for one stockvel (contributions, joins, leaves, reorders)"""
+    try:
+        member = StockvelMember.query.filter_by(
+            stockvel_id=stockvel_id,
+            user_id=current_user.id
+        ).first()
+        
+        if not member:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+        return event_stream_response(stockvel_ids=[stockvel_id], last_event_id=last_event_id, viewer_id=current_user.id)
+        
+    except Exception as e:
+        logger.error(f"Error opening event stream: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to open event stream', 'details': str(e)}), 500
+
+@stockvels_bp.route('/events', methods=['GET'])
+@jwt_required()
+def my_events():
+    """Server-sent events for every stockvel the current user belongs to"""
+    try:
+        last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+        return event_stream_response(
+            stockvel_ids=current_user.joined_group_ids,
+            user_id=current_user.id,
+            last_event_id=last_event_id
+        )
+        
+    except Exception as e:
+        logger.error(f"Error opening event stream: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to open event stream', 'details': str(e)}), 500
+
 @stockvels_bp.route('/join', methods=['POST'])
 @jwt_required()
+@idempotent
 def join_by_invite_code():
     """Join a stockvel using an invite code"""
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id = current_user.id
         data = request.get_json()
         
         invite_code = data.get('invite_code', '').strip().upper()
@@ -197,22 +223,24 @@ def join_by_invite_code():
         if existing_member:
             return jsonify({'message': 'You are already a member of this stockvel'}), 400
         
-        # Check if stockvel is full
-        if len(stockvel.members) >= stockvel.max_members:
+        # Add as member; the capacity check is part of the insert so concurrent joins can't overfill
+        try:
+            member = add_member_if_room(stockvel.id, current_user_id)
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'message': 'You are already a member of this stockvel'}), 400
+        
+        if member is None:
+            db.session.rollback()
             return jsonify({'message': 'This stockvel is full'}), 400
         
-        # Add as member
-        member = StockvelMember(
-            stockvel_id=stockvel.id,
-            user_id=current_user_id,
-            is_admin=False
-        )
-        db.session.add(member)
+        emit_event(stockvel.id, MEMBER_JOINED, member.to_dict(), user_id=current_user_id)
         db.session.commit()
+        invalidate_user(current_user_id)
         
         return jsonify({
             'message': 'Successfully joined stockvel!',
-            'stockvel': stockvel.to_dict()
+            'stockvel': serialize_stockvels([stockvel], parse_fieldset(request.args))[0]
         }), 201
         
     except Exception as e:
@@ -222,9 +250,10 @@ def join_by_invite_code():
 
 @stockvels_bp.route('/<int:stockvel_id>/join', methods=['POST'])
 @jwt_required()
+@idempotent
 def join_stockvel(stockvel_id):
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
+        current_user_id = current_user.id
         
         stockvel = Stockvel.query.get(stockvel_id)
         if not stockvel:
@@ -242,17 +271,20 @@ def join_stockvel(stockvel_id):
         if existing_member:
             return jsonify({'error': 'Already a member of this stockvel'}), 400
         
-        # Check if stockvel is full
-        if len(stockvel.members) >= stockvel.max_members:
+        # Add as member; the capacity check is part of the insert so concurrent joins can't overfill
+        try:
+            member = add_member_if_room(stockvel_id, current_user_id)
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'Already a member of this stockvel'}), 400
+        
+        if member is None:
+            db.session.rollback()
             return jsonify({'error': 'Stockvel is full'}), 400
         
-        # Add as member
-        member = StockvelMember(
-            stockvel_id=stockvel_id,
-            user_id=current_user_id
-        )
-        db.session.add(member)
+        emit_event(stockvel_id, MEMBER_JOINED, member.to_dict(), user_id=current_user_id)
         db.session.commit()
+        invalidate_user(current_user_id)
         
         return jsonify({
             'message': 'Successfully joined stockvel',
@@ -265,10 +297,11 @@ def join_stockvel(stockvel_id):
 
 @stockvels_bp.route('/<int:stockvel_id>/contribute', methods=['POST'])
 @jwt_required()
+@idempotent
 def make_contribution(stockvel_id):
     """Make a contribution to a stockvel"""
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id = current_user.id
         data = request.get_json()
         
         if 'amount' not in data:
@@ -294,8 +327,8 @@ def make_contribution(stockvel_id):
             return jsonify({'message': 'Stockvel not found'}), 404
         
         # Verify amount matches expected calculation
-        expected_amount = float(stockvel.contribution_amount) * months_paid
-        if abs(float(amount) - expected_amount) > 0.01:  # Allow small floating point difference
+        expected_amount = stockvel.contribution_amount * months_paid
+        if abs(amount - expected_amount) > Decimal('0.01'):  # Allow for client-side rounding
             return jsonify({'message': 'Invalid contribution amount'}), 400
         
         # Create contribution
@@ -309,6 +342,10 @@ def make_contribution(stockvel_id):
         )
         
         db.session.add(contribution)
+        db.session.flush()
+        emit_event(stockvel_id, CONTRIBUTION_CREATED, contribution.to_dict(), user_id=current_user_id)
+        # Sent by the mail.deliver job; only if this transaction commits
+        mail_service.queue_contribution_receipt(contribution, stockvel, current_user)
         db.session.commit()
         
         return jsonify({
@@ -325,7 +362,7 @@ def make_contribution(stockvel_id):
 @jwt_required()
 def get_contributions(stockvel_id):
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
+        current_user_id = current_user.id
         
         # Check if user is a member
         member = StockvelMember.query.filter_by(
@@ -336,22 +373,83 @@ def get_contributions(stockvel_id):
         if not member:
             return jsonify({'error': 'Access denied'}), 403
         
-        contributions = Contribution.query.filter_by(stockvel_id=stockvel_id).order_by(
-            Contribution.contribution_date.desc()
-        ).all()
-        
-        contributions_data = []
-        for contrib in contributions:
-            user = User.get_by_id(contrib.user_id)
-            contrib_dict = contrib.to_dict()
-            contrib_dict['user_name'] = (user.display_name or user.email.split('@')[0]) if user else "Unknown"
-            contributions_data.append(contrib_dict)
+        # Contributor names come from the same query instead of one user lookup per row
+        contributions_data = [
+            contribution_entry(contrib, user)
+            for contrib, user in db.session.execute(contributions_query(stockvel_id))
+        ]
         
         return jsonify({'contributions': contributions_data}), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to get contributions', 'details': str(e)}), 500
 
+@stockvels_bp.route('/archived', methods=['GET'])
+@jwt_required()
+def get_archived_stockvels():
+    """Closed stockvels the user belonged to that have been moved to the archive"""
+    try:
+        archives = db.session.execute(user_archives_query(current_user.id)).scalars().all()
+        return jsonify({'stockvels': [archive.to_dict() for archive in archives]}), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get archived stockvels', 'details': str(e)}), 500
+
+@stockvels_bp.route('/archived/<int:stockvel_id>', methods=['GET'])
+@jwt_required()
+def get_archived_stockvel(stockvel_id):
+    """An archived stockvel with its members and full ledger, unpacked from the archive"""
+    try:
+        archive = get_archive(stockvel_id)
+        if not archive:
+            return jsonify({'error': 'Archived stockvel not found'}), 404
+        
+        if not is_archived_member(archive, current_user.id):
+            return jsonify({'error': 'Access denied'}), 403
+        
+        archived = load_archive(archive)
+        return jsonify({
+            'archive': archive.to_dict(),
+            'stockvel': archived['stockvel'],
+            'members': archived['members'],
+            'contributions': archived['contributions']
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get archived stockvel', 'details': str(e)}), 500
+
+@stockvels_bp.route('/<int:stockvel_id>/ledger/export', methods=['GET'])
+@jwt_required()
+def export_ledger(stockvel_id):
+    """Download the group's full ledger as CSV or NDJSON (?format=), streamed or via a background job"""
+    try:
+        current_user_id = current_user.id
+        
+        fmt = request.args.get('format', 'csv')
+        if fmt not in export_service.FORMATS:
+            return jsonify({'error': f"Unsupported format; use one of {', '.join(export_service.FORMATS)}"}), 400
+        
+        member = StockvelMember.query.filter_by(stockvel_id=stockvel_id, user_id=current_user_id).first()
+        if not member:
+            # Closed groups stay exportable by their members after archival
+            archive = get_archive(stockvel_id)
+            if not archive or not is_archived_member(archive, current_user_id):
+                return jsonify({'error': 'Access denied'}), 403
+        
+        filename = f'stockvel-{stockvel_id}-ledger'
+        if export_service.should_queue('ledger', stockvel_id):
+            job = export_service.queue_export('ledger', stockvel_id, fmt, current_user_id, filename)
+            return jsonify({
+                'message': 'Export queued',
+                'job_id': job.id,
+                'status_url': f'/api/users/exports/{job.id}'
+            }), 202
+        
+        return export_service.export_response('ledger', stockvel_id, fmt, filename)
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to export ledger', 'details': str(e)}), 500
+
 @stockvels_bp.route('/search', methods=['GET'])
 @jwt_required()
 def search_stockvels():
@@ -368,7 +466,7 @@ def search_stockvels():
         ).limit(20).all()
         
         return jsonify({
-            'stockvels': [stockvel.to_dict() for stockvel in stockvels]
+            'stockvels': serialize_stockvels(stockvels, parse_fieldset(request.args))
         }), 200
         
     except Exception as e:
@@ -379,7 +477,7 @@ def search_stockvels():
 def get_members(stockvel_id):
     """Get all members of a stockvel with their contribution details"""
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id = current_user.id
         
         # Check if user is a member
         member = StockvelMember.query.filter_by(
@@ -395,41 +493,11 @@ def get_members(stockvel_id):
         if not stockvel:
             return jsonify({'error': 'Stockvel not found'}), 404
         
-        # Get all members ordered by position
-        members = StockvelMember.query.filter_by(
-            stockvel_id=stockvel_id
-        ).order_by(
-            StockvelMember.position.asc().nullsfirst(),  # Position first, nulls at the beginning
-            StockvelMember.joined_at.asc()  # Then by join date for members without position
-        ).all()
-        
-        members_data = []
-        for m in members:
-            user = User.get_by_id(m.user_id)
-            if user:
-                # Calculate member's total contributions
-                total_contributed = db.session.query(
-                    func.sum(Contribution.amount)
-                ).filter_by(
-                    stockvel_id=stockvel_id,
-                    user_id=m.user_id
-                ).scalar() or 0
-                
-                # Get last contribution date
-                last_contribution = Contribution.query.filter_by(
-                    stockvel_id=stockvel_id,
-                    user_id=m.user_id
-                ).order_by(Contribution.contribution_date.desc()).first()
-                
-                members_data.append({
-                    'user_id': user.id,
-                    'user_name': user.display_name or user.email.split('@')[0],
-                    'email': user.email,
-                    'is_admin': m.is_admin,
-                    'joined_date': m.joined_at.isoformat() if m.joined_at else None,
-                    'total_contributed': float(total_contributed),
-                    'last_contribution_date': last_contribution.contribution_date.isoformat() if last_contribution else None
-                })
+        # Members ordered by position, with their totals and last contribution in one query
+        members_data = [
+            roster_entry(m, user, total_contributed, last_contribution_date)
+            for m, user, total_contributed, last_contribution_date in db.session.execute(roster_query(stockvel_id))
+        ]
         
         return jsonify({'members': members_data}), 200
         
@@ -442,7 +510,7 @@ def get_members(stockvel_id):
 def leave_stockvel(stockvel_id):
     """Leave a stockvel (remove membership)"""
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id = current_user.id
         
         # Get the stockvel
         stockvel = Stockvel.query.get(stockvel_id)
@@ -476,7 +544,7 @@ def leave_stockvel(stockvel_id):
         ).filter_by(
             stockvel_id=stockvel_id,
             user_id=current_user_id
-        ).scalar() or 0
+        ).filter(ledger_bound([stockvel_id])).scalar() or 0
         
         expected_amount = float(stockvel.contribution_amount) * stockvel.max_members
         
@@ -488,7 +556,9 @@ def leave_stockvel(stockvel_id):
         
         # Remove membership
         db.session.delete(member)
+        emit_event(stockvel_id, MEMBER_LEFT, {'user_id': current_user_id}, user_id=current_user_id)
         db.session.commit()
+        invalidate_user(current_user_id)
         
         logger.info(f"User {current_user_id} left stockvel {stockvel_id}")
         
@@ -507,7 +577,7 @@ def leave_stockvel(stockvel_id):
 def reorder_members(stockvel_id):
     """Reorder members (admin only)"""
     try:
-        current_user_id = int(get_jwt_identity())
+        current_user_id = current_user.id
         data = request.get_json()
         
         if not data or 'member_order' not in data:
@@ -540,6 +610,7 @@ def reorder_members(stockvel_id):
             if member_to_update:
                 member_to_update.position = index
         
+        emit_event(stockvel_id, MEMBERS_REORDERED, {'member_order': member_order}, user_id=current_user_id)
         db.session.commit()
         
         logger.info(f"Member order updated and persisted for stockvel {stockvel_id}: {member_order}")
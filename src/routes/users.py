@@ -1,8 +1,12 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify, send_file, current_app
+from flask_jwt_extended import jwt_required, current_user
 from models.user import User
 from models.stockvel import StockvelMember
 from services.database_service import db
+from services.identity_service import invalidate_user
+from services import job_service, export_service, avatar_service
+from utils.fieldsets import parse_fieldset
+import os
 
 users_bp = Blueprint('users', __name__)
 
@@ -10,22 +14,89 @@ users_bp = Blueprint('users', __name__)
 @jwt_required()
 def get_current_user_profile():
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
-        user = User.get_by_id(current_user_id)
+        return jsonify({'user': current_user.to_dict(fields=parse_fieldset(request.args).fields)}), 200
         
+    except Exception as e:
+        return jsonify({'error': 'Failed to get profile', 'details': str(e)}), 500
+
+@users_bp.route('/profile/image', methods=['POST'])
+@jwt_required()
+def upload_profile_image():
+    """Set the profile image from the request body (raw image bytes, or multipart field ``image``)"""
+    try:
+        user = User.get_by_id(current_user.id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
-            
-        return jsonify({'user': user.to_dict()}), 200
+        
+        # A raw body is streamed straight to disk; multipart uploads are spooled by Werkzeug first
+        if request.mimetype == 'multipart/form-data':
+            if 'image' not in request.files:
+                return jsonify({'error': 'No image field in upload'}), 400
+            stream = request.files['image'].stream
+        else:
+            stream = request.stream
+        
+        try:
+            name, created = avatar_service.store_upload(stream)
+        except avatar_service.ImageTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        except avatar_service.InvalidImage as e:
+            return jsonify({'error': str(e)}), 400
+        
+        user.profile_image = avatar_service.avatar_url(name)
+        if avatar_service.missing_thumbnails(name):
+            job_service.enqueue('avatars.thumbnails', {'name': name}, commit=False)
+        db.session.commit()
+        invalidate_user(user.id)
+        
+        return jsonify({
+            'message': 'Profile image updated',
+            'user': user.to_dict(),
+            'thumbnails': {
+                str(size): avatar_service.avatar_url(name, size)
+                for size in current_app.config.get('AVATAR_THUMBNAIL_SIZES', [])
+            }
+        }), 200
         
     except Exception as e:
-        return jsonify({'error': 'Failed to get profile', 'details': str(e)}), 500
+        db.session.rollback()
+        return jsonify({'error': 'Failed to upload profile image', 'details': str(e)}), 500
+
+@users_bp.route('/avatars/<name>', methods=['GET'])
+def get_avatar(name):
+    """A stored profile image or thumbnail; public, as its name is the hash of its content"""
+    match = avatar_service.NAME.match(name)
+    if not match:
+        return jsonify({'error': 'Image not found'}), 404
+    
+    config = current_app.config
+    max_age = config.get('AVATAR_CACHE_MAX_AGE', 31536000)
+    if not os.path.exists(avatar_service.avatar_path(name)):
+        original = f'{match.group(1)}.{match.group(3)}'
+        if not match.group(2) or not os.path.exists(avatar_service.avatar_path(original)):
+            return jsonify({'error': 'Image not found'}), 404
+        # The thumbnail job hasn't run yet; serve the original briefly in its place
+        name = original
+        max_age = 60
+    
+    mimetype = avatar_service.MIMETYPES[match.group(3)]
+    accel = config.get('AVATAR_ACCEL_REDIRECT')
+    if accel:
+        # nginx sends the file itself from its internal location
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel.rstrip('/') + '/' + name
+    else:
+        response = send_file(avatar_service.avatar_path(name), mimetype=mimetype, conditional=True, etag=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = max_age > 60
+    return response
 
 @users_bp.route('/stats', methods=['GET'])
 @jwt_required()
 def get_user_stats():
     try:
-        current_user_id = int(get_jwt_identity())  # Convert string back to int
+        current_user_id = current_user.id
         
         # Get user stockvel memberships
         memberships = StockvelMember.query.filter_by(user_id=current_user_id).all()
@@ -75,4 +146,84 @@ def search_users():
         return jsonify({'users': users_data}), 200
         
     except Exception as e:
-        return jsonify({'error': 'Search failed', 'details': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': 'Search failed', 'details': str(e)}), 500
+
+@users_bp.route('/contributions/export', methods=['GET'])
+@jwt_required()
+def export_contributions():
+    """Download the user's contributions across all their groups as CSV or NDJSON (?format=)"""
+    try:
+        current_user_id = current_user.id
+        
+        fmt = request.args.get('format', 'csv')
+        if fmt not in export_service.FORMATS:
+            return jsonify({'error': f"Unsupported format; use one of {', '.join(export_service.FORMATS)}"}), 400
+        
+        filename = f'contributions-{current_user_id}'
+        if export_service.should_queue('history', current_user_id):
+            job = export_service.queue_export('history', current_user_id, fmt, current_user_id, filename)
+            return jsonify({
+                'message': 'Export queued',
+                'job_id': job.id,
+                'status_url': f'/api/users/exports/{job.id}'
+            }), 202
+        
+        return export_service.export_response('history', current_user_id, fmt, filename)
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to export contributions', 'details': str(e)}), 500
+
+def _own_export(job_id):
+    """The user's export job, or None for other users' jobs and other tasks"""
+    job = job_service.get_job(job_id)
+    if not job or job.name != 'exports.write' or job.get_payload().get('user_id') != current_user.id:
+        return None
+    return job
+
+@users_bp.route('/exports/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_export(job_id):
+    """Status of a background export; includes the download URL once it has finished"""
+    try:
+        job = _own_export(job_id)
+        if not job:
+            return jsonify({'error': 'Export not found'}), 404
+        
+        result = job.get_result() if job.status == 'succeeded' else None
+        return jsonify({
+            'export': {
+                'id': job.id,
+                'status': job.status,
+                'created_at': job.created_at,
+                'finished_at': job.finished_at,
+                'error': job.last_error if job.status == 'failed' else None,
+                'filename': result and result.get('filename'),
+                'rows': result and result.get('rows'),
+                'bytes': result and result.get('bytes'),
+                'download_url': result and result.get('download_url')
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get export', 'details': str(e)}), 500
+
+@users_bp.route('/exports/<int:job_id>/download', methods=['GET'])
+@jwt_required()
+def download_export(job_id):
+    """Download a finished background export"""
+    try:
+        job = _own_export(job_id)
+        if not job or job.status != 'succeeded':
+            return jsonify({'error': 'Export not found'}), 404
+        
+        result = job.get_result()
+        path = export_service.export_path(result['stored_name'])
+        if not os.path.exists(path):
+            return jsonify({'error': 'Export has expired'}), 410
+        
+        fmt = result['stored_name'].rsplit('.', 1)[-1]
+        return send_file(path, mimetype=export_service.FORMATS[fmt], as_attachment=True,
+                         download_name=result['filename'], conditional=True)
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to download export', 'details': str(e)}), 500
@@ -0,0 +1,142 @@
+from services.database_service import db
+from services.job_service import task, report_progress
+from services.identity_service import invalidate_user, invalidate_all
+from services.stats_service import invalidate_stats
+from models.user import User
+from models.stockvel import Stockvel, StockvelMember, Contribution
+from models.activity_event import ActivityEvent
+from models.idempotency_key import IdempotencyKey
+from models.stockvel_archive import StockvelArchive, ArchivedStockvelMember
+from flask import current_app
+from sqlalchemy import select
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+def delete_in_chunks(model, *conditions, batch_size=None, progress=None):
+    """Delete matching rows in bounded batches, committing after each one.
+
+    Each batch is a single set-based DELETE of at most ``batch_size`` ids, so
+    locks are held briefly and other requests can interleave between batches.
+    Returns the number of rows deleted.
+    """
+    batch_size = batch_size or current_app.config.get('ADMIN_PURGE_BATCH_SIZE', 1000)
+    pause = current_app.config.get('ADMIN_PURGE_PAUSE', 0)
+    table = model.__table__
+    total = 0
+
+    while True:
+        batch = select(table.c.id).where(*conditions).limit(batch_size)
+        deleted = db.session.execute(table.delete().where(table.c.id.in_(batch))).rowcount
+        db.session.commit()
+
+        total += deleted
+        if progress:
+            progress(table.name, total)
+        if deleted < batch_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+class PurgeProgress:
+    """Collects per-table deletion counts and forwards them to the job/log"""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.deleted = {}
+
+    def __call__(self, table_name, total):
+        self.deleted[table_name] = total
+        logger.info(f"{self.operation}: deleted {total} rows from {table_name}")
+        report_progress(operation=self.operation, deleted=self.deleted)
+
+def administered_stockvels(user_id):
+    """Ids of the live stockvels ``user_id`` is the admin of"""
+    return db.session.execute(
+        select(Stockvel.id).where(Stockvel.admin_user_id == user_id).order_by(Stockvel.id)
+    ).scalars().all()
+
+def purge_user(user_id, batch_size=None):
+    """Delete a user with their memberships and contributions in batches.
+
+    Raises ValueError, before deleting anything, while the user administers
+    a stockvel: stockvels.admin_user_id has no ON DELETE action, so the last
+    DELETE would fail after the batches had already committed.
+    """
+    stockvel_ids = administered_stockvels(user_id)
+    if stockvel_ids:
+        raise ValueError(
+            f"User {user_id} is the admin of stockvels {', '.join(map(str, stockvel_ids))}; "
+            "delete those or transfer admin rights first"
+        )
+    progress = PurgeProgress(f'purge_user:{user_id}')
+
+    delete_in_chunks(IdempotencyKey, IdempotencyKey.user_id == user_id, batch_size=batch_size, progress=progress)
+    delete_in_chunks(Contribution, Contribution.user_id == user_id, batch_size=batch_size, progress=progress)
+    delete_in_chunks(StockvelMember, StockvelMember.user_id == user_id, batch_size=batch_size, progress=progress)
+    delete_in_chunks(ArchivedStockvelMember, ArchivedStockvelMember.user_id == user_id, batch_size=batch_size, progress=progress)
+
+    # ON DELETE CASCADE removes anything added since the batches ran
+    delete_in_chunks(User, User.id == user_id, batch_size=batch_size, progress=progress)
+    invalidate_user(user_id)
+    invalidate_stats()
+    return progress.deleted
+
+def purge_stockvel(stockvel_id, batch_size=None):
+    """Delete a stockvel with its members and contributions in batches"""
+    progress = PurgeProgress(f'purge_stockvel:{stockvel_id}')
+
+    delete_in_chunks(ActivityEvent, ActivityEvent.stockvel_id == stockvel_id, batch_size=batch_size, progress=progress)
+    delete_in_chunks(Contribution, Contribution.stockvel_id == stockvel_id, batch_size=batch_size, progress=progress)
+    delete_in_chunks(StockvelMember, StockvelMember.stockvel_id == stockvel_id, batch_size=batch_size, progress=progress)
+    delete_in_chunks(Stockvel, Stockvel.id == stockvel_id, batch_size=batch_size, progress=progress)
+    invalidate_all()
+    invalidate_stats()
+    return progress.deleted
+
+def purge_all_stockvels(batch_size=None):
+    """Delete every stockvel with all members and contributions in batches"""
+    progress = PurgeProgress('purge_all_stockvels')
+
+    delete_in_chunks(ArchivedStockvelMember, batch_size=batch_size, progress=progress)
+    delete_in_chunks(StockvelArchive, batch_size=batch_size, progress=progress)
+    delete_in_chunks(ActivityEvent, batch_size=batch_size, progress=progress)
+    delete_in_chunks(Contribution, batch_size=batch_size, progress=progress)
+    delete_in_chunks(StockvelMember, batch_size=batch_size, progress=progress)
+    delete_in_chunks(Stockvel, batch_size=batch_size, progress=progress)
+    invalidate_all()
+    invalidate_stats()
+    return progress.deleted
+
+def purge_all_users(batch_size=None):
+    """Delete every user and all stockvel data in batches"""
+    progress = PurgeProgress('purge_all_users')
+
+    delete_in_chunks(IdempotencyKey, batch_size=batch_size, progress=progress)
+    delete_in_chunks(ArchivedStockvelMember, batch_size=batch_size, progress=progress)
+    delete_in_chunks(StockvelArchive, batch_size=batch_size, progress=progress)
+    delete_in_chunks(ActivityEvent, batch_size=batch_size, progress=progress)
+    delete_in_chunks(Contribution, batch_size=batch_size, progress=progress)
+    delete_in_chunks(StockvelMember, batch_size=batch_size, progress=progress)
+    delete_in_chunks(Stockvel, batch_size=batch_size, progress=progress)
+    delete_in_chunks(User, batch_size=batch_size, progress=progress)
+    invalidate_all()
+    invalidate_stats()
+    return progress.deleted
+
+@task('admin.purge_user')
+def purge_user_task(user_id):
+    return purge_user(user_id)
+
+@task('admin.purge_stockvel')
+def purge_stockvel_task(stockvel_id):
+    return purge_stockvel(stockvel_id)
+
+@task('admin.purge_all_stockvels')
+def purge_all_stockvels_task():
+    return purge_all_stockvels()
+
+@task('admin.purge_all_users')
+def purge_all_users_task():
+    return purge_all_users()
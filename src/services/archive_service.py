@@ -0,0 +1,242 @@
+"""
+Archival of closed stockvels out of the live tables.
+
+A stockvel is closed when it was deactivated, or its end_date passed, more
+than ARCHIVE_AFTER_DAYS ago. Archiving packs the group row, its members
+and its contributions into one gzip-compressed JSON document on a
+``stockvel_archives`` tombstone, then deletes them from the live tables, all
+in one transaction per group, so ``stockvels``, ``stockvel_members`` and
+``contributions`` only hold groups that can still change. Members read an
+archived group through ``load_archive``; ``restore_stockvel`` puts it back
+under its original ids.
+"""
+from services.database_service import db
+from services.job_service import task, report_progress
+from services.identity_service import invalidate_all
+from models.user import User
+from models.stockvel import Stockvel, StockvelMember, Contribution
+from models.stockvel_archive import StockvelArchive, ArchivedStockvelMember
+from models.activity_event import ActivityEvent
+from flask import current_app
+from sqlalchemy import select, insert, delete, and_, or_, DateTime, Numeric
+from datetime import datetime, timedelta
+from decimal import Decimal
+import gzip
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT_VERSION = 1
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot archive {type(value).__name__}")
+
+def _row(obj):
+    """Column values of a model instance, keyed by column name"""
+    return {column.name: getattr(obj, column.key) for column in obj.__table__.columns}
+
+def _typed(model, data):
+    """Column values from an archived document back as the column types"""
+    values = {}
+    for column in model.__table__.columns:
+        value = data.get(column.name)
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, Numeric):
+            value = Decimal(value)
+        values[column.name] = value
+    return values
+
+def pack(document):
+    return gzip.compress(json.dumps(document, default=_encode, separators=(',', ':')).encode('utf-8'))
+
+def unpack(payload):
+    return json.loads(gzip.decompress(payload))
+
+def closed_stockvels_query(limit, now=None, exclude=()):
+    """Ids of closed stockvels, skipping ones restored within the last ARCHIVE_AFTER_DAYS"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=current_app.config.get('ARCHIVE_AFTER_DAYS', 90))
+    recently_restored = select(StockvelArchive.stockvel_id).where(StockvelArchive.restored_at >= cutoff)
+    query = (
+        select(Stockvel.id)
+        .where(
+            or_(and_(Stockvel.is_active == False, Stockvel.deactivated_at < cutoff), Stockvel.end_date < cutoff),
+            Stockvel.id.notin_(recently_restored)
+        )
+        .order_by(Stockvel.id)
+        .limit(limit)
+    )
+    if exclude:
+        query = query.where(Stockvel.id.notin_(exclude))
+    return query
+
+def archive_stockvel(stockvel_id):
+    """Move one stockvel and its ledger into the archive; the caller commits.
+
+    The stockvel row is locked first, like a join (membership_service), so no
+    member or contribution can be added while it is being packed. Returns the
+    StockvelArchive, or None if the stockvel doesn't exist.
+    """
+    stockvel = db.session.get(Stockvel, stockvel_id, with_for_update=True)
+    if stockvel is None:
+        return None
+
+    members = db.session.execute(
+        select(StockvelMember).where(StockvelMember.stockvel_id == stockvel_id).order_by(StockvelMember.id)
+    ).scalars().all()
+    contributions = db.session.execute(
+        select(Contribution).where(Contribution.stockvel_id == stockvel_id).order_by(Contribution.id)
+    ).scalars().all()
+
+    archive = StockvelArchive.query.filter_by(stockvel_id=stockvel_id).first() or StockvelArchive(stockvel_id=stockvel_id)
+    archive.name = stockvel.name
+    archive.admin_user_id = stockvel.admin_user_id
+    archive.status = stockvel.status
+    if not stockvel.is_active:
+        archive.reason = 'inactive'
+    elif stockvel.end_date and stockvel.end_date < datetime.utcnow():
+        archive.reason = 'ended'
+    else:
+        archive.reason = 'manual'  # Archived by an admin while still open
+    archive.start_date = stockvel.start_date
+    archive.end_date = stockvel.end_date
+    archive.member_count = len(members)
+    archive.contribution_count = len(contributions)
+    archive.total_contributed = sum((c.amount for c in contributions), Decimal('0'))
+    archive.archived_at = datetime.utcnow()
+    archive.restored_at = None
+    archive.payload = pack({
+        'version': ARCHIVE_FORMAT_VERSION,
+        'stockvel': _row(stockvel),
+        'members': [_row(m) for m in members],
+        'contributions': [_row(c) for c in contributions]
+    })
+    archive.members = [ArchivedStockvelMember(user_id=m.user_id) for m in members]
+    db.session.add(archive)
+    db.session.flush()
+
+    # Activity events only matter to open streams, so they aren't kept
+    db.session.execute(delete(ActivityEvent).where(ActivityEvent.stockvel_id == stockvel_id))
+    db.session.execute(delete(Contribution).where(Contribution.stockvel_id == stockvel_id))
+    db.session.execute(delete(StockvelMember).where(StockvelMember.stockvel_id == stockvel_id))
+    db.session.execute(delete(Stockvel).where(Stockvel.id == stockvel_id))
+    for obj in [stockvel, *members, *contributions]:
+        db.session.expunge(obj)
+
+    logger.info(f"Archived stockvel {stockvel_id} ({archive.member_count} members, {archive.contribution_count} contributions)")
+    return archive
+
+def archive_closed_stockvels(batch_size=None, limit=None):
+    """Archive closed stockvels, ``batch_size`` ids at a time and one transaction per group.
+
+    A group that fails to archive is logged, rolled back and skipped for the
+    rest of the run. Returns the counts archived and failed.
+    """
+    batch_size = batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', 50)
+    pause = current_app.config.get('ADMIN_PURGE_PAUSE', 0)
+    archived = 0
+    failed = []
+
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        stockvel_ids = db.session.execute(closed_stockvels_query(size, exclude=failed)).scalars().all()
+        if not stockvel_ids:
+            break
+
+        for stockvel_id in stockvel_ids:
+            try:
+                archive_stockvel(stockvel_id)
+                db.session.commit()
+                archived += 1
+            except Exception as e:
+                db.session.rollback()
+                failed.append(stockvel_id)
+                logger.error(f"Failed to archive stockvel {stockvel_id}: {str(e)}", exc_info=True)
+
+        report_progress(operation='archive_closed_stockvels', archived=archived, failed=len(failed))
+        if len(stockvel_ids) < size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    if archived:
+        # Cached identities carry joined_group_ids
+        invalidate_all()
+    return {'archived': archived, 'failed': failed}
+
+def get_archive(stockvel_id):
+    """The archive of a stockvel that is currently out of the live tables"""
+    return StockvelArchive.query.filter_by(stockvel_id=stockvel_id, restored_at=None).first()
+
+def user_archives_query(user_id):
+    """Archived stockvels the user was a member of, most recently archived first"""
+    return (
+        select(StockvelArchive)
+        .join(ArchivedStockvelMember, ArchivedStockvelMember.archive_id == StockvelArchive.id)
+        .where(ArchivedStockvelMember.user_id == user_id, StockvelArchive.restored_at.is_(None))
+        .order_by(StockvelArchive.archived_at.desc())
+    )
+
+def is_archived_member(archive, user_id):
+    return db.session.execute(
+        select(ArchivedStockvelMember.id).where(
+            ArchivedStockvelMember.archive_id == archive.id,
+            ArchivedStockvelMember.user_id == user_id
+        ).limit(1)
+    ).first() is not None
+
+def load_archive(archive):
+    """The archived group, members and contributions with their original column types"""
+    document = unpack(archive.payload)
+    return {
+        'stockvel': _typed(Stockvel, document['stockvel']),
+        'members': [_typed(StockvelMember, m) for m in document['members']],
+        'contributions': [_typed(Contribution, c) for c in document['contributions']]
+    }
+
+def restore_stockvel(stockvel_id):
+    """Put an archived stockvel back into the live tables under its original ids; the caller commits.
+
+    Members and contributions of users that have since been deleted are
+    dropped. The tombstone is kept with ``restored_at`` set, which keeps the
+    group out of archival for another ARCHIVE_AFTER_DAYS. Returns the
+    Stockvel, or None when there is no archive to restore.
+    """
+    archive = get_archive(stockvel_id)
+    if archive is None:
+        return None
+    if db.session.get(Stockvel, stockvel_id) is not None:
+        raise ValueError(f"Stockvel {stockvel_id} already exists")
+
+    document = load_archive(archive)
+    stockvel = document['stockvel']
+    user_ids = {stockvel['admin_user_id']} | {m['user_id'] for m in document['members']}
+    existing = set(db.session.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+    if stockvel['admin_user_id'] not in existing:
+        raise ValueError(f"Admin user {stockvel['admin_user_id']} of stockvel {stockvel_id} no longer exists")
+
+    if Stockvel.query.filter_by(invite_code=stockvel['invite_code']).first():
+        stockvel['invite_code'] = Stockvel.generate_invite_code()
+
+    db.session.execute(insert(Stockvel), [stockvel])
+    members = [m for m in document['members'] if m['user_id'] in existing]
+    if members:
+        db.session.execute(insert(StockvelMember), members)
+    contributions = [c for c in document['contributions'] if c['user_id'] in existing]
+    if contributions:
+        db.session.execute(insert(Contribution), contributions)
+
+    archive.restored_at = datetime.utcnow()
+    invalidate_all(commit=False)
+    logger.info(f"Restored stockvel {stockvel_id} ({len(members)} members, {len(contributions)} contributions)")
+    return db.session.get(Stockvel, stockvel_id)
+
+@task('archive.closed_stockvels')
+def archive_closed_stockvels_task(limit=None):
+    return archive_closed_stockvels(limit=limit)
@@ -0,0 +1,201 @@
+"""
+Profile images stored by content hash.
+
+An upload is streamed from the request in AVATAR_CHUNK_SIZE pieces into a
+temporary file while it is hashed, so it never sits in memory whole, then
+renamed to ``<sha256>.<ext>`` in UPLOAD_FOLDER/avatars. Identical images
+share one file. Names never change content, so they are served with a year
+of ``Cache-Control: immutable``, directly by nginx (AVATAR_ACCEL_REDIRECT,
+or a plain location on the folder) or with sendfile through the WSGI file
+wrapper.
+
+Square thumbnails ``<sha256>_<size>.<ext>`` for AVATAR_THUMBNAIL_SIZES are
+made by the ``avatars.thumbnails`` job, off the request thread; until they
+exist the original is served in their place. Thumbnails need Pillow.
+"""
+from services.database_service import db
+from services.job_service import task
+from models.user import User
+from flask import current_app
+from sqlalchemy import select
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only originals are served
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+URL_PREFIX = '/api/users/avatars/'
+NAME = re.compile(r'^([0-9a-f]{64})(?:_(\d+))?\.(jpg|png|webp)$')
+
+MIMETYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp'
+}
+
+PIL_FORMATS = {
+    'jpg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP'
+}
+
+class InvalidImage(ValueError):
+    pass
+
+class ImageTooLarge(ValueError):
+    pass
+
+def avatar_folder():
+    folder = current_app.config.get('UPLOAD_FOLDER', 'uploads')
+    # Relative to the project root, since the web and worker processes run from different directories
+    folder = folder if os.path.isabs(folder) else os.path.join(BASE_DIR, folder)
+    return os.path.join(folder, 'avatars')
+
+def avatar_path(name):
+    return os.path.join(avatar_folder(), name)
+
+def sniff(head):
+    """File extension for the image type in the first bytes, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def thumbnail_name(name, size):
+    digest, _, ext = NAME.match(name).groups()
+    return f'{digest}_{size}.{ext}'
+
+def avatar_url(name, size=None):
+    return URL_PREFIX + (thumbnail_name(name, size) if size else name)
+
+def stored_name(url):
+    """The original's file name for one of our avatar URLs, or None for anything else"""
+    if not url or not url.startswith(URL_PREFIX):
+        return None
+    match = NAME.match(url[len(URL_PREFIX):])
+    if not match or match.group(2):
+        return None
+    return match.group(0) if os.path.exists(avatar_path(match.group(0))) else None
+
+def store_upload(stream):
+    """Write an image from a file-like ``stream`` to the avatar folder.
+
+    Returns ``(name, created)``; ``created`` is False when the same image was
+    already stored. Raises InvalidImage or ImageTooLarge.
+    """
+    config = current_app.config
+    max_bytes = config.get('AVATAR_MAX_BYTES', 5 * 1024 * 1024)
+    chunk_size = config.get('AVATAR_CHUNK_SIZE', 64 * 1024)
+    folder = avatar_folder()
+    os.makedirs(folder, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    ext = None
+    # In the same folder, so the final rename is atomic
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = sniff(chunk[:16])
+                    if ext is None:
+                        raise InvalidImage('Only JPEG, PNG and WebP images are accepted')
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLarge(f'Images may be at most {max_bytes // 1024} KB')
+                digest.update(chunk)
+                f.write(chunk)
+        if ext is None:
+            raise InvalidImage('No image received')
+
+        name = f'{digest.hexdigest()}.{ext}'
+        path = avatar_path(name)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return name, False
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        logger.info(f"Stored avatar {name} ({size} bytes)")
+        return name, True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def missing_thumbnails(name):
+    sizes = current_app.config.get('AVATAR_THUMBNAIL_SIZES', [])
+    return [size for size in sizes if not os.path.exists(avatar_path(thumbnail_name(name, size)))]
+
+def make_thumbnails(name):
+    """Write the missing thumbnails of an original; returns the names written"""
+    if Image is None:
+        logger.warning(f"Pillow is not installed; no thumbnails for {name}")
+        return []
+    ext = NAME.match(name).group(3)
+    written = []
+    with Image.open(avatar_path(name)) as original:
+        image = ImageOps.exif_transpose(original)
+        if ext == 'jpg' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        for size in missing_thumbnails(name):
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            path = avatar_path(thumbnail_name(name, size))
+            tmp_path = f'{path}.tmp'
+            thumbnail.save(tmp_path, PIL_FORMATS[ext], quality=85, optimize=True)
+            os.replace(tmp_path, path)
+            written.append(os.path.basename(path))
+    return written
+
+@task('avatars.thumbnails')
+def make_thumbnails_task(name):
+    written = make_thumbnails(name)
+    logger.info(f"Made {len(written)} thumbnail(s) for avatar {name}")
+    return {'thumbnails': written}
+
+def compact_avatars():
+    """Delete avatars no user refers to any more, with their thumbnails.
+
+    Files younger than a day are kept, so an upload whose profile update
+    hasn't committed yet is never removed.
+    """
+    folder = avatar_folder()
+    if not os.path.isdir(folder):
+        return 0
+    referenced = set()
+    for url in db.session.execute(select(User.profile_image).where(User.profile_image.like(URL_PREFIX + '%'))).scalars():
+        match = NAME.match(url[len(URL_PREFIX):])
+        if match:
+            referenced.add(match.group(1))
+
+    cutoff = (datetime.now() - timedelta(days=1)).timestamp()
+    deleted = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        match = NAME.match(name)
+        digest = match.group(1) if match else None
+        if digest in referenced or os.path.getmtime(path) >= cutoff:
+            continue
+        os.remove(path)
+        deleted += 1
+    return deleted
+
+@task('avatars.compact')
+def compact_avatars_task():
+    return {'deleted': compact_avatars()}
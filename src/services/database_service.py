@@ -1,7 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from contextlib import contextmanager
 
 db = SQLAlchemy()
 
+# Set in session.info while the session's commits are deferred (see single_transaction)
+DEFERRED_COMMIT = 'deferred_commit'
+
 def init_db(app):
     """Initialize database with app"""
     db.init_app(app)
@@ -12,4 +19,71 @@ def create_tables():
     
 def drop_tables():
     """Drop all database tables"""
-    db.drop_all()
\ No newline at end of file
+    db.drop_all()
+
+def init_sqlite_pragmas(app):
+    """Apply SQLITE_PRAGMAS to every connection of a file-backed SQLite database.
+
+    WAL lets readers run while a request writes, where the default rollback
+    journal locks the whole file; with synchronous=NORMAL commits only sync
+    the WAL at checkpoints. In-memory databases and other backends are left alone.
+    """
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    if not pragmas:
+        return
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+@contextmanager
+def single_transaction():
+    """Run a block whose ``db.session.commit()`` calls only take effect together, when it ends.
+
+    Inside the block ``db.session`` is joined to one outer transaction and
+    each commit releases a SAVEPOINT, so code that commits (a view) and what
+    the caller writes afterwards land in the same transaction. The outer
+    transaction is committed when the block exits normally and rolled back if
+    it raises; ``after_commit`` listeners run once, after the outer commit.
+    """
+    bind = db.session.get_bind()
+    # Ends the request's session (and any SAVEPOINT it holds) before the outer transaction starts
+    db.session.remove()
+    owned = not isinstance(bind, Connection)
+    connection = bind.connect() if owned else bind
+    # pysqlite only issues BEGIN before DML, so a first SAVEPOINT would be committed on its release
+    sqlite = owned and connection.dialect.name == 'sqlite'
+    if sqlite:
+        isolation_level = connection.connection.driver_connection.isolation_level
+        connection.connection.driver_connection.isolation_level = None
+    # Already inside a transaction (the test harness), the outer one is a SAVEPOINT
+    outer = connection.begin_nested() if connection.in_transaction() else connection.begin()
+    if sqlite:
+        connection.exec_driver_sql('BEGIN')
+
+    session = Session(bind=connection, join_transaction_mode='create_savepoint', query_cls=db.Query)
+    session.info[DEFERRED_COMMIT] = True
+    db.session.registry.set(session)
+    try:
+        yield session
+        session.flush()
+        outer.commit()
+        session.info.pop(DEFERRED_COMMIT)
+        session.dispatch.after_commit(session)
+    except BaseException:
+        if outer.is_active:
+            outer.rollback()
+        raise
+    finally:
+        db.session.remove()
+        if sqlite:
+            connection.connection.driver_connection.isolation_level = isolation_level
+        if owned:
+            connection.close()
@@ -0,0 +1,408 @@
+"""
+Group activity events delivered as server-sent events.
+
+Routes call ``emit_event`` inside the transaction of the change they make, so
+an event is stored in ``activity_events`` if and only if the change commits.
+Every worker fans events out to its open streams through a broker:
+
+- ``PostgresEventBroker`` sends ``pg_notify`` in the same transaction and one
+  LISTEN thread per worker dispatches the notifications after commit.
+- ``EventBroker`` (SQLite, tests) dispatches in-process after commit.
+
+Streams subscribe first and then replay stored events after the client's
+Last-Event-ID, so nothing is lost between the replay and the live feed. An
+idle stream is only a queue in the broker's index; under the ASGI mode
+(asgi.py) it costs no thread and holds no database connection.
+
+Membership is checked when a stream opens. When its member leaves, a
+group's stream is closed after delivering the ``member.left`` event, and
+the member's own feed stops following the group; a reconnect is checked
+again.
+"""
+from services.database_service import db, DEFERRED_COMMIT
+from services.job_service import task
+from models.activity_event import ActivityEvent
+from flask import current_app
+from sqlalchemy import select, func, or_, event as sa_event
+from sqlalchemy.orm import Session
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import asyncio
+import json
+import logging
+import queue
+import select as select_module
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONTRIBUTION_CREATED = 'contribution.created'
+MEMBER_JOINED = 'member.joined'
+MEMBER_LEFT = 'member.left'
+MEMBERS_REORDERED = 'members.reordered'
+
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more; larger events are sent by id
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+# Events committed in this session, published by the in-process broker after commit
+PENDING_KEY = 'pending_activity_events'
+# ...and those whose SAVEPOINT was released inside single_transaction, kept past later rollbacks
+RELEASED_KEY = 'released_activity_events'
+
+# Queued after the last event of a closed subscription
+CLOSED = object()
+
+_broker = None
+_broker_lock = threading.Lock()
+
+class Subscription(ABC):
+    """One open stream: the groups (and, for the user feed, the member) it follows.
+
+    ``viewer_id`` is the member a group's stream was opened for; it is
+    closed when they leave the group.
+    """
+
+    def __init__(self, stockvel_ids=(), user_id=None, viewer_id=None):
+        self.stockvel_ids = set(stockvel_ids)
+        self.user_id = user_id
+        self.viewer_id = viewer_id if viewer_id is not None else user_id
+        self.overflowed = False
+        self.closed = False
+
+    @abstractmethod
+    def deliver(self, event):
+        """Queue ``event`` (or CLOSED) for the stream; must not block"""
+
+    def close(self):
+        self.closed = True
+        self.deliver(CLOSED)
+
+class QueueSubscription(Subscription):
+    """Subscription read by a request thread (WSGI)"""
+
+    def __init__(self, stockvel_ids=(), user_id=None, maxsize=100, viewer_id=None):
+        super().__init__(stockvel_ids, user_id, viewer_id)
+        self.queue = queue.Queue(maxsize)
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A client this far behind reconnects and catches up with Last-Event-ID
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class AsyncSubscription(Subscription):
+    """Subscription read by a coroutine on ``loop`` (ASGI); delivery is thread-safe"""
+
+    def __init__(self, loop, stockvel_ids=(), user_id=None, maxsize=100, viewer_id=None):
+        super().__init__(stockvel_ids, user_id, viewer_id)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def deliver(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class EventBroker:
+    """In-process fan-out of events to the subscriptions of this worker"""
+
+    notify_in_transaction = False
+
+    def __init__(self):
+        self._by_stockvel = {}
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def _index(self, index, key, subscription, add=True):
+        subscriptions = index.setdefault(key, set())
+        if add:
+            subscriptions.add(subscription)
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del index[key]
+
+    def subscribe(self, subscription):
+        with self._lock:
+            for stockvel_id in subscription.stockvel_ids:
+                self._index(self._by_stockvel, stockvel_id, subscription)
+            if subscription.user_id is not None:
+                self._index(self._by_user, subscription.user_id, subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for stockvel_id in subscription.stockvel_ids:
+                self._index(self._by_stockvel, stockvel_id, subscription, add=False)
+            if subscription.user_id is not None:
+                self._index(self._by_user, subscription.user_id, subscription, add=False)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subs in self._by_stockvel.values() for s in subs} | {s for subs in self._by_user.values() for s in subs})
+
+    def dispatch(self, event):
+        closing = []
+        with self._lock:
+            targets = set(self._by_stockvel.get(event['stockvel_id'], ()))
+            # The user feed follows the member's groups as they join and leave
+            for subscription in self._by_user.get(event.get('user_id'), ()):
+                targets.add(subscription)
+                if event['type'] == MEMBER_JOINED and event['stockvel_id'] not in subscription.stockvel_ids:
+                    subscription.stockvel_ids.add(event['stockvel_id'])
+                    self._index(self._by_stockvel, event['stockvel_id'], subscription)
+                elif event['type'] == MEMBER_LEFT and event['stockvel_id'] in subscription.stockvel_ids:
+                    subscription.stockvel_ids.discard(event['stockvel_id'])
+                    self._index(self._by_stockvel, event['stockvel_id'], subscription, add=False)
+
+            # A group's stream ends when the member it was opened for leaves
+            if event['type'] == MEMBER_LEFT:
+                for subscription in targets:
+                    if subscription.user_id is None and subscription.viewer_id is not None and subscription.viewer_id == event.get('user_id'):
+                        closing.append(subscription)
+                        for stockvel_id in subscription.stockvel_ids:
+                            self._index(self._by_stockvel, stockvel_id, subscription, add=False)
+                        subscription.stockvel_ids = set()
+
+        for subscription in targets:
+            subscription.deliver(event)
+        for subscription in closing:
+            subscription.close()
+
+    def publish(self, event):
+        self.dispatch(event)
+
+    def start(self, app):
+        pass
+
+class PostgresEventBroker(EventBroker):
+    """Fan-out across workers with LISTEN/NOTIFY on EVENTS_CHANNEL"""
+
+    notify_in_transaction = True
+
+    def __init__(self, channel):
+        super().__init__()
+        self.channel = channel
+        self.last_id = 0
+        self._thread = None
+
+    def start(self, app):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, args=(app,), name='event-listener', daemon=True)
+            self._thread.start()
+
+    def _listen(self, app):
+        backoff = 1
+        while True:
+            with app.app_context():
+                try:
+                    raw = db.engine.raw_connection()
+                except Exception as e:
+                    logger.error(f"Event listener could not connect: {str(e)}")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+                try:
+                    connection = raw.driver_connection
+                    connection.autocommit = True
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'LISTEN "{self.channel}"')
+                    # Events committed while we were not listening
+                    self._catch_up()
+                    backoff = 1
+
+                    while True:
+                        if select_module.select([connection], [], [], 5) == ([], [], []):
+                            continue
+                        connection.poll()
+                        while connection.notifies:
+                            self._receive(connection.notifies.pop(0).payload)
+                except Exception as e:
+                    logger.error(f"Event listener failed, reconnecting: {str(e)}", exc_info=True)
+                    raw.invalidate()
+                    db.session.remove()
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+
+    def _catch_up(self):
+        if not self.last_id:
+            return
+        rows = db.session.execute(
+            select(ActivityEvent).where(ActivityEvent.id > self.last_id).order_by(ActivityEvent.id)
+        ).scalars().all()
+        db.session.rollback()
+        for row in rows:
+            self._dispatch_new(row.to_dict())
+
+    def _receive(self, payload):
+        event = json.loads(payload)
+        if 'type' not in event:
+            row = db.session.get(ActivityEvent, event['id'])
+            db.session.rollback()
+            if row is None:
+                return
+            event = row.to_dict()
+        self._dispatch_new(event)
+
+    def _dispatch_new(self, event):
+        self.last_id = max(self.last_id, event['id'])
+        self.dispatch(event)
+
+def get_broker():
+    """The worker's broker, chosen by EVENTS_BROKER (default: postgres on PostgreSQL, else local)"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                kind = current_app.config.get('EVENTS_BROKER') or (
+                    'postgres' if db.engine.dialect.name == 'postgresql' else 'local'
+                )
+                broker = PostgresEventBroker(current_app.config.get('EVENTS_CHANNEL', 'activity_events')) if kind == 'postgres' else EventBroker()
+                broker.start(current_app._get_current_object())
+                _broker = broker
+    return _broker
+
+# On the Session class rather than db.session, so sessions bound elsewhere (the test harness) publish too
+@sa_event.listens_for(Session, 'after_commit')
+def _publish_pending(session):
+    if session.info.get(DEFERRED_COMMIT):
+        # Only a SAVEPOINT was released; published once the outer transaction commits
+        session.info.setdefault(RELEASED_KEY, []).extend(session.info.pop(PENDING_KEY, []))
+        return
+    for event in session.info.pop(RELEASED_KEY, []) + session.info.pop(PENDING_KEY, []):
+        try:
+            get_broker().publish(event)
+        except Exception as e:
+            logger.error(f"Failed to publish event {event.get('id')}: {str(e)}", exc_info=True)
+
+@sa_event.listens_for(Session, 'after_soft_rollback')
+def _drop_pending(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+def emit_event(stockvel_id, event_type, data=None, user_id=None):
+    """Record an activity event in the current transaction; it is published once the caller commits"""
+    row = ActivityEvent(
+        stockvel_id=stockvel_id,
+        user_id=user_id,
+        type=event_type,
+        data=current_app.json.dumps(data) if data is not None else None
+    )
+    db.session.add(row)
+    db.session.flush()
+
+    event = row.to_dict()
+    if get_broker().notify_in_transaction:
+        payload = current_app.json.dumps(event)
+        if len(payload.encode('utf-8')) > NOTIFY_PAYLOAD_LIMIT:
+            payload = json.dumps({'id': row.id})
+        db.session.execute(select(func.pg_notify(current_app.config.get('EVENTS_CHANNEL', 'activity_events'), payload)))
+    else:
+        db.session.info.setdefault(PENDING_KEY, []).append(event)
+    return row
+
+def parse_last_event_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+def events_after_query(last_event_id, stockvel_ids=(), user_id=None, limit=500):
+    """Stored events after ``last_event_id`` for the groups (or member) a stream follows"""
+    scope = [ActivityEvent.stockvel_id.in_(list(stockvel_ids))]
+    if user_id is not None:
+        scope.append(ActivityEvent.user_id == user_id)
+    return (
+        select(ActivityEvent)
+        .where(ActivityEvent.id > last_event_id, or_(*scope))
+        .order_by(ActivityEvent.id)
+        .limit(limit)
+    )
+
+def format_event(event, dumps):
+    """One SSE message; ``dumps`` is the app's JSON serializer (never emits newlines)"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {dumps(event)}\n\n"
+
+def stream_settings(config):
+    return {
+        'heartbeat': config.get('EVENTS_HEARTBEAT', 15),
+        'retry': config.get('EVENTS_RETRY_MS', 3000),
+        'queue_size': config.get('EVENTS_QUEUE_SIZE', 100),
+        'replay_limit': config.get('EVENTS_REPLAY_LIMIT', 500),
+    }
+
+def _wsgi_stream(subscription, backlog, settings, dumps, max_duration):
+    yield f"retry: {settings['retry']}\n\n"
+    replayed = set()
+    for event in backlog:
+        replayed.add(event['id'])
+        yield format_event(event, dumps)
+
+    deadline = time.monotonic() + max_duration
+    while time.monotonic() < deadline and not subscription.overflowed:
+        event = subscription.get(timeout=settings['heartbeat'])
+        if event is CLOSED:
+            return
+        if event is None:
+            yield ': keepalive\n\n'
+        elif event['id'] not in replayed:
+            yield format_event(event, dumps)
+
+def event_stream_response(stockvel_ids=(), user_id=None, last_event_id=None, viewer_id=None):
+    """A streaming text/event-stream response for the WSGI app.
+
+    Each open stream holds a request thread, so streams are closed after
+    EVENTS_WSGI_MAX_DURATION and the client resumes with Last-Event-ID; use
+    the ASGI mode to hold large numbers of idle streams.
+    """
+    config = current_app.config
+    settings = stream_settings(config)
+    broker = get_broker()
+
+    subscription = QueueSubscription(stockvel_ids, user_id, maxsize=settings['queue_size'], viewer_id=viewer_id)
+    broker.subscribe(subscription)
+
+    backlog = []
+    if last_event_id is not None:
+        rows = db.session.execute(
+            events_after_query(last_event_id, stockvel_ids, user_id, settings['replay_limit'])
+        ).scalars().all()
+        backlog = [row.to_dict() for row in rows]
+    # Release the connection; the stream itself doesn't need the database
+    db.session.remove()
+
+    response = current_app.response_class(
+        _wsgi_stream(subscription, backlog, settings, current_app.json.dumps, config.get('EVENTS_WSGI_MAX_DURATION', 300)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    response.call_on_close(lambda: broker.unsubscribe(subscription))
+    return response
+
+def compact_events(batch_size=None):
+    """Delete events older than EVENTS_RETENTION_DAYS; clients that far behind reload instead of resuming"""
+    from services.admin_service import delete_in_chunks
+
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config.get('EVENTS_RETENTION_DAYS', 30))
+    return delete_in_chunks(ActivityEvent, ActivityEvent.created_at < cutoff, batch_size=batch_size)
+
+@task('events.compact')
+def compact_events_task():
+    return {'deleted': compact_events()}
@@ -0,0 +1,266 @@
+"""
+Streaming CSV/NDJSON statements of contributions.
+
+Two kinds of export: a group's ledger (``ledger``) and a member's history
+across all their groups (``history``). Rows are read with ``yield_per`` so
+the database driver streams them from a server-side cursor, and are encoded
+in chunks of EXPORT_BATCH_SIZE rows as they arrive. A response or file of any
+size therefore takes the same memory. Contributions of archived groups
+(archive_service) are included from their archived documents.
+
+Exports larger than EXPORT_STREAM_MAX_ROWS are written to a file in
+EXPORT_FOLDER by the ``exports.write`` job instead and downloaded once it
+finishes.
+"""
+from services.database_service import db
+from services.job_service import task, enqueue, current_job_id
+from services.serialization_service import ledger_bound
+from services.archive_service import get_archive, user_archives_query, load_archive
+from models.user import User
+from models.stockvel import Stockvel, Contribution
+from flask import current_app, request, stream_with_context
+from sqlalchemy import select, func, and_
+from datetime import datetime, timedelta
+import csv
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+EXPORT_FIELDS = (
+    'id', 'contribution_date', 'stockvel_id', 'stockvel_name', 'user_id', 'user_name',
+    'amount', 'status', 'payment_method', 'description'
+)
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+def _columns():
+    return (
+        Contribution.id, Contribution.contribution_date, Contribution.stockvel_id, Stockvel.name,
+        Contribution.user_id, User.display_name, User.email,
+        Contribution.amount, Contribution.status, Contribution.payment_method, Contribution.description
+    )
+
+def _export_query(condition):
+    return (
+        select(*_columns())
+        .join(Stockvel, Stockvel.id == Contribution.stockvel_id)
+        .outerjoin(User, User.id == Contribution.user_id)
+        .where(condition)
+        .order_by(Contribution.contribution_date, Contribution.id)
+    )
+
+def ledger_query(stockvel_id):
+    """Every contribution to a stockvel, oldest first"""
+    return _export_query(and_(Contribution.stockvel_id == stockvel_id, ledger_bound([stockvel_id])))
+
+def history_query(user_id):
+    """Every contribution a user made to a live stockvel, oldest first"""
+    return _export_query(Contribution.user_id == user_id)
+
+QUERIES = {
+    'ledger': ledger_query,
+    'history': history_query
+}
+
+def _user_name(display_name, email):
+    return display_name or (email.split('@')[0] if email else 'Unknown')
+
+def _record(row):
+    contribution_id, contribution_date, stockvel_id, stockvel_name, user_id, display_name, email, \
+        amount, status, payment_method, description = row
+    return {
+        'id': contribution_id,
+        'contribution_date': contribution_date,
+        'stockvel_id': stockvel_id,
+        'stockvel_name': stockvel_name,
+        'user_id': user_id,
+        'user_name': _user_name(display_name, email),
+        'amount': amount,
+        'status': status,
+        'payment_method': payment_method,
+        'description': description
+    }
+
+def stream_records(statement):
+    """Rows of ``statement`` as export records, fetched EXPORT_BATCH_SIZE at a time"""
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    for row in db.session.execute(statement.execution_options(yield_per=batch_size)):
+        yield _record(row)
+
+def archived_records(archive, user_id=None):
+    """Export records from an archived group's document, optionally for one member"""
+    contributions = [
+        c for c in load_archive(archive)['contributions']
+        if user_id is None or c['user_id'] == user_id
+    ]
+    user_ids = {c['user_id'] for c in contributions}
+    names = {
+        id: _user_name(display_name, email)
+        for id, display_name, email in db.session.execute(
+            select(User.id, User.display_name, User.email).where(User.id.in_(user_ids))
+        )
+    }
+    contributions.sort(key=lambda c: (c['contribution_date'], c['id']))
+    for c in contributions:
+        yield {
+            'id': c['id'],
+            'contribution_date': c['contribution_date'],
+            'stockvel_id': archive.stockvel_id,
+            'stockvel_name': archive.name,
+            'user_id': c['user_id'],
+            'user_name': names.get(c['user_id'], 'Unknown'),
+            'amount': c['amount'],
+            'status': c['status'],
+            'payment_method': c['payment_method'],
+            'description': c['description']
+        }
+
+def ledger_records(stockvel_id):
+    if db.session.get(Stockvel, stockvel_id) is None:
+        archive = get_archive(stockvel_id)
+        if archive is not None:
+            yield from archived_records(archive)
+        return
+    yield from stream_records(ledger_query(stockvel_id))
+
+def history_records(user_id):
+    """Archived groups first (they have closed), then live groups, each oldest first"""
+    for archive in db.session.execute(user_archives_query(user_id)).scalars().all():
+        yield from archived_records(archive, user_id)
+    yield from stream_records(history_query(user_id))
+
+RECORDS = {
+    'ledger': ledger_records,
+    'history': history_records
+}
+
+def count_rows(kind, subject_id):
+    """Live rows an export would read (its own query, counted); decides whether it streams or goes to a job"""
+    rows = QUERIES[kind](subject_id).order_by(None).subquery()
+    return db.session.execute(select(func.count()).select_from(rows)).scalar()
+
+def should_queue(kind, subject_id):
+    """Whether the caller asked for a background export, or the export is too large to stream"""
+    if request.args.get('background', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return count_rows(kind, subject_id) > current_app.config.get('EXPORT_STREAM_MAX_ROWS', 50000)
+
+def queue_export(kind, subject_id, fmt, user_id, filename):
+    return enqueue('exports.write', {
+        'kind': kind,
+        'subject_id': subject_id,
+        'format': fmt,
+        'user_id': user_id,
+        'filename': filename
+    })
+
+# Leading characters that make spreadsheets read a cell as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def encode_csv(records, batch_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for count, record in enumerate(records, 1):
+        writer.writerow([_csv_value(record[field]) for field in EXPORT_FIELDS])
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def encode_ndjson(records, batch_size):
+    dumps = current_app.json.dumps
+    lines = []
+    for record in records:
+        lines.append(dumps(record))
+        if len(lines) == batch_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def encode(records, fmt):
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    encoder = encode_csv if fmt == 'csv' else encode_ndjson
+    return encoder(records, batch_size)
+
+def export_response(kind, subject_id, fmt, filename):
+    """Stream an export as a download; the database cursor stays open until the last chunk"""
+    chunks = encode(RECORDS[kind](subject_id), fmt)
+    response = current_app.response_class(stream_with_context(chunks), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+def export_folder():
+    folder = current_app.config.get('EXPORT_FOLDER', 'exports')
+    # Relative to the project root, since the web and worker processes run from different directories
+    return folder if os.path.isabs(folder) else os.path.join(BASE_DIR, folder)
+
+def export_path(filename):
+    return os.path.join(export_folder(), filename)
+
+def write_export(kind, subject_id, fmt, path):
+    """Write an export to ``path`` (via a temporary file, so a partial file is never served)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = 0
+
+    def counted(records):
+        nonlocal rows
+        for record in records:
+            rows += 1
+            yield record
+
+    partial = f'{path}.partial'
+    with open(partial, 'w', newline='', encoding='utf-8') as f:
+        for chunk in encode(counted(RECORDS[kind](subject_id)), fmt):
+            f.write(chunk)
+    os.replace(partial, path)
+    return rows
+
+@task('exports.write')
+def write_export_task(kind, subject_id, format, user_id, filename):
+    job_id = current_job_id()
+    stored_name = f'{filename}-{job_id}.{format}'
+    path = export_path(stored_name)
+    rows = write_export(kind, subject_id, format, path)
+    logger.info(f"Wrote export {stored_name} ({rows} rows) for user {user_id}")
+    return {
+        'filename': f'{filename}.{format}',
+        'stored_name': stored_name,
+        'rows': rows,
+        'bytes': os.path.getsize(path),
+        'download_url': f'/api/users/exports/{job_id}/download'
+    }
+
+def compact_exports():
+    """Delete export files older than EXPORT_RETENTION_HOURS"""
+    folder = export_folder()
+    if not os.path.isdir(folder):
+        return 0
+    cutoff = (datetime.now() - timedelta(hours=current_app.config.get('EXPORT_RETENTION_HOURS', 24))).timestamp()
+    deleted = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            deleted += 1
+    return deleted
+
+@task('exports.compact')
+def compact_exports_task():
+    return {'deleted': compact_exports()}
@@ -0,0 +1,198 @@
+"""
+Idempotency-Key support for mutating endpoints.
+
+A request carrying ``Idempotency-Key`` first claims the key in
+``idempotency_keys`` (unique per user) in its own transaction, then runs the
+view and stores the response in one transaction (the view's commits only
+release SAVEPOINTs), so a crash in between leaves neither: the claim lapses
+after IDEMPOTENCY_LOCK_TIMEOUT and a retry runs the request again. A retry with the same key and request gets the
+stored response replayed without running the view; a retry that arrives while
+the first request is still running waits for it. Keys expire after
+IDEMPOTENCY_TTL seconds.
+"""
+from services.database_service import db, single_transaction
+from services.job_service import task
+from models.idempotency_key import IdempotencyKey
+from flask import current_app, request, jsonify
+from flask_jwt_extended import current_user
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from functools import wraps
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+def request_fingerprint():
+    """Identifies the request a key was used for: method, path and raw body"""
+    digest = hashlib.sha256()
+    digest.update(f'{request.method} {request.path}\n'.encode('utf-8'))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+def claim_key(user_id, key, fingerprint):
+    """Insert an in-progress row for the key.
+
+    Returns ``(row, True)`` when this request owns the key, or the existing
+    row and False. Expired keys are replaced, and an in-progress claim whose
+    lock has lapsed (its request died) is taken over.
+    """
+    config = current_app.config
+    for _ in range(3):
+        now = datetime.utcnow()
+        row = IdempotencyKey(
+            user_id=user_id,
+            key=key,
+            fingerprint=fingerprint,
+            status=IN_PROGRESS,
+            locked_until=now + timedelta(seconds=config.get('IDEMPOTENCY_LOCK_TIMEOUT', 60)),
+            expires_at=now + timedelta(seconds=config.get('IDEMPOTENCY_TTL', 86400))
+        )
+        db.session.add(row)
+        try:
+            db.session.commit()
+            return row, True
+        except IntegrityError:
+            db.session.rollback()
+
+        existing = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if existing is None:
+            continue  # Deleted since our insert failed
+
+        if existing.expires_at <= now:
+            db.session.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.id == existing.id,
+                IdempotencyKey.expires_at <= now
+            ))
+            db.session.commit()
+            continue
+
+        if existing.status == IN_PROGRESS and existing.fingerprint == fingerprint and existing.locked_until < now:
+            # Conditional, so only one of several waiting retries takes over
+            taken = db.session.execute(
+                update(IdempotencyKey)
+                .where(
+                    IdempotencyKey.id == existing.id,
+                    IdempotencyKey.status == IN_PROGRESS,
+                    IdempotencyKey.locked_until == existing.locked_until
+                )
+                .values(locked_until=row.locked_until)
+            ).rowcount
+            db.session.commit()
+            if taken:
+                logger.warning(f"Took over stale idempotency key {existing.id} for user {user_id}")
+                return existing, True
+
+        return existing, False
+
+    raise RuntimeError(f'Could not claim idempotency key for user {user_id}')
+
+class NotStored(Exception):
+    """Unwinds a view's transaction whose response must not be stored"""
+
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+
+def complete_key(key_id, response):
+    """Store the response so retries replay it; inside single_transaction this commits with the view's writes"""
+    db.session.rollback()
+    db.session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.id == key_id)
+        .values(
+            status=COMPLETED,
+            locked_until=None,
+            response_status=response.status_code,
+            response_body=response.get_data(as_text=True),
+            response_mimetype=response.mimetype
+        )
+    )
+    db.session.commit()
+
+def release_key(key_id):
+    """Forget a claim whose request failed, so the client can retry it"""
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == key_id))
+    db.session.commit()
+
+def replay(row):
+    response = current_app.response_class(row.response_body, status=row.response_status, mimetype=row.response_mimetype)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(view):
+    """Honour the Idempotency-Key header on a mutating route; place it under @jwt_required()"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'message': f'{HEADER} must be 1-{MAX_KEY_LENGTH} characters', 'error': 'invalid_idempotency_key'}), 400
+
+        config = current_app.config
+        user_id = current_user.id
+        fingerprint = request_fingerprint()
+        deadline = time.monotonic() + config.get('IDEMPOTENCY_WAIT', 10)
+
+        while True:
+            row, claimed = claim_key(user_id, key, fingerprint)
+            if claimed:
+                break
+            if row.fingerprint != fingerprint:
+                return jsonify({
+                    'message': f'{HEADER} was already used for a different request',
+                    'error': 'idempotency_key_reused'
+                }), 422
+            if row.status == COMPLETED:
+                logger.info(f"Replaying response for idempotency key {row.id} (user {user_id})")
+                return replay(row)
+
+            # The same request is still running (a concurrent retry); wait for its response
+            if time.monotonic() >= deadline:
+                response = jsonify({'message': 'A request with this Idempotency-Key is still in progress', 'error': 'request_in_progress'})
+                response.status_code = 409
+                response.headers['Retry-After'] = '1'
+                return response
+            db.session.rollback()
+            time.sleep(config.get('IDEMPOTENCY_POLL_INTERVAL', 0.1))
+
+        key_id = row.id
+        try:
+            # The view's writes and the stored response commit together
+            with single_transaction():
+                response = current_app.make_response(view(*args, **kwargs))
+                # Server errors are not stored (nor kept), so a retry runs the request again
+                if response.status_code >= 500 or response.is_streamed:
+                    raise NotStored(response)
+                complete_key(key_id, response)
+        except NotStored as e:
+            release_key(key_id)
+            return e.response
+        except Exception:
+            release_key(key_id)
+            raise
+        return response
+
+    return wrapper
+
+def compact_idempotency_keys(batch_size=None):
+    """Delete expired keys"""
+    from services.admin_service import delete_in_chunks
+
+    return delete_in_chunks(IdempotencyKey, IdempotencyKey.expires_at < datetime.utcnow(), batch_size=batch_size)
+
+@task('idempotency.compact')
+def compact_idempotency_keys_task():
+    return {'deleted': compact_idempotency_keys()}
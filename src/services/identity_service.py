@@ -0,0 +1,189 @@
+"""
+The authenticated user, loaded once per request and cached per worker.
+
+Snapshots are kept for IDENTITY_CACHE_TTL seconds. Writes that change a
+user or their memberships call ``invalidate_user``/``invalidate_all``,
+which drop the entries in this process and record the invalidation in
+``identity_invalidations``. Every worker replays rows it hasn't seen yet
+(by id) at most every IDENTITY_SYNC_INTERVAL seconds, so a purge run by
+the job worker reaches the web workers within that interval.
+"""
+from services.database_service import db
+from services.job_service import task
+from models.user import User
+from models.stockvel import StockvelMember
+from models.identity_invalidation import IdentityInvalidation
+from utils.cache import TTLCache
+from flask import current_app
+from sqlalchemy import select, and_, func, insert
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rows re-read on each sync, so invalidations committed out of id order are not missed
+SYNC_OVERLAP = 100
+
+# Shared by all request threads in this worker; created on first use so it picks up app config
+_cache = None
+_feed = None
+
+class CurrentUser:
+    """Read-only snapshot of the authenticated user and their active group ids.
+
+    Returned by ``flask_jwt_extended.current_user``. Routes that modify the
+    user must load the ORM object with ``User.get_by_id`` and call
+    ``invalidate_user`` after committing.
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self.id = data['id']
+        self.email = data['email']
+        self.display_name = data['display_name']
+        self.is_active = data['is_active']
+        self.joined_group_ids = data['joined_group_ids']
+
+    def __repr__(self):
+        return f"<CurrentUser(id={self.id}, email='{self.email}')>"
+
+    def to_dict(self, fields=None):
+        """Same shape as User.to_dict"""
+        data = dict(self._data)
+        data['joined_group_ids'] = list(self.joined_group_ids)
+        if fields is not None:
+            data = {key: value for key, value in data.items() if key == 'id' or key in fields}
+        return data
+
+class InvalidationFeed:
+    """This worker's position in identity_invalidations"""
+
+    def __init__(self):
+        self.last_id = None
+        self.seen = set()  # Ids inside the overlap window that were already applied
+        self.last_sync = None
+        self._sync_lock = threading.Lock()
+
+    def sync(self, cache, force=False):
+        """Apply invalidations from other processes when the sync interval has passed"""
+        interval = current_app.config.get('IDENTITY_SYNC_INTERVAL', 2)
+        if not force and self.last_sync is not None and time.monotonic() - self.last_sync < interval:
+            return
+        # One thread syncs; the others use the cache as it is
+        if not self._sync_lock.acquire(blocking=force):
+            return
+        try:
+            table = IdentityInvalidation.__table__
+            if self.last_id is None:
+                # The cache starts out empty, so only later invalidations matter
+                self.last_id = db.session.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+            rows = db.session.execute(
+                select(table.c.id, table.c.user_id)
+                .where(table.c.id > self.last_id - SYNC_OVERLAP)
+                .order_by(table.c.id)
+            ).all()
+            first_sync = self.last_sync is None
+
+            for row_id, user_id in rows:
+                if row_id in self.seen:
+                    continue
+                self.seen.add(row_id)
+                if first_sync and row_id <= self.last_id:
+                    continue
+                if user_id is None:
+                    cache.clear()
+                else:
+                    cache.pop(user_id)
+                self.last_id = max(self.last_id, row_id)
+
+            self.seen = {row_id for row_id in self.seen if row_id > self.last_id - SYNC_OVERLAP}
+            self.last_sync = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+def get_cache():
+    global _cache, _feed
+    if _cache is None:
+        _cache = TTLCache(
+            maxsize=current_app.config.get('IDENTITY_CACHE_SIZE', 4096),
+            ttl=current_app.config.get('IDENTITY_CACHE_TTL', 30)
+        )
+        _feed = InvalidationFeed()
+    return _cache
+
+def reset_cache():
+    """Forget every snapshot and the sync position (tests roll back the rows it has seen)"""
+    global _cache, _feed
+    _cache = None
+    _feed = None
+
+def sync_invalidations(force=False):
+    get_cache()
+    _feed.sync(_cache, force=force)
+
+def current_user_query(user_id):
+    """A user and their active membership ids in a single query"""
+    return (
+        select(User, StockvelMember.stockvel_id)
+        .outerjoin(StockvelMember, and_(
+            StockvelMember.user_id == User.id,
+            StockvelMember.is_active == True
+        ))
+        .where(User.id == user_id)
+    )
+
+def build_current_user(rows):
+    if not rows:
+        return None
+
+    user = rows[0][0]
+    joined_group_ids = [stockvel_id for _, stockvel_id in rows if stockvel_id is not None]
+    return CurrentUser(user.to_dict(joined_group_ids=joined_group_ids))
+
+def fetch_current_user(user_id):
+    return build_current_user(db.session.execute(current_user_query(user_id)).all())
+
+def load_current_user(user_id):
+    """Get the user snapshot from the worker cache, loading it on a miss"""
+    cache = get_cache()
+    _feed.sync(cache)
+    current = cache.get(user_id)
+    if current is None:
+        current = fetch_current_user(user_id)
+        if current is not None:
+            cache.set(user_id, current)
+    return current
+
+def _publish(user_ids, commit):
+    db.session.execute(insert(IdentityInvalidation), [{'user_id': user_id} for user_id in user_ids])
+    if commit:
+        db.session.commit()
+
+def invalidate_user(*user_ids, commit=True):
+    """Drop cached snapshots after a profile or membership write, in every worker.
+
+    Other workers see the invalidation once it commits; pass commit=False to
+    publish it with the caller's own transaction.
+    """
+    cache = get_cache()
+    for user_id in user_ids:
+        cache.pop(user_id)
+    _publish(user_ids, commit)
+
+def invalidate_all(commit=True):
+    """Drop every cached snapshot in every worker, e.g. after a bulk membership change"""
+    get_cache().clear()
+    _publish([None], commit)
+
+def compact_invalidations(batch_size=None):
+    """Delete invalidations older than any snapshot they could still apply to"""
+    from services.admin_service import delete_in_chunks
+
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('IDENTITY_INVALIDATION_RETENTION', 3600))
+    return delete_in_chunks(IdentityInvalidation, IdentityInvalidation.created_at < cutoff, batch_size=batch_size)
+
+@task('identity.compact')
+def compact_invalidations_task():
+    return {'deleted': compact_invalidations()}
@@ -0,0 +1,406 @@
+"""
+Persistent background job queue.
+
+Jobs live in the ``jobs`` table so routes can enqueue work and return
+immediately, while a separate worker process (``run_worker.py``) claims and
+runs them. PostgreSQL claims use ``FOR UPDATE SKIP LOCKED`` so any number of
+workers can poll the same table; SQLite falls back to a conditional UPDATE.
+A running job's ``locked_at`` is its heartbeat: the worker process refreshes
+it while the job runs (and report_progress does too), so only jobs whose
+worker died go JOB_STALE_TIMEOUT without one and are requeued, or failed
+once they have used up their attempts.
+"""
+from services.database_service import db
+from models.job import Job
+from flask import current_app
+from sqlalchemy import select, func
+from datetime import datetime, timedelta
+import importlib
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+
+# Registered task callables by name
+TASKS = {}
+
+_current = threading.local()
+
+def task(name):
+    """Register a function as a background task under ``name``"""
+    def decorator(fn):
+        TASKS[name] = fn
+        return fn
+    return decorator
+
+def load_task_modules(app):
+    """Import the modules listed in JOB_TASK_MODULES so their tasks register"""
+    for module_name in app.config.get('JOB_TASK_MODULES', []):
+        importlib.import_module(module_name)
+
+def enqueue(name, payload=None, priority=PRIORITY_NORMAL, delay=0, max_attempts=None, commit=True, dedup_key=None):
+    """Queue a task and return the Job row.
+
+    Pass ``commit=False`` to enqueue as part of the caller's transaction so the
+    job only becomes visible if the surrounding write commits. A job with a
+    ``dedup_key`` holds it until a worker claims it; while another queued job
+    holds the key nothing is added and None is returned. The check is the
+    insert itself (ON CONFLICT DO NOTHING), so concurrent callers can't both add one.
+    """
+    if name not in TASKS:
+        raise ValueError(f'Unknown task: {name}')
+
+    values = {
+        'name': name,
+        'payload': json.dumps(payload or {}, default=str),
+        'priority': priority,
+        'max_attempts': max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 3),
+        'run_at': datetime.utcnow() + timedelta(seconds=delay),
+        'status': 'queued'
+    }
+    if dedup_key is not None:
+        return _enqueue_once(values, dedup_key, commit)
+
+    job = Job(**values)
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
+
+    logger.info(f"Enqueued job {job.id} ({name}) with priority {priority}")
+    return job
+
+def _enqueue_once(values, dedup_key, commit):
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    job_id = db.session.execute(
+        insert(Job.__table__)
+        .values(dedup_key=dedup_key, **values)
+        .on_conflict_do_nothing(index_elements=['dedup_key'])
+        .returning(Job.__table__.c.id)
+    ).scalar()
+    if commit:
+        db.session.commit()
+    if job_id is None:
+        return None
+
+    logger.info(f"Enqueued job {job_id} ({values['name']}) with priority {values['priority']}")
+    return db.session.get(Job, job_id)
+
+def get_job(job_id):
+    """Get job by ID"""
+    return db.session.get(Job, job_id)
+
+def cancel_job(job_id):
+    """Cancel a job no worker has claimed yet. Returns False once it is running or finished."""
+    jobs = Job.__table__
+    cancelled = db.session.execute(
+        jobs.update()
+        .where(jobs.c.id == job_id, jobs.c.status == 'queued')
+        .values(status='cancelled', dedup_key=None, finished_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    if cancelled:
+        logger.info(f"Cancelled job {job_id}")
+    return bool(cancelled)
+
+def current_job_id():
+    """ID of the job running on this thread, or None outside a worker"""
+    return getattr(_current, 'job_id', None)
+
+def report_progress(**data):
+    """Store a progress report on the running job, which also counts as a heartbeat (no-op outside a worker)"""
+    job_id = current_job_id()
+    if job_id is None:
+        return
+
+    db.session.execute(
+        Job.__table__.update()
+        .where(Job.__table__.c.id == job_id)
+        .values(result=json.dumps(data, default=str), locked_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+def claim_next_job(worker_id):
+    """Atomically claim the highest priority due job, returning its ID or None"""
+    now = datetime.utcnow()
+    jobs = Job.__table__
+    claimed_values = {
+        'status': 'running',
+        'locked_by': worker_id,
+        'locked_at': now,
+        'started_at': now,
+        'attempts': jobs.c.attempts + 1,
+        'dedup_key': None  # Work added from now on needs a run of its own
+    }
+
+    if db.engine.dialect.name == 'postgresql':
+        # Concurrent workers skip rows another worker has locked instead of waiting
+        next_id = (
+            select(jobs.c.id)
+            .where(jobs.c.status == 'queued', jobs.c.run_at <= now)
+            .order_by(jobs.c.priority.desc(), jobs.c.run_at, jobs.c.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        job_id = db.session.execute(
+            jobs.update().where(jobs.c.id == next_id).values(**claimed_values).returning(jobs.c.id)
+        ).scalar()
+        db.session.commit()
+        return job_id
+
+    # SQLite fallback: pick candidates, then claim with a conditional UPDATE
+    candidates = db.session.execute(
+        select(jobs.c.id)
+        .where(jobs.c.status == 'queued', jobs.c.run_at <= now)
+        .order_by(jobs.c.priority.desc(), jobs.c.run_at, jobs.c.id)
+        .limit(5)
+    ).scalars().all()
+
+    for job_id in candidates:
+        claimed = db.session.execute(
+            jobs.update()
+            .where(jobs.c.id == job_id, jobs.c.status == 'queued')
+            .values(**claimed_values)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+
+    db.session.rollback()
+    return None
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter for the given number of attempts made"""
+    base = current_app.config.get('JOB_RETRY_BACKOFF', 5)
+    cap = current_app.config.get('JOB_RETRY_BACKOFF_MAX', 600)
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.8, 1.2)
+
+def run_job(job_id):
+    """Run a claimed job and record the outcome. Returns the final status."""
+    job = get_job(job_id)
+    if not job:
+        return None
+
+    fn = TASKS.get(job.name)
+    _current.job_id = job_id
+    try:
+        if fn is None:
+            raise LookupError(f'No task registered as {job.name}')
+
+        result = fn(**job.get_payload())
+
+        job = get_job(job_id)
+        job.status = 'succeeded'
+        if result is not None:
+            job.result = json.dumps(result, default=str)
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return job.status
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+
+        job = get_job(job_id)
+        job.last_error = str(e)
+        job.locked_by = None
+        job.locked_at = None
+        if fn is not None and job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts))
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return 'retrying' if job.status == 'queued' else job.status
+
+    finally:
+        _current.job_id = None
+
+def heartbeat(worker_ids):
+    """Refresh locked_at on the jobs these workers are running, so they don't look stale"""
+    jobs = Job.__table__
+    db.session.execute(
+        jobs.update()
+        .where(jobs.c.status == 'running', jobs.c.locked_by.in_(worker_ids))
+        .values(locked_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+def requeue_stale_jobs(timeout):
+    """Return jobs whose worker died mid-run to the queue, or fail them once out of attempts"""
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=timeout)
+    jobs = Job.__table__
+    stale = (jobs.c.status == 'running', jobs.c.locked_at < cutoff)
+    failed = db.session.execute(
+        jobs.update()
+        .where(*stale, jobs.c.attempts >= jobs.c.max_attempts)
+        .values(status='failed', locked_by=None, locked_at=None, finished_at=now,
+                last_error='Worker stopped responding while running the job')
+    ).rowcount
+    count = db.session.execute(
+        jobs.update()
+        .where(*stale)
+        .values(status='queued', locked_by=None, locked_at=None, run_at=now)
+    ).rowcount
+    db.session.commit()
+    if failed:
+        logger.warning(f"Failed {failed} stale jobs that had no attempts left")
+    if count:
+        logger.warning(f"Requeued {count} stale jobs")
+    return count
+
+def get_job_metrics():
+    """Queue depth and outcome counts per task, plus recent runtimes"""
+    now = datetime.utcnow()
+
+    counts = {}
+    rows = db.session.execute(
+        select(Job.name, Job.status, func.count(Job.id)).group_by(Job.name, Job.status)
+    ).all()
+    for name, status, count in rows:
+        counts.setdefault(name, {})[status] = count
+
+    oldest_due = db.session.execute(
+        select(func.min(Job.run_at)).where(Job.status == 'queued', Job.run_at <= now)
+    ).scalar()
+
+    recent = db.session.execute(
+        select(Job.created_at, Job.started_at, Job.finished_at)
+        .where(Job.status == 'succeeded', Job.finished_at.isnot(None))
+        .order_by(Job.finished_at.desc())
+        .limit(500)
+    ).all()
+    runtimes = [(r.finished_at - r.started_at).total_seconds() for r in recent if r.started_at]
+    waits = [(r.started_at - r.created_at).total_seconds() for r in recent if r.started_at and r.created_at]
+
+    return {
+        'tasks': counts,
+        'queued': sum(c.get('queued', 0) for c in counts.values()),
+        'running': sum(c.get('running', 0) for c in counts.values()),
+        'failed': sum(c.get('failed', 0) for c in counts.values()),
+        'oldest_due_seconds': (now - oldest_due).total_seconds() if oldest_due else 0,
+        'avg_runtime_seconds': sum(runtimes) / len(runtimes) if runtimes else None,
+        'avg_wait_seconds': sum(waits) / len(waits) if waits else None
+    }
+
+class WorkerPool:
+    """Threads in one process that claim and run jobs until stopped"""
+
+    def __init__(self, app, concurrency=None, poll_interval=None):
+        self.app = app
+        self.concurrency = concurrency or app.config.get('JOB_WORKER_CONCURRENCY', 4)
+        self.poll_interval = poll_interval or app.config.get('JOB_POLL_INTERVAL', 1.0)
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.worker_ids = [f"{self.name}:{index}" for index in range(self.concurrency)]
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.stats = {'processed': 0, 'succeeded': 0, 'retried': 0, 'failed': 0, 'busy_seconds': 0.0}
+        self._last_scheduled = {}
+
+    def _record(self, status, elapsed):
+        with self._lock:
+            self.stats['processed'] += 1
+            self.stats['busy_seconds'] += elapsed
+            if status == 'succeeded':
+                self.stats['succeeded'] += 1
+            elif status == 'retrying':
+                self.stats['retried'] += 1
+            elif status == 'failed':
+                self.stats['failed'] += 1
+
+    def _work(self, index):
+        worker_id = self.worker_ids[index]
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    job_id = claim_next_job(worker_id)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Worker {worker_id} could not claim a job: {str(e)}", exc_info=True)
+                    job_id = None
+
+                if job_id is None:
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                started = time.monotonic()
+                status = run_job(job_id)
+                self._record(status, time.monotonic() - started)
+
+    def schedule_periodic_tasks(self):
+        """Enqueue JOB_PERIODIC_TASKS that are due and not already pending"""
+        now = time.monotonic()
+        for name, interval in self.app.config.get('JOB_PERIODIC_TASKS', {}).items():
+            last = self._last_scheduled.get(name)
+            if last is not None and now - last < interval:
+                continue
+
+            pending = db.session.execute(
+                select(func.count(Job.id)).where(Job.name == name, Job.status.in_(('queued', 'running')))
+            ).scalar()
+            if not pending:
+                enqueue(name, priority=PRIORITY_LOW)
+            self._last_scheduled[name] = now
+
+    def start(self):
+        with self.app.app_context():
+            load_task_modules(self.app)
+
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._work, args=(index,), name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info(f"Started {self.concurrency} job workers on {self.name} ({len(TASKS)} tasks registered)")
+
+    def stop(self, timeout=None):
+        """Let running jobs finish, then stop all threads"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run(self):
+        """Run until SIGTERM/SIGINT, doing housekeeping in the main thread"""
+        signal.signal(signal.SIGTERM, lambda *args: self._stop.set())
+        signal.signal(signal.SIGINT, lambda *args: self._stop.set())
+
+        self.start()
+        with self.app.app_context():
+            self.schedule_periodic_tasks()
+        stale_timeout = self.app.config.get('JOB_STALE_TIMEOUT', 900)
+        metrics_interval = self.app.config.get('JOB_METRICS_INTERVAL', 60)  # Also the heartbeat interval; keep it well below stale_timeout
+
+        while not self._stop.wait(metrics_interval):
+            with self.app.app_context():
+                try:
+                    heartbeat(self.worker_ids)
+                    requeue_stale_jobs(stale_timeout)
+                    self.schedule_periodic_tasks()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Job housekeeping failed: {str(e)}")
+            with self._lock:
+                logger.info(f"Job worker stats: {dict(self.stats)}")
+
+        logger.info("Stopping job workers...")
+        self.stop()
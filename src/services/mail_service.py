@@ -0,0 +1,435 @@
+"""
+Outbound mail: contribution receipts and payout reminders.
+
+Messages are rows in ``outbound_emails``. They are queued in the transaction
+of the change they report, so a rolled-back contribution sends no receipt,
+and delivered by the ``mail.deliver`` job, never on a request thread.
+Delivery claims up to MAIL_BATCH_SIZE due messages at a time and sends them
+over at most MAIL_CONCURRENCY SMTP connections per process. Connections stay
+open between batches and jobs, and are replaced after MAIL_MAX_PER_CONNECTION
+messages or MAIL_IDLE_TIMEOUT idle seconds.
+
+Temporary failures (4xx replies, dropped connections) are retried with
+exponential backoff up to MAIL_MAX_ATTEMPTS; permanent ones (5xx) fail the
+message at once. Messages carry a ``dedup_key``, so queuing the same
+reminder twice (a rerun of the daily job) sends it once.
+
+While MAIL_SERVER is unset, messages are logged instead of sent.
+"""
+from services.database_service import db
+from services.job_service import task, enqueue
+from services.serialization_service import ROSTER_ORDER
+from models.outbound_email import OutboundEmail
+from models.user import User
+from models.stockvel import Stockvel, StockvelMember
+from flask import current_app
+from sqlalchemy import select, or_
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid, parseaddr
+import atexit
+import calendar
+import logging
+import os
+import random
+import smtplib
+import socket
+import ssl
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Per-process connection pool, created on first use so it picks up app config
+_pool = None
+_pool_lock = threading.Lock()
+
+class SMTPPool:
+    """Up to ``size`` persistent SMTP connections shared by the threads of this process"""
+
+    def __init__(self, config):
+        self.host = config.get('MAIL_SERVER')
+        self.port = config.get('MAIL_PORT', 587)
+        self.use_tls = config.get('MAIL_USE_TLS', True)
+        self.username = config.get('MAIL_USERNAME')
+        self.password = config.get('MAIL_PASSWORD')
+        self.timeout = config.get('MAIL_TIMEOUT', 30)
+        self.max_per_connection = config.get('MAIL_MAX_PER_CONNECTION', 100)
+        self.idle_timeout = config.get('MAIL_IDLE_TIMEOUT', 60)
+        self.size = config.get('MAIL_CONCURRENCY', 4)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = []  # (connection, messages sent on it, last used)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        connection.ehlo()
+        if self.use_tls:
+            connection.starttls(context=ssl.create_default_context())
+            connection.ehlo()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    def _close(self, connection):
+        try:
+            connection.quit()
+        except Exception:
+            connection.close()
+
+    def _checkout(self):
+        """An idle connection (most recently used first), or a new one; returns (connection, sent, reused)"""
+        expired = []
+        found = None
+        with self._lock:
+            while self._idle:
+                connection, sent, last_used = self._idle.pop()
+                if time.monotonic() - last_used > self.idle_timeout:
+                    expired.append(connection)
+                    continue
+                found = (connection, sent, True)
+                break
+        for connection in expired:
+            self._close(connection)
+        return found or (self._connect(), 0, False)
+
+    def _checkin(self, connection, sent):
+        if sent >= self.max_per_connection:
+            self._close(connection)
+            return
+        with self._lock:
+            self._idle.append((connection, sent, time.monotonic()))
+
+    def send(self, message):
+        """Send an EmailMessage, waiting for a free connection slot"""
+        with self._slots:
+            for attempt in (1, 2):
+                connection, sent, reused = self._checkout()
+                try:
+                    connection.send_message(message)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                    # The server answered, so the connection is still usable unless it is closing
+                    if getattr(e, 'smtp_code', None) == 421:
+                        connection.close()
+                    else:
+                        self._checkin(connection, sent + 1)
+                    raise
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    connection.close()
+                    if reused and attempt == 1:
+                        continue  # Dropped while idle; once more on a new connection
+                    raise
+                self._checkin(connection, sent + 1)
+                return
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _, _ in idle:
+            self._close(connection)
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPPool(current_app.config)
+            atexit.register(_pool.close)
+        return _pool
+
+def close_pool():
+    """Close this process's idle SMTP connections; the next send opens new ones"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+def _insert_messages(rows):
+    """Insert outbox rows, skipping ones whose dedup_key is already queued; returns the rows added"""
+    if not rows:
+        return 0
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    result = db.session.execute(
+        insert(OutboundEmail.__table__).on_conflict_do_nothing(index_elements=['dedup_key']),
+        rows
+    )
+    return result.rowcount if result.rowcount >= 0 else len(rows)
+
+def kick(delay=None):
+    """Make sure a mail.deliver job is queued, in the caller's transaction.
+
+    At most one is queued at a time (its dedup_key), however many requests
+    kick at once. The default delay lets receipts queued close together go
+    out in one batch.
+    """
+    delay = current_app.config.get('MAIL_DELIVER_DELAY', 5) if delay is None else delay
+    enqueue('mail.deliver', delay=delay, commit=False, dedup_key='mail.deliver')
+
+def _name(display_name, email):
+    return display_name or email.split('@')[0]
+
+def queue_contribution_receipt(contribution, stockvel, user):
+    """Queue a receipt for a new contribution; the caller commits"""
+    name = _name(user.display_name, user.email)
+    _insert_messages([{
+        'kind': 'contribution_receipt',
+        'user_id': user.id,
+        'recipient': user.email,
+        'subject': f'Receipt: R{contribution.amount} to {stockvel.name}',
+        'body': (
+            f"Hi {name},\n\n"
+            f"We received your contribution of R{contribution.amount} to {stockvel.name} "
+            f"on {contribution.contribution_date:%d %B %Y}.\n\n"
+            f"Reference: {contribution.id}\n"
+            f"Payment method: {contribution.payment_method or '-'}\n\n"
+            "SaveTogether"
+        ),
+        'dedup_key': f'contribution_receipt:{contribution.id}'
+    }])
+    kick()
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+def next_due_date(start, frequency, today):
+    """The first contribution date on or after ``today`` of a group started on ``start``, and its round (from 0)"""
+    start = start.date() if isinstance(start, datetime) else start
+    if today <= start:
+        return start, 0
+    if frequency in ('Weekly', 'Bi-Weekly'):
+        days = 7 if frequency == 'Weekly' else 14
+        rounds = -(-(today - start).days // days)
+        return start + timedelta(days=rounds * days), rounds
+    months = (today.year - start.year) * 12 + today.month - start.month
+    if _add_months(start, months) < today:
+        months += 1
+    return _add_months(start, months), months
+
+def queue_payout_reminders(today=None):
+    """Queue a reminder to every member of groups with a contribution due within MAIL_REMINDER_DAYS_AHEAD.
+
+    The reminder names the member whose turn it is to be paid out, counting
+    members in the roster's order (ROSTER_ORDER). Groups are read in batches; reminders are keyed by group,
+    member and due date, so running this again the same day queues nothing.
+    """
+    config = current_app.config
+    today = today or datetime.utcnow().date()
+    horizon = today + timedelta(days=config.get('MAIL_REMINDER_DAYS_AHEAD', 2))
+    batch_size = config.get('MAIL_BATCH_SIZE', 200)
+    queued = 0
+    last_id = 0
+
+    while True:
+        groups = db.session.execute(
+            select(Stockvel)
+            .where(
+                Stockvel.id > last_id,
+                Stockvel.is_active == True,
+                Stockvel.start_date < datetime.combine(horizon + timedelta(days=1), datetime.min.time()),
+                or_(Stockvel.end_date.is_(None), Stockvel.end_date >= datetime.combine(today, datetime.min.time()))
+            )
+            .order_by(Stockvel.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not groups:
+            break
+        last_id = groups[-1].id
+
+        due = {}
+        for stockvel in groups:
+            due_date, round_number = next_due_date(stockvel.start_date, stockvel.frequency, today)
+            if due_date <= horizon and (stockvel.end_date is None or due_date <= stockvel.end_date.date()):
+                due[stockvel.id] = (stockvel, due_date, round_number)
+        if not due:
+            continue
+
+        members = {}
+        for row in db.session.execute(
+            select(StockvelMember.stockvel_id, User.id, User.email, User.display_name)
+            .join(User, User.id == StockvelMember.user_id)
+            .where(StockvelMember.stockvel_id.in_(due), StockvelMember.is_active == True, User.is_active == True)
+            .order_by(StockvelMember.stockvel_id, *ROSTER_ORDER)
+        ):
+            members.setdefault(row.stockvel_id, []).append(row)
+
+        rows = []
+        for stockvel_id, group_members in members.items():
+            stockvel, due_date, round_number = due[stockvel_id]
+            payee = group_members[round_number % len(group_members)]
+            for member in group_members:
+                turn = 'you' if member.id == payee.id else _name(payee.display_name, payee.email)
+                rows.append({
+                    'kind': 'payout_reminder',
+                    'user_id': member.id,
+                    'recipient': member.email,
+                    'subject': f'{stockvel.name}: R{stockvel.contribution_amount} due {due_date:%d %B}',
+                    'body': (
+                        f"Hi {_name(member.display_name, member.email)},\n\n"
+                        f"Your {stockvel.frequency.lower()} contribution of R{stockvel.contribution_amount} "
+                        f"to {stockvel.name} is due on {due_date:%d %B %Y}. "
+                        f"This round's payout goes to {turn}.\n\n"
+                        "SaveTogether"
+                    ),
+                    'dedup_key': f'payout_reminder:{stockvel_id}:{member.id}:{due_date.isoformat()}'
+                })
+        queued += _insert_messages(rows)
+        db.session.commit()
+
+    if queued:
+        kick(delay=0)
+        db.session.commit()
+    logger.info(f"Queued {queued} payout reminders")
+    return queued
+
+@task('mail.payout_reminders')
+def payout_reminders_task():
+    return {'queued': queue_payout_reminders()}
+
+def requeue_stale_messages():
+    """Return messages claimed by a delivery that died mid-batch to the queue"""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('MAIL_SEND_TIMEOUT', 600))
+    emails = OutboundEmail.__table__
+    count = db.session.execute(
+        emails.update()
+        .where(emails.c.status == 'sending', emails.c.locked_at < cutoff)
+        .values(status='queued', locked_by=None, locked_at=None)
+    ).rowcount
+    db.session.commit()
+    if count:
+        logger.warning(f"Requeued {count} stale outbound emails")
+    return count
+
+def claim_batch(limit):
+    """Mark up to ``limit`` due messages as sending and return them"""
+    token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    now = datetime.utcnow()
+    emails = OutboundEmail.__table__
+    due = (
+        select(emails.c.id)
+        .where(emails.c.status == 'queued', emails.c.send_after <= now)
+        .order_by(emails.c.send_after, emails.c.id)
+        .limit(limit)
+    )
+    if db.engine.dialect.name == 'postgresql':
+        # Concurrent deliveries skip each other's rows instead of waiting
+        due = due.with_for_update(skip_locked=True).scalar_subquery()
+    else:
+        due = db.session.execute(due).scalars().all()
+
+    db.session.execute(
+        emails.update()
+        .where(emails.c.id.in_(due), emails.c.status == 'queued')
+        .values(status='sending', locked_by=token, locked_at=now, attempts=emails.c.attempts + 1)
+    )
+    db.session.commit()
+    return db.session.execute(
+        select(OutboundEmail).where(OutboundEmail.locked_by == token, OutboundEmail.status == 'sending')
+    ).scalars().all()
+
+def build_message(email):
+    sender = current_app.config.get('MAIL_DEFAULT_SENDER', 'SaveTogether <no-reply@savetogether.app>')
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = email.recipient
+    message['Subject'] = email.subject
+    message['Date'] = formatdate(usegmt=True)
+    message['Message-ID'] = make_msgid(domain=parseaddr(sender)[1].rpartition('@')[2] or None)
+    message['Auto-Submitted'] = 'auto-generated'
+    message.set_content(email.body)
+    return message
+
+def is_permanent(error):
+    """Whether retrying cannot help (5xx replies, except login failures, which are our configuration)"""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+def retry_delay(attempts):
+    base = current_app.config.get('MAIL_RETRY_BACKOFF', 60)
+    return base * (2 ** max(attempts - 1, 0)) * random.uniform(0.8, 1.2)
+
+def send_batch(batch):
+    """Send claimed messages concurrently and record the outcomes; returns counts by outcome"""
+    config = current_app.config
+    messages = [build_message(email) for email in batch]
+
+    if not config.get('MAIL_SERVER'):
+        for email in batch:
+            logger.info(f"MAIL_SERVER unset; not sending {email.kind} to {email.recipient}: {email.subject}")
+        errors = [None] * len(batch)
+    else:
+        pool = get_pool()
+
+        def send(message):
+            try:
+                pool.send(message)
+                return None
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix='mail') as executor:
+            errors = list(executor.map(send, messages))
+
+    now = datetime.utcnow()
+    max_attempts = config.get('MAIL_MAX_ATTEMPTS', 5)
+    emails = OutboundEmail.__table__
+    outcomes = {'sent': 0, 'retrying': 0, 'failed': 0}
+    sent_ids = [email.id for email, error in zip(batch, errors) if error is None]
+    if sent_ids:
+        db.session.execute(
+            emails.update()
+            .where(emails.c.id.in_(sent_ids))
+            .values(status='sent', sent_at=now, locked_by=None, last_error=None)
+        )
+        outcomes['sent'] = len(sent_ids)
+
+    for email, error in zip(batch, errors):
+        if error is None:
+            continue
+        values = {'locked_by': None, 'locked_at': None, 'last_error': f'{type(error).__name__}: {error}'}
+        if is_permanent(error) or email.attempts >= max_attempts:
+            values['status'] = 'failed'
+            outcomes['failed'] += 1
+            logger.warning(f"Giving up on email {email.id} to {email.recipient}: {values['last_error']}")
+        else:
+            values['status'] = 'queued'
+            values['send_after'] = now + timedelta(seconds=retry_delay(email.attempts))
+            outcomes['retrying'] += 1
+        db.session.execute(emails.update().where(emails.c.id == email.id).values(**values))
+    db.session.commit()
+    return outcomes
+
+def deliver(max_seconds=None):
+    """Send due messages batch by batch until none are left or ``max_seconds`` have passed"""
+    config = current_app.config
+    requeue_stale_messages()
+    deadline = time.monotonic() + (max_seconds or config.get('MAIL_DELIVER_MAX_SECONDS', 300))
+    totals = {'sent': 0, 'retrying': 0, 'failed': 0}
+    while time.monotonic() < deadline:
+        batch = claim_batch(config.get('MAIL_BATCH_SIZE', 200))
+        if not batch:
+            break
+        for outcome, count in send_batch(batch).items():
+            totals[outcome] += count
+    else:
+        # Out of time with messages left; a new job carries on, so other tasks get a turn
+        kick(delay=0)
+        db.session.commit()
+    logger.info(f"Mail delivery: {totals}")
+    return totals
+
+@task('mail.deliver')
+def deliver_task():
+    return deliver()
@@ -0,0 +1,48 @@
+from services.database_service import db
+from models.stockvel import Stockvel, StockvelMember
+from sqlalchemy import select, insert, func, literal
+import logging
+
+logger = logging.getLogger(__name__)
+
+def add_member_if_room(stockvel_id, user_id, is_admin=False):
+    """Add a membership only while the stockvel has fewer than max_members members.
+
+    The capacity check and the insert are one ``INSERT ... SELECT ... WHERE
+    count < max_members`` statement, counted from the (stockvel_id, user_id)
+    unique index instead of loading the members. On PostgreSQL the stockvel
+    row is locked first so concurrent joins to the same group queue up rather
+    than all seeing the same count; SQLite runs one writer at a time anyway.
+    The same lock keeps the new member's payout position, one after the
+    group's last, unique.
+
+    Returns the new StockvelMember, or None when the stockvel is full. A
+    duplicate membership raises IntegrityError. The caller commits.
+    """
+    db.session.execute(select(Stockvel.id).where(Stockvel.id == stockvel_id).with_for_update())
+
+    member_count = (
+        select(func.count(StockvelMember.id))
+        .where(StockvelMember.stockvel_id == stockvel_id)
+        .scalar_subquery()
+    )
+    capacity = select(Stockvel.max_members).where(Stockvel.id == stockvel_id).scalar_subquery()
+    next_position = (
+        select(func.coalesce(func.max(StockvelMember.position) + 1, 0))
+        .where(StockvelMember.stockvel_id == stockvel_id)
+        .scalar_subquery()
+    )
+
+    member_id = db.session.execute(
+        insert(StockvelMember)
+        .from_select(
+            ['stockvel_id', 'user_id', 'is_admin', 'position'],
+            select(literal(stockvel_id), literal(user_id), literal(is_admin), next_position).where(member_count < capacity)
+        )
+        .returning(StockvelMember.id)
+    ).scalar()
+
+    if member_id is None:
+        logger.info(f"Stockvel {stockvel_id} is full; user {user_id} not added")
+        return None
+    return db.session.get(StockvelMember, member_id)
@@ -0,0 +1,234 @@
+"""
+Per-worker memory instrumentation.
+
+Each worker reports its RSS and, while tracemalloc is tracing, the source
+lines holding the most memory and those that grew the most since the first
+snapshot (the baseline) and since the previous one. Reports are written to
+MEMORY_FOLDER as ``worker-<pid>.json``, so the admin endpoints see every
+worker on the host, not just the one serving the request.
+
+Snapshots are triggered through ``trigger.json`` in the same folder: each
+worker checks it at most every MEMORY_TRIGGER_CHECK seconds before a
+request, so an idle worker reports on its next request. MEMORY_TRACE starts
+tracing at boot instead of on the first snapshot, which also attributes
+memory allocated before it.
+
+Workers whose RSS passes WORKER_MAX_RSS_MB are recycled by gunicorn.conf.py.
+"""
+from flask import current_app
+from datetime import datetime
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+HISTORY_SIZE = 50  # RSS samples kept per worker report
+
+# Allocations by tracemalloc and the import machinery are noise in a report
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+def rss_bytes():
+    """Resident set size of this process (peak RSS where /proc isn't available)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+def memory_folder(config):
+    folder = config.get('MEMORY_FOLDER', 'logs/memory')
+    return folder if os.path.isabs(folder) else os.path.join(BASE_DIR, folder)
+
+def _stat(stat):
+    frame = stat.traceback[0]
+    return {
+        'where': f'{frame.filename}:{frame.lineno}',
+        'size_kb': round(stat.size / 1024, 1),
+        'count': stat.count
+    }
+
+def _diff(stat):
+    frame = stat.traceback[0]
+    return {
+        'where': f'{frame.filename}:{frame.lineno}',
+        'size_diff_kb': round(stat.size_diff / 1024, 1),
+        'count_diff': stat.count_diff,
+        'size_kb': round(stat.size / 1024, 1)
+    }
+
+class WorkerMemory:
+    """Snapshots and the report of this process"""
+
+    def __init__(self, folder, top, frames):
+        self.folder = folder
+        self.top = top
+        self.frames = frames
+        self.lock = threading.Lock()
+        self.baseline = None
+        self.previous = None
+        self.history = []
+        self.check_lock = threading.Lock()
+        self.last_trigger = None
+        self.last_check = 0.0
+
+    @property
+    def path(self):
+        return os.path.join(self.folder, f'worker-{os.getpid()}.json')
+
+    def start_tracing(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop_tracing(self):
+        with self.lock:
+            tracemalloc.stop()
+            self.baseline = self.previous = None
+        self.write_report(self.report())
+
+    def snapshot(self):
+        """Take a snapshot (starting tracemalloc if needed), write and return the report"""
+        with self.lock:
+            self.start_tracing()
+            snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+            report = self.report(snapshot)
+            self.previous = snapshot
+            if self.baseline is None:
+                self.baseline = snapshot
+        self.write_report(report)
+        return report
+
+    def report(self, snapshot=None):
+        rss = rss_bytes()
+        self.history = (self.history + [[datetime.utcnow().isoformat(), round(rss / 1048576, 1)]])[-HISTORY_SIZE:]
+        report = {
+            'pid': os.getpid(),
+            'taken_at': datetime.utcnow().isoformat(),
+            'rss_mb': round(rss / 1048576, 1),
+            'rss_history': self.history,
+            'tracing': tracemalloc.is_tracing()
+        }
+        if snapshot is None:
+            return report
+
+        current, peak = tracemalloc.get_traced_memory()
+        report['traced_mb'] = round(current / 1048576, 1)
+        report['traced_peak_mb'] = round(peak / 1048576, 1)
+        report['top'] = [_stat(stat) for stat in snapshot.statistics('lineno')[:self.top]]
+        if self.baseline is not None:
+            report['growth_since_baseline'] = [_diff(stat) for stat in snapshot.compare_to(self.baseline, 'lineno')[:self.top]]
+        if self.previous is not None:
+            report['growth_since_previous'] = [_diff(stat) for stat in snapshot.compare_to(self.previous, 'lineno')[:self.top]]
+        return report
+
+    def write_report(self, report):
+        os.makedirs(self.folder, exist_ok=True)
+        partial = f'{self.path}.partial'
+        with open(partial, 'w', encoding='utf-8') as f:
+            json.dump(report, f)
+        os.replace(partial, self.path)
+
+    def read_trigger(self):
+        try:
+            with open(os.path.join(self.folder, 'trigger.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def check_trigger(self, interval):
+        """Act on a trigger written since the last check; cheap enough to call before every request"""
+        now = time.monotonic()
+        if now - self.last_check < interval or not self.check_lock.acquire(blocking=False):
+            return
+        try:
+            self.last_check = now
+            trigger = self.read_trigger()
+            if trigger is None or trigger['id'] == self.last_trigger:
+                return
+            self.last_trigger = trigger['id']
+            if trigger.get('pid') not in (None, os.getpid()):
+                return
+            self.run(trigger['action'])
+        finally:
+            self.check_lock.release()
+
+    def run(self, action):
+        if action == 'stop':
+            self.stop_tracing()
+        else:
+            report = self.snapshot()
+            logger.info(f"Memory snapshot of worker {report['pid']}: {report['rss_mb']}MB RSS, {report['traced_mb']}MB traced")
+
+def init_memory_instrumentation(app):
+    """Check for snapshot triggers before requests; start tracing now if MEMORY_TRACE"""
+    config = app.config
+    if not config.get('MEMORY_INSTRUMENTATION', True):
+        return
+    memory = WorkerMemory(memory_folder(config), config.get('MEMORY_TOP_STATS', 25), config.get('MEMORY_TRACE_FRAMES', 1))
+    app.extensions['worker_memory'] = memory
+    # Only triggers written from now on apply to this worker
+    trigger = memory.read_trigger()
+    memory.last_trigger = trigger and trigger['id']
+    if config.get('MEMORY_TRACE'):
+        memory.start_tracing()
+    interval = config.get('MEMORY_TRIGGER_CHECK', 5)
+
+    @app.before_request
+    def check_memory_trigger():
+        try:
+            memory.check_trigger(interval)
+        except Exception as e:
+            logger.warning(f"Memory snapshot failed: {str(e)}")
+
+def trigger(action='snapshot', pid=None):
+    """Ask every worker (or worker ``pid``) to take a snapshot or stop tracing"""
+    folder = memory_folder(current_app.config)
+    os.makedirs(folder, exist_ok=True)
+    trigger = {'id': f'{time.time():.6f}-{os.getpid()}', 'action': action, 'pid': pid}
+    partial = os.path.join(folder, f'trigger.json.{os.getpid()}')
+    with open(partial, 'w', encoding='utf-8') as f:
+        json.dump(trigger, f)
+    os.replace(partial, os.path.join(folder, 'trigger.json'))
+    return trigger
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def worker_reports():
+    """Latest report of each worker on this host, largest RSS first; reports of exited workers are deleted"""
+    folder = memory_folder(current_app.config)
+    if not os.path.isdir(folder):
+        return []
+    reports = []
+    for name in os.listdir(folder):
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not _alive(report['pid']):
+            os.remove(path)
+            continue
+        reports.append(report)
+    return sorted(reports, key=lambda report: report['rss_mb'], reverse=True)
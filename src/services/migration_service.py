@@ -0,0 +1,348 @@
+"""
+Versioned schema migrations (run with ``python migrate.py``).
+
+Migrations are the files in migrations/ named ``NNNN_description.sql`` or
+``NNNN_description.py``, applied in version order and recorded in
+``schema_migrations``. Header comments of an SQL file set options:
+
+    -- migrate: postgresql            only on these dialects; recorded as skipped elsewhere
+    -- migrate: no-transaction        statements run one at a time in autocommit
+
+A file runs in one transaction with its ``schema_migrations`` row unless it
+is no-transaction. Files using CREATE INDEX CONCURRENTLY are no-transaction
+automatically, since PostgreSQL refuses it inside a transaction. They should
+be re-runnable (IF NOT EXISTS; drop an INVALID index left by a failed build
+first), because a failure leaves the statements before it applied.
+
+A Python migration defines ``upgrade(migration)`` and may set ``DIALECTS``
+and ``TRANSACTIONAL = False``. Data changes on large tables go through
+``migration.backfill``, which updates one key range per short transaction,
+adapting the range to MIGRATION_BATCH_TARGET_MS and pausing
+MIGRATION_BATCH_PAUSE between batches, and stores its progress with the
+migration so an interrupted run resumes where it stopped. On PostgreSQL
+every statement runs with lock_timeout = MIGRATION_LOCK_TIMEOUT_MS, so DDL
+waiting behind a long transaction fails fast instead of blocking traffic
+queued behind it, and concurrent runners are serialized by an advisory lock.
+"""
+from models.schema_migration import SchemaMigration
+from sqlalchemy import select, insert, update, delete, func, table, column, text
+from datetime import datetime
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+MIGRATIONS_DIR = os.path.join(BASE_DIR, 'migrations')
+
+FILENAME = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+DIRECTIVE = re.compile(r'^--\s*migrate:\s*(.+)$', re.MULTILINE)
+CONCURRENTLY = re.compile(r'\bCONCURRENTLY\b', re.IGNORECASE)
+ADVISORY_LOCK_ID = 7301946  # Arbitrary; shared by every runner of this app
+
+class Migration:
+    def __init__(self, path):
+        version, name, kind = FILENAME.match(os.path.basename(path)).groups()
+        self.version = version
+        self.name = name
+        self.kind = kind
+        self.path = path
+        with open(path, 'rb') as f:
+            source = f.read()
+        self.checksum = hashlib.sha256(source).hexdigest()
+        self.dialects = None
+        self.transactional = True
+        self.module = None
+
+        if kind == 'sql':
+            self.sql = source.decode('utf-8')
+            for directive in DIRECTIVE.findall(self.sql):
+                for option in (option.strip() for option in directive.split(',')):
+                    if option == 'no-transaction':
+                        self.transactional = False
+                    elif option:
+                        self.dialects = (self.dialects or ()) + (option,)
+            if CONCURRENTLY.search(self.sql):
+                self.transactional = False
+        else:
+            spec = importlib.util.spec_from_file_location(f'migrations.m{version}_{name}', path)
+            self.module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self.module)
+            self.dialects = getattr(self.module, 'DIALECTS', None)
+            self.transactional = getattr(self.module, 'TRANSACTIONAL', True)
+
+    def __repr__(self):
+        return f"<Migration({self.version}_{self.name}.{self.kind})>"
+
+    def applies_to(self, dialect):
+        return self.dialects is None or dialect in self.dialects
+
+def discover(folder=MIGRATIONS_DIR):
+    """The migrations in ``folder``, in version order"""
+    migrations = [Migration(os.path.join(folder, name)) for name in sorted(os.listdir(folder)) if FILENAME.match(name)]
+    versions = [migration.version for migration in migrations]
+    duplicates = sorted({version for version in versions if versions.count(version) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate migration versions: {', '.join(duplicates)}")
+    return migrations
+
+def split_statements(sql):
+    """Top-level statements of an SQL script, honouring quotes, comments and $tag$ bodies"""
+    statements = []
+    current = []
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end + 1
+            continue
+        if sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = len(sql) if end == -1 else end + 2
+            continue
+        if char in ("'", '"'):
+            end = i + 1
+            while end < len(sql):
+                if sql[end] == char and sql.startswith(char * 2, end):
+                    end += 2
+                    continue
+                if sql[end] == char:
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        dollar = re.match(r'\$(\w*)\$', sql[i:]) if char == '$' else None
+        if dollar:
+            tag = dollar.group(0)
+            end = sql.find(tag, i + len(tag))
+            end = len(sql) if end == -1 else end + len(tag)
+            current.append(sql[i:end])
+            i = end
+            continue
+        if char == ';':
+            statements.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statements.append(''.join(current).strip())
+    return [statement for statement in statements if statement]
+
+class MigrationContext:
+    """What a Python migration's ``upgrade`` receives"""
+
+    def __init__(self, runner, migration, connection):
+        self.runner = runner
+        self.migration = migration
+        self.connection = connection
+        self.dialect = runner.dialect
+
+    def execute(self, statement, **params):
+        return self.connection.execute(text(statement), params)
+
+    def backfill(self, step, table_name, statement, key='id', batch_size=None):
+        """Run ``statement`` for ranges ``:lo < key <= :hi`` of ``table_name``, one transaction per range.
+
+        Covers the keys that exist when it starts; rows added later must be
+        written correctly by the application. Returns the rows affected.
+        """
+        if self.migration.transactional:
+            raise RuntimeError(f"{self.migration!r} must set TRANSACTIONAL = False to backfill")
+        runner = self.runner
+        config = runner.config
+        size = batch_size or config.get('MIGRATION_BATCH_SIZE', 1000)
+        target = config.get('MIGRATION_BATCH_TARGET_MS', 500) / 1000
+        pause = config.get('MIGRATION_BATCH_PAUSE', 0.05)
+        keys = table(table_name, column(key))
+
+        with runner.engine.connect() as conn:
+            low, high = conn.execute(select(func.min(keys.c[key]), func.max(keys.c[key]))).one()
+        checkpoint = runner.checkpoint(self.migration.version)
+        lo = checkpoint.get(step, low - 1 if low is not None else None)
+        if high is None or lo >= high:
+            logger.info(f"{self.migration.version} {step}: nothing to backfill")
+            return 0
+
+        rows = 0
+        batches = 0
+        while lo < high:
+            hi = min(lo + size, high)
+            started = time.perf_counter()
+            with runner.engine.begin() as conn:
+                runner.set_lock_timeout(conn, local=True)
+                rows += max(conn.execute(text(statement), {'lo': lo, 'hi': hi}).rowcount, 0)
+                checkpoint[step] = hi
+                runner.save_checkpoint(conn, self.migration.version, checkpoint)
+            elapsed = time.perf_counter() - started
+            lo = hi
+            batches += 1
+
+            # Keep each transaction (and the row locks it holds) short
+            if elapsed > target * 2:
+                size = max(1, size // 2)
+            elif elapsed < target / 2:
+                size = int(size * 1.5) + 1
+            if batches % 10 == 0 or lo >= high:
+                logger.info(f"{self.migration.version} {step}: {key} {lo}/{high}, {rows} rows, batch {size}")
+            if pause and lo < high:
+                time.sleep(pause)
+        return rows
+
+class MigrationRunner:
+    def __init__(self, engine, config, folder=MIGRATIONS_DIR):
+        self.engine = engine
+        self.config = config
+        self.folder = folder
+        self.dialect = engine.dialect.name
+        self.lock_timeout = config.get('MIGRATION_LOCK_TIMEOUT_MS', 5000)
+        self.migrations = discover(folder)
+        SchemaMigration.__table__.create(engine, checkfirst=True)
+
+    def applied(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(SchemaMigration.__table__)).mappings().all()
+        return {row['version']: row for row in rows}
+
+    def status(self):
+        """Every migration with its state ('pending' if it never ran) and whether its file changed since"""
+        applied = self.applied()
+        report = []
+        for migration in self.migrations:
+            row = applied.get(migration.version)
+            report.append({
+                'version': migration.version,
+                'name': migration.name,
+                'state': row['state'] if row else 'pending',
+                'applied_at': row['applied_at'] if row else None,
+                'changed': bool(row) and row['state'] != 'baseline' and row['checksum'] != migration.checksum,
+                'transactional': migration.transactional,
+                'applies': migration.applies_to(self.dialect)
+            })
+        return report
+
+    def pending(self, target=None):
+        applied = self.applied()
+        return [
+            migration for migration in self.migrations
+            if (migration.version not in applied or applied[migration.version]['state'] == 'running')
+            and (target is None or migration.version <= target)
+        ]
+
+    def checkpoint(self, version):
+        with self.engine.connect() as conn:
+            value = conn.execute(select(SchemaMigration.checkpoint).where(SchemaMigration.version == version)).scalar()
+        return json.loads(value) if value else {}
+
+    def save_checkpoint(self, conn, version, checkpoint):
+        conn.execute(update(SchemaMigration).where(SchemaMigration.version == version).values(checkpoint=json.dumps(checkpoint)))
+
+    def set_lock_timeout(self, conn, local=False):
+        if self.dialect == 'postgresql' and self.lock_timeout:
+            conn.exec_driver_sql(f"SET {'LOCAL ' if local else ''}lock_timeout = {int(self.lock_timeout)}")
+
+    def _record(self, conn, migration, state, started=None):
+        values = {
+            'name': migration.name,
+            'checksum': migration.checksum,
+            'state': state,
+            'applied_at': datetime.utcnow() if state != 'running' else None,
+            'duration_ms': int((time.perf_counter() - started) * 1000) if started and state != 'running' else None
+        }
+        if state != 'running':
+            values['checkpoint'] = None
+        exists = conn.execute(select(SchemaMigration.version).where(SchemaMigration.version == migration.version)).first()
+        if exists:
+            conn.execute(update(SchemaMigration).where(SchemaMigration.version == migration.version).values(**values))
+        else:
+            conn.execute(insert(SchemaMigration).values(version=migration.version, started_at=datetime.utcnow(), **values))
+
+    def _apply(self, migration):
+        started = time.perf_counter()
+        if migration.transactional:
+            with self.engine.begin() as conn:
+                self.set_lock_timeout(conn, local=True)
+                self._run(migration, conn)
+                self._record(conn, migration, 'applied', started)
+            return
+
+        # Recorded as running first, so backfill checkpoints have a row and a failed run is resumed
+        with self.engine.begin() as conn:
+            self._record(conn, migration, 'running')
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            self.set_lock_timeout(conn)
+            try:
+                self._run(migration, conn)
+            finally:
+                if self.dialect == 'postgresql':
+                    conn.exec_driver_sql('RESET lock_timeout')
+        with self.engine.begin() as conn:
+            self._record(conn, migration, 'applied', started)
+
+    def _run(self, migration, conn):
+        if migration.kind == 'sql':
+            raw = conn.execution_options(no_parameters=True)
+            for statement in split_statements(migration.sql):
+                raw.exec_driver_sql(statement)
+        else:
+            migration.module.upgrade(MigrationContext(self, migration, conn))
+
+    def _lock(self):
+        """Hold PostgreSQL's advisory lock for the run, so two deploys don't migrate at once"""
+        if self.dialect != 'postgresql':
+            return None
+        conn = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        conn.exec_driver_sql(f'SELECT pg_advisory_lock({ADVISORY_LOCK_ID})')
+        return conn
+
+    def _unlock(self, conn):
+        if conn is not None:
+            conn.exec_driver_sql(f'SELECT pg_advisory_unlock({ADVISORY_LOCK_ID})')
+            conn.close()
+
+    def upgrade(self, target=None):
+        """Apply pending migrations up to ``target`` (inclusive); returns the versions applied or skipped"""
+        lock = self._lock()
+        done = []
+        try:
+            for migration in self.pending(target):
+                if not migration.applies_to(self.dialect):
+                    with self.engine.begin() as conn:
+                        self._record(conn, migration, 'skipped')
+                    logger.info(f"Skipped {migration.version}_{migration.name} (only for {', '.join(migration.dialects)})")
+                else:
+                    logger.info(f"Applying {migration.version}_{migration.name}{'' if migration.transactional else ' (no transaction)'}")
+                    started = time.perf_counter()
+                    self._apply(migration)
+                    logger.info(f"Applied {migration.version}_{migration.name} in {time.perf_counter() - started:.2f}s")
+                done.append(migration.version)
+        finally:
+            self._unlock(lock)
+        return done
+
+    def baseline(self, target=None):
+        """Record migrations up to ``target`` as applied without running them (databases built by create_all)"""
+        lock = self._lock()
+        try:
+            applied = self.applied()
+            versions = []
+            with self.engine.begin() as conn:
+                for migration in self.migrations:
+                    if migration.version in applied or (target is not None and migration.version > target):
+                        continue
+                    self._record(conn, migration, 'baseline')
+                    versions.append(migration.version)
+            return versions
+        finally:
+            self._unlock(lock)
+
+    def forget(self, version):
+        """Drop the record of a migration so it runs again"""
+        with self.engine.begin() as conn:
+            return conn.execute(delete(SchemaMigration).where(SchemaMigration.version == version)).rowcount
@@ -0,0 +1,222 @@
+"""
+Monthly range partitions for the contributions ledger on PostgreSQL.
+
+``contributions`` is declared ``PARTITION BY RANGE (contribution_date)`` (see
+models/stockvel.py), one partition per month named ``contributions_pYYYYMM``
+plus ``contributions_default`` for anything outside them. The
+``partitions.maintain`` task keeps partitions created a few months ahead.
+
+Ledger queries bound ``contribution_date`` from below by the group's
+``ledger_starts_at`` (serialization_service.ledger_bound), so a group's reads
+only scan the months since its first contribution. The task can also detach
+old months, but only once archiving (archive_service) has moved every
+contribution out of them; a month that still holds a row is never detached,
+so no live query loses one. On SQLite the table is a single ordinary table
+and all of this is a no-op.
+"""
+from services.database_service import db
+from services.job_service import task
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import PrimaryKeyConstraint
+from datetime import datetime
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MONTHS_AHEAD = 3
+
+def partitioned(table, column):
+    """Mark ``table`` as range-partitioned by ``column`` on PostgreSQL.
+
+    The table's ``__table_args__`` carry ``postgresql_partition_by``; this adds
+    the partition key to the primary key (PostgreSQL requires it) and creates
+    the initial partitions whenever the table itself is created.
+    """
+    table.info['partition_key'] = column
+    event.listen(table, 'after_create', _create_initial_partitions)
+    return table
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _primary_key_with_partition_key(constraint, compiler, **kw):
+    key = constraint.table.info.get('partition_key')
+    if not key or key in constraint.columns:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+
+    # The ORM still identifies rows by id alone; the sequence keeps it unique
+    preparer = compiler.preparer
+    columns = [column.name for column in constraint.columns] + [key]
+    sql = ''
+    if constraint.name is not None:
+        sql += f"CONSTRAINT {preparer.format_constraint(constraint)} "
+    return sql + f"PRIMARY KEY ({', '.join(preparer.quote(name) for name in columns)})"
+
+def _create_initial_partitions(table, connection, **kw):
+    if connection.dialect.name != 'postgresql':
+        return
+    months_ahead = DEFAULT_MONTHS_AHEAD
+    if has_app_context():
+        months_ahead = current_app.config.get('CONTRIBUTION_PARTITIONS_AHEAD', DEFAULT_MONTHS_AHEAD)
+    ensure_partitions(connection, table.name, months_ahead=months_ahead)
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(table_name, month):
+    return f"{table_name}_p{month.year:04d}{month.month:02d}"
+
+def partition_month(table_name, name):
+    """The month a partition named by partition_name covers, or None for other tables"""
+    match = re.fullmatch(rf"{re.escape(table_name)}_p(\d{{4}})(\d{{2}})", name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+def is_partitioned(connection, table_name):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+        {'table': table_name}
+    ).first() is not None
+
+def list_partitions(connection, table_name):
+    """Names of the partitions currently attached to ``table_name``"""
+    return [row[0] for row in connection.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+        ),
+        {'table': table_name}
+    )]
+
+def _table_exists(connection, name):
+    return connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}).scalar()
+
+def _bound(value):
+    return f"'{value:%Y-%m-%d %H:%M:%S}'"
+
+def create_partition(connection, table_name, month):
+    """Create and attach the partition for ``month``.
+
+    Rows for that month already sitting in the default partition are moved
+    into the new table first, since PostgreSQL refuses to attach a range the
+    default partition has rows for.
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    key = quote(_partition_key(table_name))
+    parent = quote(table_name)
+    name = quote(partition_name(table_name, month))
+    start, end = _bound(month), _bound(add_months(month, 1))
+
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    default = f"{table_name}_default"
+    if _table_exists(connection, default):
+        connection.execute(text(
+            f"WITH moved AS (DELETE FROM {quote(default)} WHERE {key} >= {start} AND {key} < {end} RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ))
+    connection.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})"))
+    logger.info(f"Created partition {partition_name(table_name, month)}")
+
+def _partition_key(table_name):
+    return db.metadata.tables[table_name].info['partition_key']
+
+def ensure_partitions(connection, table_name, months_ahead=DEFAULT_MONTHS_AHEAD, now=None):
+    """Make sure the default partition and this month's and the next ``months_ahead`` months' exist.
+
+    Returns the names of the partitions created. Months that were detached
+    are not recreated unless they fall in that window.
+    """
+    if not is_partitioned(connection, table_name):
+        return []
+
+    quote = connection.dialect.identifier_preparer.quote
+    default = f"{table_name}_default"
+    if not _table_exists(connection, default):
+        connection.execute(text(f"CREATE TABLE {quote(default)} PARTITION OF {quote(table_name)} DEFAULT"))
+
+    attached = set(list_partitions(connection, table_name))
+    current = month_start(now or datetime.utcnow())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        name = partition_name(table_name, month)
+        if name not in attached and not _table_exists(connection, name):
+            create_partition(connection, table_name, month)
+            created.append(name)
+    return created
+
+def detach_partitions(connection, table_name, before):
+    """Detach the empty monthly partitions that end on or before ``before``'s month.
+
+    Each partition is locked before it is checked, so no row can arrive
+    between the check and the detach. Returns the names of the partitions
+    detached.
+    """
+    if not is_partitioned(connection, table_name):
+        return []
+
+    quote = connection.dialect.identifier_preparer.quote
+    cutoff = month_start(before)
+    detached = []
+    for name in list_partitions(connection, table_name):
+        month = partition_month(table_name, name)
+        if month is None or add_months(month, 1) > cutoff:
+            continue
+        connection.execute(text(f"LOCK TABLE {quote(name)} IN ACCESS EXCLUSIVE MODE"))
+        if connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {quote(name)})")).scalar():
+            logger.info(f"Keeping partition {name} attached; it still has rows of unarchived groups")
+            continue
+        connection.execute(text(f"ALTER TABLE {quote(table_name)} DETACH PARTITION {quote(name)}"))
+        detached.append(name)
+        logger.info(f"Detached partition {name}")
+    return detached
+
+def attach_partition(connection, table_name, name):
+    """Attach a previously detached monthly partition again.
+
+    Rows for its month that arrived meanwhile (a restored group) went to the
+    default partition; they are moved into it first, as in create_partition.
+    """
+    month = partition_month(table_name, name)
+    if month is None:
+        raise ValueError(f"{name} is not a monthly partition of {table_name}")
+    quote = connection.dialect.identifier_preparer.quote
+    key = quote(_partition_key(table_name))
+    start, end = _bound(month), _bound(add_months(month, 1))
+    default = f"{table_name}_default"
+    if _table_exists(connection, default):
+        connection.execute(text(
+            f"WITH moved AS (DELETE FROM {quote(default)} WHERE {key} >= {start} AND {key} < {end} RETURNING *) "
+            f"INSERT INTO {quote(name)} SELECT * FROM moved"
+        ))
+    connection.execute(text(
+        f"ALTER TABLE {quote(table_name)} ATTACH PARTITION {quote(name)} FOR VALUES FROM ({start}) TO ({end})"
+    ))
+    logger.info(f"Attached partition {name}")
+
+def maintain_contribution_partitions():
+    """Create upcoming months and, when CONTRIBUTION_PARTITIONS_DETACH_AFTER is set, detach old emptied ones"""
+    config = current_app.config
+    with db.engine.begin() as connection:
+        created = ensure_partitions(
+            connection, 'contributions',
+            months_ahead=config.get('CONTRIBUTION_PARTITIONS_AHEAD', DEFAULT_MONTHS_AHEAD)
+        )
+
+    detached = []
+    detach_after = config.get('CONTRIBUTION_PARTITIONS_DETACH_AFTER', 0)
+    if detach_after:
+        before = add_months(month_start(datetime.utcnow()), -detach_after)
+        with db.engine.begin() as connection:
+            detached = detach_partitions(connection, 'contributions', before)
+    return {'created': created, 'detached': detached}
+
+@task('partitions.maintain')
+def maintain_partitions_task():
+    return maintain_contribution_partitions()
@@ -0,0 +1,285 @@
+"""
+Slow-query log with EXPLAIN plans.
+
+Every statement is timed with cursor execute events; one slower than
+SLOW_QUERY_MS is written as a JSON line to SLOW_QUERY_LOG with its
+normalized text, a fingerprint of that text, the route (or job) that issued
+it and its plan. SLOW_QUERY_EXPLAIN picks the plan: 'plan' runs EXPLAIN
+(EXPLAIN QUERY PLAN on SQLite), 'analyze' runs read-only SELECTs again under
+EXPLAIN ANALYZE (anything else just gets its plan), 'off' skips it. Either
+way the EXPLAIN runs inside a savepoint that is rolled back. Each fingerprint is explained at most once per
+SLOW_QUERY_EXPLAIN_INTERVAL per worker, so a regression doesn't double the
+load it already causes.
+
+All workers on the host append to the same file, which is rotated at
+SLOW_QUERY_LOG_BYTES with SLOW_QUERY_LOG_BACKUPS old files kept;
+``top_slow_queries`` aggregates them for /api/admin/slow-queries.
+"""
+from services.job_service import current_job_id
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from collections import Counter
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: rotation isn't coordinated between processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+_PLACEHOLDERS = re.compile(r"%\(\w+\)s|\$\d+|(?<!:):[a-zA-Z_]\w*|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize(statement):
+    """Statement text with literals and parameters as ?, IN lists collapsed and whitespace squeezed"""
+    statement = _PLACEHOLDERS.sub('?', statement)
+    statement = _IN_LISTS.sub('(?...)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+# What EXPLAIN ANALYZE may run again: a SELECT (or WITH) that writes and locks nothing and
+# calls only these functions; a call to anything else (nextval, pg_notify, pg_advisory_lock,
+# a user-defined function) could have side effects, so such a statement only gets its plan
+ANALYZE_SAFE_FUNCTIONS = frozenset({
+    'count', 'sum', 'min', 'max', 'avg', 'coalesce', 'nullif', 'greatest', 'least',
+    'lower', 'upper', 'length', 'trim', 'substr', 'substring', 'concat', 'replace',
+    'abs', 'round', 'floor', 'ceil', 'date_trunc', 'date_part', 'extract', 'to_char', 'now',
+    'row_number', 'rank', 'dense_rank', 'lag', 'lead', 'array_agg', 'string_agg', 'json_agg',
+    'json_build_object', 'bool_or', 'bool_and', 'cast',
+})
+# Keywords and type names that may be followed by a parenthesis without being a call
+_SQL_KEYWORDS = frozenset({
+    'select', 'from', 'join', 'where', 'and', 'or', 'not', 'on', 'in', 'exists', 'any', 'all',
+    'some', 'as', 'over', 'filter', 'values', 'by', 'when', 'then', 'else', 'case', 'having',
+    'using', 'lateral', 'with', 'union', 'except', 'intersect', 'array', 'row', 'is', 'like', 'between',
+    'numeric', 'decimal', 'varchar', 'char', 'timestamp',
+})
+# Comments, string literals and quoted names, matched together so none hides inside another
+_OPAQUE = re.compile(r'''--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|"(?:[^"]|"")*"''', re.DOTALL)
+_WRITES_OR_LOCKS = re.compile(
+    r'\b(?:INSERT|UPDATE|DELETE|MERGE|INTO|TRUNCATE|LOCK|FOR\s+(?:KEY\s+)?SHARE)\b|\$\w*\$', re.IGNORECASE
+)
+_CALLS = re.compile(r'\b([a-zA-Z_][\w.]*)\s*\(')
+
+def _opaque(match):
+    return {'-': ' ', '/': ' ', "'": '?'}.get(match.group()[0], 'name')
+
+def analyzable(statement):
+    """Whether ``statement`` is a plain read-only SELECT that EXPLAIN ANALYZE may run again"""
+    statement = _OPAQUE.sub(_opaque, statement).strip()
+    if statement[:6].upper() not in ('SELECT', 'WITH ') or _WRITES_OR_LOCKS.search(statement):
+        return False
+    for name in _CALLS.findall(statement):
+        name = name.lower()
+        if name not in _SQL_KEYWORDS and name not in ANALYZE_SAFE_FUNCTIONS:
+            return False
+    return True
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+def log_path(config):
+    path = config.get('SLOW_QUERY_LOG', 'logs/slow_queries.log')
+    return path if os.path.isabs(path) else os.path.join(BASE_DIR, path)
+
+class SharedLogFile:
+    """Append-only JSON lines file shared by processes, rotated by size.
+
+    Lines are written with O_APPEND, so writers don't interleave. Rotation
+    takes an flock on ``<path>.lock``; a writer whose file was rotated by
+    another process notices the new inode and reopens.
+    """
+
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        self.fd = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _open(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _current(self):
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self.fd).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _rotate(self):
+        with open(self.path + '.lock', 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have rotated while we waited
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                for number in range(self.backups - 1, 0, -1):
+                    if os.path.exists(f'{self.path}.{number}'):
+                        os.replace(f'{self.path}.{number}', f'{self.path}.{number + 1}')
+                if self.backups:
+                    os.replace(self.path, f'{self.path}.1')
+                else:
+                    os.remove(self.path)
+        self._open()
+
+    def write(self, record):
+        line = (json.dumps(record, default=str, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            if self.fd is None or not self._current():
+                self._open()
+            os.write(self.fd, line)
+            if os.fstat(self.fd).st_size >= self.max_bytes:
+                self._rotate()
+
+    def files(self):
+        """Current file last, so newer records win"""
+        names = [f'{self.path}.{number}' for number in range(self.backups, 0, -1)] + [self.path]
+        return [name for name in names if os.path.exists(name)]
+
+def _origin():
+    """The route or job issuing the current statement"""
+    if has_request_context():
+        return {'route': request.endpoint, 'method': request.method, 'path': request.path}
+    job_id = current_job_id()
+    if job_id is not None:
+        return {'route': None, 'job_id': job_id}
+    return {'route': None}
+
+def explain(conn, statement, parameters, analyze):
+    """Plan of a statement, run on the same connection through a raw cursor (so it isn't timed itself)"""
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze and analyzable(statement) else 'EXPLAIN '
+    else:
+        return None
+
+    cursor = conn.connection.dbapi_connection.cursor()
+    savepoint = dialect == 'postgresql'
+    try:
+        # Whatever the EXPLAIN did, or however it failed, is undone before the caller goes on
+        if savepoint:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+    except Exception as e:
+        return f'EXPLAIN failed: {str(e)}'
+    finally:
+        if savepoint:
+            cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+        cursor.close()
+    return '\n'.join(str(row[-1]) for row in rows)
+
+def init_slow_query_log(app):
+    """Time every statement and log the slow ones; off when SLOW_QUERY_MS is 0"""
+    config = app.config
+    threshold = config.get('SLOW_QUERY_MS', 0) / 1000
+    if threshold <= 0:
+        return
+
+    mode = config.get('SLOW_QUERY_EXPLAIN', 'plan')
+    explain_interval = config.get('SLOW_QUERY_EXPLAIN_INTERVAL', 60)
+    log = SharedLogFile(log_path(config), config.get('SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024), config.get('SLOW_QUERY_LOG_BACKUPS', 5))
+    last_explained = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        elapsed = time.perf_counter() - started
+        if elapsed < threshold:
+            return
+
+        normalized = normalize(statement)
+        key = fingerprint(normalized)
+        record = {
+            'time': datetime.utcnow().isoformat(),
+            'ms': round(elapsed * 1000, 3),
+            'fingerprint': key,
+            'statement': normalized,
+            'rows': cursor.rowcount,
+            'pid': os.getpid(),
+            **_origin()
+        }
+        now = time.monotonic()
+        if mode != 'off' and not executemany and (key not in last_explained or now - last_explained[key] >= explain_interval):
+            last_explained[key] = now
+            record['plan'] = explain(conn, statement, parameters, mode == 'analyze')
+        try:
+            log.write(record)
+        except OSError as e:
+            logger.warning(f"Could not write slow query log: {str(e)}")
+
+    def handle_error(exception_context):
+        # Keep the timing stack balanced when a statement fails
+        started = exception_context.connection.info.get('query_started') if exception_context.connection is not None else None
+        if started:
+            started.pop()
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(Engine, 'handle_error', handle_error)
+    app.extensions['slow_query_log'] = log
+
+def read_records(log):
+    for path in log.files():
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # Line cut by rotation or a crash
+
+def top_slow_queries(log, limit=20, sort='total', since=None):
+    """Slow statements grouped by fingerprint, the costliest first.
+
+    ``sort`` is 'total' (summed time), 'max', 'count' or 'mean'; ``since``
+    limits the records to those logged after a datetime.
+    """
+    groups = {}
+    since = since.isoformat() if since else None
+    for record in read_records(log):
+        if since and record['time'] < since:
+            continue
+        group = groups.get(record['fingerprint'])
+        if group is None:
+            group = groups[record['fingerprint']] = {
+                'fingerprint': record['fingerprint'],
+                'statement': record['statement'],
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'routes': Counter(),
+                'plan': None,
+                'last_seen': None
+            }
+        group['count'] += 1
+        group['total_ms'] += record['ms']
+        group['max_ms'] = max(group['max_ms'], record['ms'])
+        group['routes'][record.get('route') or (f"job {record['job_id']}" if record.get('job_id') else 'other')] += 1
+        group['plan'] = record.get('plan') or group['plan']
+        group['last_seen'] = record['time']
+
+    for group in groups.values():
+        group['total_ms'] = round(group['total_ms'], 3)
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 3)
+        group['routes'] = dict(group['routes'].most_common(5))
+
+    key = {'total': 'total_ms', 'max': 'max_ms', 'count': 'count', 'mean': 'mean_ms'}.get(sort, 'total_ms')
+    return sorted(groups.values(), key=lambda group: group[key], reverse=True)[:limit]
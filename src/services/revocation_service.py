@@ -0,0 +1,163 @@
+"""
+Access token revocation.
+
+Revocations are persisted in ``token_revocations`` and mirrored into an
+in-memory index in every worker, so checking a token on each request is a
+dict lookup. Workers pull rows they have not seen yet (by id) at most once
+every REVOCATION_SYNC_INTERVAL seconds; revocations made by this worker are
+applied locally straight away.
+
+A revoke-all cutoff is compared with the token's ``iat_us`` claim, its issue
+time in microseconds, since ``iat`` only has whole seconds: a token issued
+just before the cutoff would share its second with one issued just after.
+Tokens without the claim fall back to ``iat`` and count as revoked when they
+may have been issued before the cutoff.
+"""
+from services.database_service import db
+from services.job_service import task
+from models.token_revocation import TokenRevocation
+from flask import current_app
+from sqlalchemy import select
+from datetime import datetime, timezone
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rows re-read on each sync, so revocations committed out of id order are not missed
+SYNC_OVERLAP = 100
+
+ISSUED_CLAIM = 'iat_us'
+
+def issued_at_claims():
+    """Extra claims for every new access token: its issue time to the microsecond"""
+    return {ISSUED_CLAIM: time.time_ns() // 1000}
+
+def _issued_at(jwt_payload):
+    """Epoch seconds the token was issued at, as precisely as the token records it"""
+    if ISSUED_CLAIM in jwt_payload:
+        return jwt_payload[ISSUED_CLAIM] / 1_000_000
+    return jwt_payload.get('iat', 0)
+
+def _epoch(dt):
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+class RevocationIndex:
+    """Per-worker view of the revocation table"""
+
+    def __init__(self):
+        self.jtis = {}  # jti -> expiry (epoch seconds)
+        self.cutoffs = {}  # user_id -> (tokens issued before this epoch are revoked, expiry)
+        self.last_id = 0
+        self.last_sync = None
+        self._sync_lock = threading.Lock()
+
+    def add(self, row):
+        expires = _epoch(row.expires_at)
+        if row.jti:
+            self.jtis[row.jti] = expires
+        if row.revoked_before:
+            cutoff = _epoch(row.revoked_before)
+            current = self.cutoffs.get(row.user_id)
+            if current is None or cutoff > current[0]:
+                self.cutoffs[row.user_id] = (cutoff, expires)
+        self.last_id = max(self.last_id, row.id or 0)
+
+    def prune(self, now):
+        """Forget entries whose tokens would have expired anyway"""
+        self.jtis = {jti: exp for jti, exp in self.jtis.items() if exp > now}
+        self.cutoffs = {uid: entry for uid, entry in self.cutoffs.items() if entry[1] > now}
+
+    def sync(self, force=False):
+        """Pull new revocations from the database when the sync interval has passed"""
+        interval = current_app.config.get('REVOCATION_SYNC_INTERVAL', 5)
+        if not force and self.last_sync is not None and time.monotonic() - self.last_sync < interval:
+            return
+
+        # Only one thread syncs; the others keep checking against the current index,
+        # except before the first load when there is no index to check against yet
+        if not self._sync_lock.acquire(blocking=force or self.last_sync is None):
+            return
+        try:
+            if not force and self.last_sync is not None and time.monotonic() - self.last_sync < interval:
+                return
+
+            query = select(TokenRevocation).where(TokenRevocation.id > self.last_id - SYNC_OVERLAP)
+            if self.last_sync is None:
+                query = query.where(TokenRevocation.expires_at > datetime.utcnow())
+            rows = db.session.execute(query.order_by(TokenRevocation.id)).scalars().all()
+
+            for row in rows:
+                self.add(row)
+            if self.last_sync is not None and rows:
+                self.prune(time.time())
+            self.last_sync = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    def is_revoked(self, jwt_payload, sync=True):
+        if sync:
+            self.sync()
+
+        jti = jwt_payload.get('jti')
+        if jti and jti in self.jtis:
+            return True
+
+        user_id = jwt_payload.get('sub')
+        cutoff = self.cutoffs.get(int(user_id)) if user_id is not None else None
+        return cutoff is not None and _issued_at(jwt_payload) < cutoff[0]
+
+_index = RevocationIndex()
+
+def is_token_revoked(jwt_payload, sync=True):
+    """Blocklist check used by the JWT extension on every protected request.
+
+    The async read path passes ``sync=False`` and calls ``sync_revocations``
+    from a background thread instead, so the event loop never waits on the database.
+    """
+    return _index.is_revoked(jwt_payload, sync=sync)
+
+def sync_revocations(force=False):
+    _index.sync(force=force)
+
+def revoke_token(jwt_payload):
+    """Revoke a single access token, e.g. on logout"""
+    row = TokenRevocation(
+        jti=jwt_payload['jti'],
+        user_id=int(jwt_payload['sub']),
+        expires_at=datetime.utcfromtimestamp(jwt_payload['exp'])
+    )
+    db.session.add(row)
+    db.session.commit()
+    _index.add(row)
+    logger.info(f"Revoked token {row.jti} for user {row.user_id}")
+
+def revoke_all_sessions(user_id):
+    """Revoke every access token issued to the user up to now"""
+    now = datetime.utcnow()
+    row = TokenRevocation(
+        user_id=user_id,
+        revoked_before=now,
+        expires_at=now + current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    )
+    db.session.add(row)
+    db.session.commit()
+    _index.add(row)
+    logger.info(f"Revoked all sessions for user {user_id}")
+
+def compact_revocations(batch_size=None):
+    """Delete revocations for tokens that have expired anyway"""
+    from services.admin_service import delete_in_chunks
+
+    deleted = delete_in_chunks(
+        TokenRevocation,
+        TokenRevocation.expires_at < datetime.utcnow(),
+        batch_size=batch_size
+    )
+    _index.prune(time.time())
+    return deleted
+
+@task('revocation.compact')
+def compact_revocations_task():
+    return {'deleted': compact_revocations()}
@@ -0,0 +1,265 @@
+"""
+Batched loading for the model serializers.
+
+The ``*_query`` functions only build statements, so the async read path
+(``asgi.py``) runs exactly the same SQL as the Flask routes.
+"""
+from services.database_service import db
+from models.user import User
+from models.stockvel import Stockvel, StockvelMember, Contribution
+from utils.fieldsets import Fieldset
+from sqlalchemy import select, func
+from decimal import Decimal
+
+# Payout rotation order within a group
+ROSTER_ORDER = (
+    StockvelMember.position.asc().nullsfirst(),  # Position first, nulls at the beginning
+    StockvelMember.joined_at.asc()  # Then by join date for members without position
+)
+
+def ledger_bound(stockvel_ids):
+    """contribution_date from the groups' earliest contribution on, i.e. all of theirs.
+
+    stockvels.ledger_starts_at is kept at or before every contribution by a
+    trigger (models/stockvel.py), so the bound excludes no row, back-dated
+    ones included; on PostgreSQL it lets the scan skip the monthly
+    partitions from before it.
+    """
+    starts = (
+        select(func.min(Stockvel.ledger_starts_at))
+        .where(Stockvel.id.in_(stockvel_ids))
+        .scalar_subquery()
+    )
+    return Contribution.contribution_date >= starts
+
+def member_count_query(stockvel_ids):
+    return (
+        select(StockvelMember.stockvel_id, func.count(StockvelMember.id))
+        .where(StockvelMember.stockvel_id.in_(stockvel_ids))
+        .group_by(StockvelMember.stockvel_id)
+    )
+
+def current_total_query(stockvel_ids):
+    return (
+        select(Contribution.stockvel_id, func.sum(Contribution.amount))
+        .where(Contribution.stockvel_id.in_(stockvel_ids), ledger_bound(stockvel_ids))
+        .group_by(Contribution.stockvel_id)
+    )
+
+def user_totals_query(stockvel_ids, user_id):
+    """A user's confirmed contributions per stockvel"""
+    return (
+        select(Contribution.stockvel_id, func.sum(Contribution.amount))
+        .where(
+            Contribution.stockvel_id.in_(stockvel_ids),
+            Contribution.user_id == user_id,
+            Contribution.status == 'confirmed',
+            ledger_bound(stockvel_ids)
+        )
+        .group_by(Contribution.stockvel_id)
+    )
+
+def joined_group_ids_query(user_ids):
+    return (
+        select(StockvelMember.user_id, StockvelMember.stockvel_id)
+        .where(StockvelMember.user_id.in_(user_ids), StockvelMember.is_active == True)
+    )
+
+def members_query(stockvel_ids):
+    return (
+        select(StockvelMember)
+        .where(StockvelMember.stockvel_id.in_(stockvel_ids))
+        .order_by(StockvelMember.id)
+    )
+
+def users_query(user_ids):
+    return select(User).where(User.id.in_(user_ids))
+
+def member_totals_query(stockvel_ids):
+    return (
+        select(Contribution.stockvel_id, Contribution.user_id, func.sum(Contribution.amount))
+        .where(Contribution.stockvel_id.in_(stockvel_ids), ledger_bound(stockvel_ids))
+        .group_by(Contribution.stockvel_id, Contribution.user_id)
+    )
+
+def user_stockvels_query(user_id):
+    """Active stockvels the user is a member of"""
+    return (
+        select(Stockvel)
+        .join(StockvelMember, StockvelMember.stockvel_id == Stockvel.id)
+        .where(StockvelMember.user_id == user_id, Stockvel.is_active == True)
+    )
+
+def membership_query(stockvel_id, user_id):
+    return select(StockvelMember.id).where(
+        StockvelMember.stockvel_id == stockvel_id,
+        StockvelMember.user_id == user_id
+    ).limit(1)
+
+def roster_query(stockvel_id):
+    """Members with user details, contribution total and last contribution in one query"""
+    totals = (
+        select(
+            Contribution.user_id.label('user_id'),
+            func.sum(Contribution.amount).label('total_contributed'),
+            func.max(Contribution.contribution_date).label('last_contribution_date')
+        )
+        .where(Contribution.stockvel_id == stockvel_id, ledger_bound([stockvel_id]))
+        .group_by(Contribution.user_id)
+        .subquery()
+    )
+    return (
+        select(StockvelMember, User, totals.c.total_contributed, totals.c.last_contribution_date)
+        .join(User, User.id == StockvelMember.user_id)
+        .outerjoin(totals, totals.c.user_id == StockvelMember.user_id)
+        .where(StockvelMember.stockvel_id == stockvel_id)
+        .order_by(*ROSTER_ORDER)
+    )
+
+def contributions_query(stockvel_id):
+    """Contributions newest first, with the contributor's user row"""
+    return (
+        select(Contribution, User)
+        .outerjoin(User, User.id == Contribution.user_id)
+        .where(Contribution.stockvel_id == stockvel_id, ledger_bound([stockvel_id]))
+        .order_by(Contribution.contribution_date.desc())
+    )
+
+def display_name(user):
+    return (user.display_name or user.email.split('@')[0]) if user else "Unknown"
+
+def roster_entry(member, user, total_contributed, last_contribution_date):
+    return {
+        'user_id': user.id,
+        'user_name': display_name(user),
+        'email': user.email,
+        'is_admin': member.is_admin,
+        'joined_date': member.joined_at,
+        'total_contributed': total_contributed or Decimal('0'),
+        'last_contribution_date': last_contribution_date
+    }
+
+def contribution_entry(contribution, user):
+    data = contribution.to_dict()
+    data['user_name'] = display_name(user)
+    return data
+
+def empty_aggregates(stockvel_ids, fieldset):
+    aggregates = {stockvel_id: {} for stockvel_id in stockvel_ids}
+    for values in aggregates.values():
+        if fieldset.wants('member_count'):
+            values['member_count'] = 0
+        if fieldset.wants('current_total'):
+            values['current_total'] = Decimal('0')
+    return aggregates
+
+def load_stockvel_aggregates(stockvel_ids, fieldset):
+    """member_count/current_total for many stockvels with one grouped query each, only if requested"""
+    aggregates = empty_aggregates(stockvel_ids, fieldset)
+    if not stockvel_ids:
+        return aggregates
+
+    if fieldset.wants('member_count'):
+        for stockvel_id, count in db.session.execute(member_count_query(stockvel_ids)):
+            aggregates[stockvel_id]['member_count'] = count
+
+    if fieldset.wants('current_total'):
+        for stockvel_id, total in db.session.execute(current_total_query(stockvel_ids)):
+            aggregates[stockvel_id]['current_total'] = total or Decimal('0')
+
+    return aggregates
+
+def load_joined_group_ids(user_ids):
+    """Active membership stockvel ids for many users in one query"""
+    joined = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+        return joined
+
+    for user_id, stockvel_id in db.session.execute(joined_group_ids_query(user_ids)):
+        joined[user_id].append(stockvel_id)
+    return joined
+
+def serialize_users(users, fieldset=None, joined=None):
+    """User.to_dict for a list of users without a membership query per user"""
+    fieldset = fieldset or Fieldset()
+    if joined is None:
+        joined = load_joined_group_ids([user.id for user in users]) if fieldset.wants('joined_group_ids') else {}
+    return [user.to_dict(joined_group_ids=joined.get(user.id), fields=fieldset.fields) for user in users]
+
+def build_members(stockvel_ids, members, user_dicts, totals):
+    members_by_stockvel = {stockvel_id: [] for stockvel_id in stockvel_ids}
+    for member in members:
+        members_by_stockvel[member.stockvel_id].append({
+            'id': member.id,
+            'user': user_dicts.get(member.user_id),
+            'joined_at': member.joined_at,
+            'is_admin': member.is_admin,
+            'total_contributed': totals.get((member.stockvel_id, member.user_id)) or Decimal('0')
+        })
+    return members_by_stockvel
+
+def load_members(stockvel_ids):
+    """Member entries (with user and contribution total) keyed by stockvel id"""
+    if not stockvel_ids:
+        return {}
+
+    members = db.session.execute(members_query(stockvel_ids)).scalars().all()
+
+    user_ids = list({m.user_id for m in members})
+    users = db.session.execute(users_query(user_ids)).scalars().all() if user_ids else []
+    user_dicts = {user.id: data for user, data in zip(users, serialize_users(users))}
+
+    totals = {
+        (stockvel_id, user_id): total
+        for stockvel_id, user_id, total in db.session.execute(member_totals_query(stockvel_ids))
+    }
+    return build_members(stockvel_ids, members, user_dicts, totals)
+
+def serialize_stockvels(stockvels, fieldset=None, default_include=(), aggregates=None, admins=None, members=None):
+    """Stockvel.to_dict for a list of stockvels, loading only what the fieldset asks for.
+
+    Relations: ``admin`` (public profile of the group admin) and ``members``.
+    ``default_include`` lists the relations embedded when the caller didn't pass ``include=``.
+    The async path passes ``aggregates``/``admins``/``members`` it already loaded.
+    """
+    fieldset = fieldset or Fieldset()
+    stockvel_ids = [stockvel.id for stockvel in stockvels]
+    if aggregates is None:
+        aggregates = load_stockvel_aggregates(stockvel_ids, fieldset)
+
+    results = [stockvel.to_dict(fields=fieldset.fields, aggregates=aggregates[stockvel.id]) for stockvel in stockvels]
+
+    if fieldset.includes('admin', 'admin' in default_include):
+        if admins is None:
+            admin_ids = list({stockvel.admin_user_id for stockvel in stockvels})
+            admins = {user.id: user for user in db.session.execute(users_query(admin_ids)).scalars()} if admin_ids else {}
+        for stockvel, data in zip(stockvels, results):
+            admin = admins.get(stockvel.admin_user_id)
+            data['admin'] = admin.to_public_dict() if admin else None
+
+    if fieldset.includes('members', 'members' in default_include):
+        if members is None:
+            members = load_members(stockvel_ids)
+        for stockvel, data in zip(stockvels, results):
+            data['members'] = members[stockvel.id]
+
+    return results
+
+def add_user_totals(stockvels, stockvels_data, user_totals, fieldset):
+    """Add the requesting user's contributed/expected/progress fields to each stockvel dict"""
+    for stockvel, stockvel_dict in zip(stockvels, stockvels_data):
+        user_total_contributed = user_totals.get(stockvel.id) or Decimal('0')
+
+        # Calculate expected contribution for this user (contribution_amount * max_members for full cycle)
+        # But user only needs to contribute their share: contribution_amount * max_members
+        user_expected_total = stockvel.contribution_amount * stockvel.max_members
+
+        # Add user-specific data
+        if fieldset.wants('user_contributed'):
+            stockvel_dict['user_contributed'] = user_total_contributed
+        if fieldset.wants('user_expected'):
+            stockvel_dict['user_expected'] = user_expected_total
+        if fieldset.wants('user_progress_percentage'):
+            stockvel_dict['user_progress_percentage'] = float(user_total_contributed / user_expected_total * 100) if user_expected_total > 0 else 0
+
+USER_TOTAL_FIELDS = ('user_contributed', 'user_expected', 'user_progress_percentage')
@@ -0,0 +1,182 @@
+from services.database_service import db
+from models.user import User
+from models.stockvel import Stockvel, StockvelMember, Contribution
+from models.stats_snapshot import StatsSnapshot
+from middleware.compression import PrecompressedBody
+from flask import current_app
+from sqlalchemy import select, func, case, or_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from decimal import Decimal
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Row of stats_snapshots holding the admin statistics
+SNAPSHOT = 'admin'
+
+# The stored snapshot's compressed variants in this worker, as (computed_at, PrecompressedBody)
+_body = None
+
+def _count_where(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+def _month_of(column):
+    """Dialect-specific 'YYYY-MM' bucket for a datetime column"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+def compute_stats():
+    """Aggregate the admin statistics, scanning each table once"""
+    users = db.session.execute(
+        select(func.count(User.id), _count_where(User.is_active == True))
+    ).one()
+
+    groups_by_status = {}
+    active_stockvels = 0
+    for status, total, active in db.session.execute(
+        select(Stockvel.status, func.count(Stockvel.id), _count_where(Stockvel.is_active == True))
+        .group_by(Stockvel.status)
+    ):
+        groups_by_status[status or 'Unknown'] = total
+        active_stockvels += active
+
+    members = db.session.execute(
+        select(func.count(StockvelMember.id), _count_where(StockvelMember.is_active == True))
+    ).one()
+
+    # One grouped pass gives both the per-status and per-period totals
+    period = _month_of(Contribution.contribution_date).label('period')
+    by_status = {}
+    by_period = {}
+    for status, month, count, amount in db.session.execute(
+        select(Contribution.status, period, func.count(Contribution.id), func.coalesce(func.sum(Contribution.amount), 0))
+        .group_by(Contribution.status, period)
+    ):
+        status = status or 'unknown'
+        totals = by_status.setdefault(status, {'count': 0, 'total': Decimal('0')})
+        totals['count'] += count
+        totals['total'] += Decimal(str(amount))
+        by_period.setdefault(month or 'unknown', {})[status] = {'count': count, 'total': Decimal(str(amount))}
+
+    recent_periods = sorted(by_period)[-current_app.config.get('STATS_PERIODS', 12):]
+
+    return {
+        'total_users': users[0],
+        'active_users': int(users[1]),
+        'total_stockvels': sum(groups_by_status.values()),
+        'active_stockvels': int(active_stockvels),
+        'stockvels_by_status': groups_by_status,
+        'total_members': members[0],
+        'active_members': int(members[1]),
+        'contributions': {
+            'count': sum(t['count'] for t in by_status.values()),
+            'total': sum((t['total'] for t in by_status.values()), Decimal('0')),
+            'by_status': by_status,
+            'by_period': [{'period': month, 'by_status': by_period[month]} for month in recent_periods]
+        },
+        'generated_at': datetime.utcnow()
+    }
+
+def _store(body, computed_at):
+    """Write the snapshot row, creating it on first use"""
+    snapshots = StatsSnapshot.__table__
+    values = {'body': body, 'computed_at': computed_at, 'refreshing_since': None}
+    if not db.session.execute(snapshots.update().where(snapshots.c.name == SNAPSHOT).values(**values)).rowcount:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(snapshots.insert().values(name=SNAPSHOT, **values))
+        except IntegrityError:
+            pass  # Another process stored one at the same moment
+    db.session.commit()
+
+def refresh_stats():
+    """Recompute the snapshot and store it for every process"""
+    snapshot = compute_stats()
+    _store(current_app.json.dumps(snapshot), snapshot['generated_at'])
+    return snapshot
+
+def _claim_refresh(computed_at):
+    """The claim's time if this process won the right to recompute a snapshot computed at ``computed_at``, else None.
+
+    The conditional UPDATE succeeds in one process only; a claim older than
+    STATS_REFRESH_TIMEOUT (its process died) can be taken over.
+    """
+    now = datetime.utcnow()
+    snapshots = StatsSnapshot.__table__
+    claimed = db.session.execute(
+        snapshots.update()
+        .where(
+            snapshots.c.name == SNAPSHOT,
+            snapshots.c.computed_at == computed_at,
+            or_(
+                snapshots.c.refreshing_since.is_(None),
+                snapshots.c.refreshing_since < now - timedelta(seconds=current_app.config.get('STATS_REFRESH_TIMEOUT', 300))
+            )
+        )
+        .values(refreshing_since=now)
+    ).rowcount
+    db.session.commit()
+    return now if claimed else None
+
+def _release_refresh(claimed_at):
+    """Give up a claim that is still ours, so the next stale read retries right away"""
+    snapshots = StatsSnapshot.__table__
+    db.session.execute(
+        snapshots.update()
+        .where(snapshots.c.name == SNAPSHOT, snapshots.c.refreshing_since == claimed_at)
+        .values(refreshing_since=None)
+    )
+    db.session.commit()
+
+def invalidate_stats():
+    """Drop the snapshot after bulk changes, so the next call recomputes it"""
+    db.session.execute(StatsSnapshot.__table__.delete().where(StatsSnapshot.__table__.c.name == SNAPSHOT))
+    db.session.commit()
+
+def _refresh_in_background(app, claimed_at):
+    with app.app_context():
+        try:
+            refresh_stats()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Stats refresh failed: {str(e)}", exc_info=True)
+        finally:
+            # A stored snapshot already cleared it; after a failure nobody else would
+            try:
+                _release_refresh(claimed_at)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not release the stats refresh claim: {str(e)}")
+
+def get_stats_body():
+    """The shared snapshot as a response body, compressed at most once per encoding in this worker.
+
+    Only the first call after the snapshot is missing computes inline. When
+    it is older than STATS_CACHE_TTL, the one process that claims the
+    refresh recomputes it off the request thread; everyone else, and the
+    claimant meanwhile, serves the stored snapshot.
+    """
+    global _body
+    row = db.session.execute(
+        select(StatsSnapshot.body, StatsSnapshot.computed_at).where(StatsSnapshot.name == SNAPSHOT)
+    ).one_or_none()
+    if row is None:
+        refresh_stats()
+        row = db.session.execute(
+            select(StatsSnapshot.body, StatsSnapshot.computed_at).where(StatsSnapshot.name == SNAPSHOT)
+        ).one()
+    else:
+        age = (datetime.utcnow() - row.computed_at).total_seconds()
+        claimed_at = _claim_refresh(row.computed_at) if age > current_app.config.get('STATS_CACHE_TTL', 30) else None
+        if claimed_at is not None:
+            app = current_app._get_current_object()
+            threading.Thread(target=_refresh_in_background, args=(app, claimed_at), daemon=True).start()
+
+    cached = _body
+    if cached is None or cached[0] != row.computed_at:
+        cached = (row.computed_at, PrecompressedBody(row.body.encode('utf-8') + b'\n'))
+        _body = cached
+    return cached[1]
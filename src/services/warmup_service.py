@@ -0,0 +1,86 @@
+"""
+Worker warm-up before accepting traffic.
+
+Run from gunicorn's ``post_worker_init`` hook (see gunicorn.conf.py) or when
+STARTUP_WARMUP is set, so the first requests a fresh worker serves don't pay
+for configuring mappers, opening database connections, compiling the hot
+statements or loading the revocation index.
+"""
+from services.database_service import db
+from services import serialization_service as queries
+from services.identity_service import current_user_query
+from services.event_service import events_after_query
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def hot_queries():
+    """The statements behind the busiest endpoints, with placeholder ids"""
+    ids = [0]
+    return [
+        current_user_query(0),
+        queries.user_stockvels_query(0),
+        queries.member_count_query(ids),
+        queries.current_total_query(ids),
+        queries.user_totals_query(ids, 0),
+        queries.joined_group_ids_query(ids),
+        queries.members_query(ids),
+        queries.users_query(ids),
+        queries.member_totals_query(ids),
+        queries.membership_query(0, 0),
+        queries.roster_query(0),
+        queries.contributions_query(0),
+        events_after_query(0, ids, 0),
+    ]
+
+def fill_pool(engine, size):
+    """Open ``size`` connections at once so they're all in the pool before the first request"""
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connection.execute(text('SELECT 1'))
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+def compile_hot_queries():
+    """Execute each hot statement once so its compiled form is in the engine's cache"""
+    for statement in hot_queries():
+        db.session.execute(statement).all()
+    db.session.rollback()
+
+def warm_up(app):
+    """Warm this worker; returns the seconds spent per step"""
+    timings = {}
+
+    def step(name, fn):
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            # A cold worker is still a working worker
+            logger.warning(f"Warm-up step {name} failed: {str(e)}")
+        timings[name] = round(time.perf_counter() - started, 4)
+
+    with app.app_context():
+        step('configure_mappers', configure_mappers)
+
+        pool_size = app.config.get('WARMUP_POOL_CONNECTIONS') or getattr(db.engine.pool, 'size', lambda: 1)()
+        step('fill_pool', lambda: fill_pool(db.engine, pool_size))
+        step('compile_queries', compile_hot_queries)
+
+        if app.config.get('JWT_BLACKLIST_ENABLED'):
+            from services.revocation_service import sync_revocations
+            step('revocation_index', lambda: sync_revocations(force=True))
+
+        db.session.remove()
+
+    logger.info(f"Worker {threading.get_native_id()} warmed up: {timings}")
+    return timings
@@ -0,0 +1,158 @@
+"""
+Write-behind buffer for low-value per-user timestamps (``users.last_login``).
+
+Requests record a timestamp in memory instead of updating the row and
+committing. Repeated values for the same user coalesce to the latest. A
+thread in each process writes the buffer every WRITE_BEHIND_INTERVAL
+seconds as bulk ``UPDATE ... SET col = CASE id ... END`` statements of
+WRITE_BEHIND_BATCH_SIZE users, earlier once WRITE_BEHIND_MAX_PENDING users
+are waiting. Stored values therefore lag by at most the interval (plus the
+time a flush takes), and are never moved backwards. The buffer is flushed
+when the process exits cleanly (atexit, and gunicorn's worker_exit); a
+crash loses at most one interval of timestamps.
+
+With WRITE_BEHIND_INTERVAL = 0 the update runs in the request's own
+session, as before.
+"""
+from services.database_service import db
+from models.user import User
+from flask import current_app
+from sqlalchemy import case, or_
+from datetime import datetime
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Columns of users that may be written behind
+COLUMNS = {
+    'last_login': User.__table__.c.last_login
+}
+
+# Per-process buffer, created on first use so it picks up app config (and again after a fork)
+_buffer = None
+_buffer_lock = threading.Lock()
+
+class WriteBehindBuffer:
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config.get('WRITE_BEHIND_INTERVAL', 10)
+        self.max_pending = app.config.get('WRITE_BEHIND_MAX_PENDING', 5000)
+        self.batch_size = app.config.get('WRITE_BEHIND_BATCH_SIZE', 500)
+        self.pid = os.getpid()
+        self._pending = {}  # column -> {user_id: latest timestamp}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def record(self, user_id, column, when):
+        with self._lock:
+            values = self._pending.setdefault(column, {})
+            current = values.get(user_id)
+            if current is None:
+                self._count += 1
+            if current is None or when > current:
+                values[user_id] = when
+            full = self._count >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return self._count
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending, self._count = self._pending, {}, 0
+        return pending
+
+    def _restore(self, pending):
+        """Put back values a failed flush didn't write, unless newer ones arrived meanwhile"""
+        for column, values in pending.items():
+            for user_id, when in values.items():
+                self.record(user_id, column, when)
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of users updated"""
+        with self._flush_lock:
+            pending = self._take()
+            if not pending:
+                return 0
+            written = 0
+            try:
+                with self.app.app_context():
+                    try:
+                        for column_name, values in pending.items():
+                            column = COLUMNS[column_name]
+                            items = sorted(values.items())  # Same lock order in every process
+                            for start in range(0, len(items), self.batch_size):
+                                written += self._update(column, dict(items[start:start + self.batch_size]))
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed, retrying next interval: {str(e)}")
+                self._restore(pending)
+                return 0
+            return written
+
+    def _update(self, column, values):
+        users = User.__table__
+        value = case(values, value=users.c.id)
+        db.session.execute(
+            users.update()
+            .where(users.c.id.in_(list(values)), or_(column.is_(None), column < value))
+            .values({column.name: value})
+        )
+        db.session.commit()
+        return len(values)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the thread and write what is left"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        if self.pid == os.getpid():
+            flushed = self.flush()
+            if flushed:
+                logger.info(f"Wrote {flushed} buffered timestamps on shutdown")
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None or _buffer.pid != os.getpid():
+            # Threads don't survive a fork; a forked worker starts its own buffer
+            _buffer = WriteBehindBuffer(current_app._get_current_object())
+            atexit.register(_buffer.close)
+        return _buffer
+
+def record_activity(user_id, column='last_login', when=None):
+    """Set a user's activity timestamp ``column`` to ``when`` (now) without a write on this request"""
+    if column not in COLUMNS:
+        raise ValueError(f'Not a write-behind column: {column}')
+    when = when or datetime.utcnow()
+    if not current_app.config.get('WRITE_BEHIND_INTERVAL', 10):
+        db.session.execute(User.__table__.update().where(User.__table__.c.id == user_id).values({column: when}))
+        db.session.commit()
+        return when
+    get_buffer().record(user_id, column, when)
+    return when
+
+def flush_pending():
+    """Write this process's buffered timestamps now (e.g. before a worker exits)"""
+    buffer = _buffer
+    if buffer is None or buffer.pid != os.getpid():
+        return 0
+    return buffer.flush()
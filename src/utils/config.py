@@ -16,26 +16,212 @@ class Config:
         'pool_pre_ping': True,
         'pool_recycle': 300,
     }
+    # Applied to file-backed SQLite databases on connect (services/database_service.py)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # Milliseconds a writer waits for the lock
+        'cache_size': -16000,  # KiB of page cache per connection
+        'temp_store': 'MEMORY'
+    }
+    # Async read path (asgi.py); derived from DATABASE_URL with the asyncpg/aiosqlite driver when unset
+    ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL')
+    ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', 20))
+    ASYNC_MAX_OVERFLOW = int(os.getenv('ASYNC_MAX_OVERFLOW', 10))
+    
+    # Startup warm-up (services/warmup_service.py); gunicorn.conf.py always warms workers
+    STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', 'False').lower() == 'true'
+    WARMUP_POOL_CONNECTIONS = int(os.getenv('WARMUP_POOL_CONNECTIONS', 0))  # Connections opened up front; 0 = pool size
     
     # JWT config
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt-secret-change-in-production')
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=7)
     JWT_BLACKLIST_ENABLED = True
     JWT_BLACKLIST_TOKEN_CHECKS = ['access']
+    REVOCATION_SYNC_INTERVAL = int(os.getenv('REVOCATION_SYNC_INTERVAL', 5))  # Seconds between revocation syncs
+    IDENTITY_CACHE_TTL = int(os.getenv('IDENTITY_CACHE_TTL', 30))  # Seconds a loaded current user is reused
+    IDENTITY_CACHE_SIZE = 4096
+    IDENTITY_SYNC_INTERVAL = float(os.getenv('IDENTITY_SYNC_INTERVAL', 2))  # Seconds between reads of other processes' invalidations
+    IDENTITY_INVALIDATION_RETENTION = 3600  # Seconds invalidations are kept; must exceed IDENTITY_CACHE_TTL
     
     # CORS config
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*').split(',')
     
+    # Response compression config
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'True').lower() == 'true'
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # Bytes; smaller responses are sent as-is
+    COMPRESS_LEVEL = 6  # gzip
+    COMPRESS_BROTLI_QUALITY = 5
+    COMPRESS_MIMETYPES = ['application/json', 'text/html', 'text/csv', 'application/x-ndjson']
+    
+    # Rate limiting and load shedding (middleware/rate_limit.py)
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    RATE_LIMIT_STORAGE = os.getenv('RATE_LIMIT_STORAGE', 'shared')  # 'shared' (all workers on the host) or 'local'
+    RATE_LIMIT_SHARED_PATH = os.getenv('RATE_LIMIT_SHARED_PATH')  # Bucket file; default /dev/shm/savetogether-ratelimit
+    RATE_LIMIT_SLOTS = 16384  # Buckets the shared file holds (24 bytes each)
+    RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 0))  # Proxies in front of the app setting X-Forwarded-For
+    RATE_LIMITS = {  # Rule -> (endpoints, bucket per 'ip', 'user' or 'route', requests, per seconds)
+        'login_ip': (('auth.login',), 'ip', 10, 60),
+        'register_ip': (('auth.register',), 'ip', 5, 600),
+        'search_user': (('stockvels.search_stockvels', 'users.search_users'), 'user', 30, 60),
+        'search_ip': (('stockvels.search_stockvels', 'users.search_users'), 'ip', 60, 60),
+        'search_route': (('stockvels.search_stockvels', 'users.search_users'), 'route', 1200, 60),
+    }
+    LOAD_SHED_MAX_INFLIGHT = int(os.getenv('LOAD_SHED_MAX_INFLIGHT', 0))  # Requests in progress per worker before 503; 0 = no limit
+    LOAD_SHED_EXPENSIVE_MAX = int(os.getenv('LOAD_SHED_EXPENSIVE_MAX', 4))  # Expensive requests in progress per worker
+    LOAD_SHED_EXPENSIVE_ENDPOINTS = [  # Password hashing and unindexed ILIKE searches
+        'auth.login', 'auth.register', 'auth.change_password',
+        'stockvels.search_stockvels', 'users.search_users',
+    ]
+    LOAD_SHED_MAX_QUEUE_MS = int(os.getenv('LOAD_SHED_MAX_QUEUE_MS', 0))  # Shed requests queued longer behind the proxy (X-Request-Start); 0 = off
+    LOAD_SHED_RETRY_AFTER = 1  # Seconds sent in Retry-After with 503
+    LOAD_SHED_EXEMPT_ENDPOINTS = ['health_check']
+    
+    # Request profiling (middleware/profiling.py); nothing is installed unless enabled
+    PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'False').lower() == 'true'
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))  # Fraction of requests profiled at random
+    PROFILE_SECRET = os.getenv('PROFILE_SECRET')  # Signs X-Profile headers; unset = header ignored
+    PROFILE_MODE = os.getenv('PROFILE_MODE', 'both')  # 'cprofile', 'sampling' or 'both'
+    PROFILE_SAMPLE_INTERVAL_MS = 5
+    PROFILE_FOLDER = os.getenv('PROFILE_FOLDER', 'profiles')  # Relative to the project root
+    PROFILE_KEEP = 200  # Most recent profiles kept
+    
+    # Slow-query log (services/query_log_service.py)
+    SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 500))  # Statements slower than this are logged; 0 = off
+    SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'plan')  # 'plan', 'analyze' (read-only SELECTs run again) or 'off'
+    SLOW_QUERY_EXPLAIN_INTERVAL = 60  # Seconds before the same statement is explained again
+    SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'logs/slow_queries.log')  # Relative to the project root
+    SLOW_QUERY_LOG_BYTES = 10 * 1024 * 1024  # Size at which the log is rotated
+    SLOW_QUERY_LOG_BACKUPS = 5
+    
+    # Worker memory instrumentation (services/memory_service.py)
+    MEMORY_INSTRUMENTATION = os.getenv('MEMORY_INSTRUMENTATION', 'True').lower() == 'true'
+    MEMORY_TRACE = os.getenv('MEMORY_TRACE', 'False').lower() == 'true'  # Trace allocations from boot rather than the first snapshot
+    MEMORY_TRACE_FRAMES = int(os.getenv('MEMORY_TRACE_FRAMES', 1))  # Stack frames stored per allocation
+    MEMORY_TOP_STATS = 25  # Source lines listed per report
+    MEMORY_TRIGGER_CHECK = 5  # Seconds between checks for a snapshot trigger
+    MEMORY_FOLDER = os.getenv('MEMORY_FOLDER', 'logs/memory')  # Relative to the project root
+    WORKER_MAX_RSS_MB = int(os.getenv('WORKER_MAX_RSS_MB', 0))  # gunicorn workers above this are recycled; 0 = never
+    
+    # Traffic capture for replay (middleware/traffic_capture.py, benchmarks/replay_traffic.py)
+    TRAFFIC_CAPTURE = os.getenv('TRAFFIC_CAPTURE', 'False').lower() == 'true'
+    TRAFFIC_CAPTURE_RATE = float(os.getenv('TRAFFIC_CAPTURE_RATE', 1.0))  # Fraction of requests recorded
+    TRAFFIC_CAPTURE_FOLDER = os.getenv('TRAFFIC_CAPTURE_FOLDER', 'captures')  # Relative to the project root
+    TRAFFIC_CAPTURE_SECRET = os.getenv('TRAFFIC_CAPTURE_SECRET')  # Keys the pseudonyms; defaults to JWT_SECRET_KEY
+    TRAFFIC_CAPTURE_FLUSH_EVERY = 100  # Records buffered before the file is flushed
+
+    # Schema migrations (services/migration_service.py, migrate.py)
+    MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv('MIGRATION_LOCK_TIMEOUT_MS', 5000))  # PostgreSQL lock_timeout for migration statements
+    MIGRATION_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', 1000))  # Initial key range per backfill transaction
+    MIGRATION_BATCH_TARGET_MS = int(os.getenv('MIGRATION_BATCH_TARGET_MS', 500))  # Backfill batches are resized toward this duration
+    MIGRATION_BATCH_PAUSE = float(os.getenv('MIGRATION_BATCH_PAUSE', 0.05))  # Seconds between backfill batches
+
     # App config
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file upload
-    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')  # Relative to the project root
+    
+    # Profile images (services/avatar_service.py)
+    AVATAR_MAX_BYTES = int(os.getenv('AVATAR_MAX_BYTES', 5 * 1024 * 1024))
+    AVATAR_CHUNK_SIZE = 64 * 1024  # Bytes read from the request at a time
+    AVATAR_THUMBNAIL_SIZES = [64, 256]  # Square thumbnails made by the avatars.thumbnails job
+    AVATAR_CACHE_MAX_AGE = 365 * 24 * 3600  # Names are content hashes, so files never change
+    AVATAR_ACCEL_REDIRECT = os.getenv('AVATAR_ACCEL_REDIRECT')  # nginx internal location for UPLOAD_FOLDER/avatars, e.g. /_avatars/
     
-    # Email config (for future features)
+    # Email config (services/mail_service.py); messages are only logged while MAIL_SERVER is unset
     MAIL_SERVER = os.getenv('MAIL_SERVER')
     MAIL_PORT = int(os.getenv('MAIL_PORT', 587))
     MAIL_USE_TLS = os.getenv('MAIL_USE_TLS', 'True').lower() == 'true'
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER', 'SaveTogether <no-reply@savetogether.app>')
+    MAIL_TIMEOUT = 30  # Seconds for SMTP connects and replies
+    MAIL_CONCURRENCY = int(os.getenv('MAIL_CONCURRENCY', 4))  # SMTP connections per worker process
+    MAIL_MAX_PER_CONNECTION = int(os.getenv('MAIL_MAX_PER_CONNECTION', 100))  # Messages before a connection is replaced
+    MAIL_IDLE_TIMEOUT = 60  # Seconds an idle connection is kept open
+    MAIL_BATCH_SIZE = 200  # Messages claimed per delivery batch
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BACKOFF = 60  # Seconds before the first retry, doubled per attempt
+    MAIL_DELIVER_DELAY = 5  # Seconds a delivery job waits so receipts queued together go out together
+    MAIL_DELIVER_MAX_SECONDS = 300  # A delivery job hands over to a new one after this long
+    MAIL_SEND_TIMEOUT = 600  # Messages left 'sending' this long are requeued
+    MAIL_REMINDER_DAYS_AHEAD = 2  # Payout reminders go out this many days before a contribution is due
+    
+    # Write-behind of activity timestamps like users.last_login (services/write_behind_service.py)
+    WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', 10))  # Max seconds a timestamp waits in memory; 0 writes it on the request
+    WRITE_BEHIND_MAX_PENDING = 5000  # Buffered users that trigger an early flush
+    WRITE_BEHIND_BATCH_SIZE = 500  # Users per UPDATE statement
+    
+    # Background job config
+    JOB_WORKER_CONCURRENCY = int(os.getenv('JOB_WORKER_CONCURRENCY', 4))
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))  # Seconds between polls when idle
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETRY_BACKOFF = 5  # Seconds before first retry, doubled per attempt
+    JOB_RETRY_BACKOFF_MAX = 600
+    JOB_STALE_TIMEOUT = 900  # Running jobs without a heartbeat for this long are requeued (or failed when out of attempts)
+    JOB_METRICS_INTERVAL = 60
+    JOB_TASK_MODULES = [  # Modules imported by the worker so their tasks register
+        'services.admin_service',
+        'services.revocation_service',
+        'services.identity_service',
+        'services.event_service',
+        'services.idempotency_service',
+        'services.partition_service',
+        'services.archive_service',
+        'services.export_service',
+        'services.avatar_service',
+        'services.mail_service',
+    ]
+    JOB_PERIODIC_TASKS = {  # Task name -> seconds between runs
+        'revocation.compact': 3600,
+        'identity.compact': 3600,
+        'events.compact': 86400,
+        'idempotency.compact': 3600,
+        'partitions.maintain': 86400,
+        'archive.closed_stockvels': 86400,
+        'exports.compact': 3600,
+        'avatars.compact': 86400,
+        'mail.deliver': 60,  # Picks up retries; new messages schedule their own delivery
+        'mail.payout_reminders': 86400,
+    }
+    
+    # Activity event stream (SSE) config
+    EVENTS_BROKER = os.getenv('EVENTS_BROKER')  # 'postgres' (LISTEN/NOTIFY) or 'local'; default by database
+    EVENTS_CHANNEL = 'activity_events'
+    EVENTS_HEARTBEAT = int(os.getenv('EVENTS_HEARTBEAT', 15))  # Seconds between keepalive comments
+    EVENTS_RETRY_MS = 3000  # Client reconnect delay sent in the stream
+    EVENTS_QUEUE_SIZE = 100  # Undelivered events per stream before it is closed
+    EVENTS_REPLAY_LIMIT = 500  # Events replayed after Last-Event-ID
+    EVENTS_WSGI_MAX_DURATION = int(os.getenv('EVENTS_WSGI_MAX_DURATION', 300))  # Seconds a threaded stream stays open
+    EVENTS_RETENTION_DAYS = 30
+    
+    # Idempotency-Key config (contributions, group creation, joins)
+    IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 86400))  # Seconds a key and its response are kept
+    IDEMPOTENCY_LOCK_TIMEOUT = 60  # Seconds before an unfinished request's claim can be taken over
+    IDEMPOTENCY_WAIT = 10  # Seconds a concurrent retry waits for the first request's response
+    IDEMPOTENCY_POLL_INTERVAL = 0.1
+    
+    # Contributions partitioning (PostgreSQL; services/partition_service.py)
+    CONTRIBUTION_PARTITIONS_AHEAD = 3  # Monthly partitions created ahead of the current month
+    CONTRIBUTION_PARTITIONS_DETACH_AFTER = int(os.getenv('CONTRIBUTION_PARTITIONS_DETACH_AFTER', 0))  # Months before partitions emptied by archiving are detached; 0 = never
+    
+    # Archival of closed stockvels (services/archive_service.py)
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))  # Days past end_date or deactivation before a group is archived
+    ARCHIVE_BATCH_SIZE = 50  # Groups selected per batch
+    
+    # Contribution statement exports (services/export_service.py)
+    EXPORT_FOLDER = os.getenv('EXPORT_FOLDER', 'exports')  # Background export files; relative to the project root
+    EXPORT_BATCH_SIZE = 1000  # Rows fetched from the cursor and encoded per chunk
+    EXPORT_STREAM_MAX_ROWS = int(os.getenv('EXPORT_STREAM_MAX_ROWS', 50000))  # Larger exports are written by a job
+    EXPORT_RETENTION_HOURS = int(os.getenv('EXPORT_RETENTION_HOURS', 24))
+    
+    # Admin purge config
+    ADMIN_PURGE_BATCH_SIZE = int(os.getenv('ADMIN_PURGE_BATCH_SIZE', 1000))
+    ADMIN_PURGE_PAUSE = float(os.getenv('ADMIN_PURGE_PAUSE', 0.05))  # Seconds between batches
+    
+    # Admin statistics config
+    STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', 30))  # Seconds before the shared snapshot is refreshed
+    STATS_REFRESH_TIMEOUT = 300  # Seconds after which another process may take over a refresh that never finished
+    STATS_PERIODS = 12  # Most recent months reported in contribution totals
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -54,8 +240,15 @@ class ProductionConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # Concurrency tests need a real database (PostgreSQL, or a SQLite file) shared between threads
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'sqlite:///:memory:')
+    SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS, synchronous='OFF')  # Test databases are thrown away
     WTF_CSRF_ENABLED = False
+    RATE_LIMIT_STORAGE = 'local'  # Each test app starts with empty buckets
+    SLOW_QUERY_MS = 0
+    MEMORY_INSTRUMENTATION = False
+    IDENTITY_SYNC_INTERVAL = 0  # Every lookup sees invalidations, so tests are deterministic
+    WRITE_BEHIND_INTERVAL = 0  # Tests read last_login straight back; the buffer is tested directly
 
 config_by_name = {
     'development': DevelopmentConfig,
@@ -0,0 +1,28 @@
+def _split(value):
+    if value is None:
+        return None
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    return names or None
+
+class Fieldset:
+    """Which attributes (``fields=``) and relations (``include=``) a caller asked for.
+
+    ``fields`` of None means "all fields"; ``include`` of None means "the
+    endpoint's default relations".
+    """
+
+    def __init__(self, fields=None, include=None):
+        self.fields = fields
+        self.include = include
+
+    def wants(self, name):
+        return self.fields is None or name in self.fields
+
+    def includes(self, name, default=False):
+        if self.include is None:
+            return default
+        return name in self.include
+
+def parse_fieldset(args):
+    """Read ``?fields=a,b&include=c`` from the request arguments"""
+    return Fieldset(fields=_split(args.get('fields')), include=_split(args.get('include')))
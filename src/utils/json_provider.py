@@ -0,0 +1,60 @@
+from flask.json.provider import DefaultJSONProvider
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library serializer
+    orjson = None
+
+def _default(obj):
+    """Serialize values the standard library json module can't handle"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return format(obj, 'f')  # Exact, as a string; json can't write it as a raw number
+    return DefaultJSONProvider.default(obj)
+
+def _orjson_default(obj):
+    """orjson handles datetime natively; Decimal is emitted as an exact JSON number (a string before orjson 3.9)"""
+    if isinstance(obj, Decimal):
+        if hasattr(orjson, 'Fragment'):
+            return orjson.Fragment(format(obj, 'f'))
+        return format(obj, 'f')
+    return DefaultJSONProvider.default(obj)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider built on orjson.
+
+    Models return raw ``Decimal`` and ``datetime`` values from ``to_dict`` and
+    leave the conversion to this provider, so money is serialized exactly
+    (``10.50`` rather than a float round trip) and datetimes as ISO 8601.
+    Without orjson the standard library writes Decimal as an exact string
+    (``"10.50"``) instead, never as a float.
+    """
+
+    sort_keys = False
+    options = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            kwargs.setdefault('default', _default)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_orjson_default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None:
+            return self._app.response_class(f'{self.dumps(obj)}\n', mimetype=self.mimetype)
+
+        option = self.options
+        if self.compact is False or (self.compact is None and self._app.debug):
+            option |= orjson.OPT_INDENT_2
+        body = orjson.dumps(obj, default=_orjson_default, option=option)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
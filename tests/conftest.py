@@ -0,0 +1,158 @@
+"""
+Shared fixtures for the test suite.
+
+The schema is created once per session in a database of this pytest worker:
+``TEST_DATABASE_URL`` with ``_<worker>`` appended to the database name under
+pytest-xdist (created on PostgreSQL if missing), or a temporary SQLite file
+when it is unset, so ``pytest -n auto`` workers never share tables.
+
+Tests that take ``db_session`` (or ``client``) run inside one transaction
+that is rolled back afterwards. The app's ``db.session`` joins it through a
+SAVEPOINT, so code under test can commit and roll back as usual while
+nothing outlives the test. Tests that need other connections to see their
+rows, like the concurrency tests, take ``committed_db`` instead; it empties
+the tables when the test ends.
+
+Data comes from the factories in ``factories.py``.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+os.environ['FLASK_ENV'] = 'testing'
+
+def worker_database_url(url, worker):
+    """``url`` with the worker id appended to the database name"""
+    from sqlalchemy.engine import make_url
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return url.render_as_string(hide_password=False)
+        root, ext = os.path.splitext(url.database)
+        return url.set(database=f'{root}_{worker}{ext}').render_as_string(hide_password=False)
+    return url.set(database=f'{url.database}_{worker}').render_as_string(hide_password=False)
+
+def create_worker_database(url):
+    """Create a PostgreSQL worker database next to the configured one"""
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.engine import make_url
+    url = make_url(url)
+    if url.get_backend_name() != 'postgresql':
+        return
+    engine = create_engine(url.set(database='postgres'), isolation_level='AUTOCOMMIT')
+    with engine.connect() as conn:
+        exists = conn.execute(text('SELECT 1 FROM pg_database WHERE datname = :name'), {'name': url.database}).scalar()
+        if not exists:
+            conn.exec_driver_sql(f'CREATE DATABASE "{url.database}"')
+    engine.dispose()
+
+_worker = os.getenv('PYTEST_XDIST_WORKER')
+if os.getenv('TEST_DATABASE_URL'):
+    if _worker:
+        os.environ['TEST_DATABASE_URL'] = worker_database_url(os.environ['TEST_DATABASE_URL'], _worker)
+        create_worker_database(os.environ['TEST_DATABASE_URL'])
+else:
+    # A file rather than :memory:, so threads in the concurrency tests share one database
+    os.environ['TEST_DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'savetogether_%s.db' % (_worker or 'main'))}"
+
+from main import get_app
+from services.database_service import db
+from services.identity_service import reset_cache
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+@pytest.fixture(scope='session')
+def app():
+    """The app, with a fresh schema created once for the session"""
+    app = get_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+@pytest.fixture
+def db_session(app):
+    """``db.session`` inside a transaction that is rolled back when the test ends"""
+    with app.app_context():
+        connection = db.engine.connect()
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            # pysqlite starts and commits transactions on its own, which would end the outer
+            # transaction at the first SAVEPOINT release; take over and issue BEGIN ourselves
+            connection.connection.driver_connection.isolation_level = None
+        transaction = connection.begin()
+        if sqlite:
+            connection.exec_driver_sql('BEGIN')
+
+        original = db.session
+        db.session = scoped_session(sessionmaker(
+            bind=connection,
+            join_transaction_mode='create_savepoint',
+            query_cls=db.Query
+        ))
+        try:
+            yield db.session
+        finally:
+            db.session.remove()
+            db.session = original
+            transaction.rollback()
+            if sqlite:
+                connection.connection.driver_connection.isolation_level = ''
+            connection.close()
+            # Ids are reused after the rollback, so cached identities would belong to other users
+            reset_cache()
+
+@pytest.fixture
+def client(app, db_session):
+    return app.test_client()
+
+@pytest.fixture
+def committed_db(app):
+    """For tests whose rows must be visible to other connections; empties every table afterwards"""
+    with app.app_context():
+        yield db
+        db.session.remove()
+        with db.engine.begin() as conn:
+            for table in reversed(db.metadata.sorted_tables):
+                conn.execute(table.delete())
+        reset_cache()
+
+class QueryCounter:
+    """Statements executed inside ``with counter:``, without the harness's SAVEPOINTs"""
+
+    def __init__(self):
+        self.statements = []
+        self.active = False
+
+    def __enter__(self):
+        self.statements.clear()
+        self.active = True
+        return self
+
+    def __exit__(self, *exc):
+        self.active = False
+
+    def __len__(self):
+        return len(self.statements)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active and not statement.lstrip().upper().startswith(('SAVEPOINT', 'RELEASE', 'ROLLBACK TO')):
+            self.statements.append(statement)
+
+@pytest.fixture
+def query_count(app):
+    """A QueryCounter on the app's engine, for query-count regression tests"""
+    counter = QueryCounter()
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', counter.record)
+    yield counter
+    event.remove(engine, 'before_cursor_execute', counter.record)
@@ -0,0 +1,77 @@
+"""
+Factories for test data.
+
+Each ``create_*`` adds a row with plausible defaults, overridden by keyword
+arguments, and commits it (inside ``db_session`` the commit only releases a
+SAVEPOINT). Values come from a seeded generator so failures reproduce.
+Every user's password is ``PASSWORD``; it is hashed once per session, since
+hashing dominates the cost of creating users.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import count
+import random
+
+from services.database_service import db
+from models.user import User
+from models.stockvel import Stockvel, StockvelMember, Contribution
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'password123'
+
+_rng = random.Random(1234)
+_sequence = count(1)
+_password_hash = None
+
+def _next():
+    return next(_sequence)
+
+def password_hash():
+    global _password_hash
+    if _password_hash is None:
+        _password_hash = generate_password_hash(PASSWORD)
+    return _password_hash
+
+def _save(obj):
+    db.session.add(obj)
+    db.session.commit()
+    return obj
+
+def create_user(**fields):
+    n = _next()
+    fields.setdefault('email', f'user{n}@example.com')
+    fields.setdefault('display_name', f'User {n}')
+    fields.setdefault('password_hash', password_hash())
+    return _save(User(**fields))
+
+def create_stockvel(admin=None, members=0, **fields):
+    """A stockvel with ``admin`` (created if missing) as its first member, plus ``members`` more users"""
+    admin = admin or create_user()
+    n = _next()
+    fields.setdefault('name', f'Group {n}')
+    fields.setdefault('contribution_amount', Decimal(_rng.choice([100, 250, 500, 1000])))
+    fields.setdefault('frequency', _rng.choice(['Weekly', 'Bi-Weekly', 'Monthly']))
+    fields.setdefault('max_members', max(10, members + 1))
+    fields.setdefault('start_date', datetime(2024, 1, 1) + timedelta(days=_rng.randrange(365)))
+    stockvel = _save(Stockvel(admin_user_id=admin.id, **fields))
+    create_member(stockvel, admin, is_admin=True)
+    for _ in range(members):
+        create_member(stockvel)
+    return stockvel
+
+def create_member(stockvel, user=None, **fields):
+    user = user or create_user()
+    if 'position' not in fields:
+        fields['position'] = StockvelMember.query.filter_by(stockvel_id=stockvel.id).count()
+    return _save(StockvelMember(stockvel_id=stockvel.id, user_id=user.id, **fields))
+
+def create_contribution(stockvel, user=None, **fields):
+    """A contribution by ``user`` (by default the group's admin) to ``stockvel``"""
+    fields.setdefault('amount', stockvel.contribution_amount)
+    fields.setdefault('contribution_date', stockvel.start_date + timedelta(days=_rng.randrange(90)))
+    fields.setdefault('payment_method', 'bank_transfer')
+    return _save(Contribution(
+        stockvel_id=stockvel.id,
+        user_id=user.id if user else stockvel.admin_user_id,
+        **fields
+    ))
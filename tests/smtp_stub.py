@@ -0,0 +1,77 @@
+"""
+A minimal SMTP server for tests, standing in for the mail relay.
+
+Speaks just enough SMTP for smtplib (no TLS or AUTH) and records every
+message and connection. ``replies`` maps a recipient address to the reply
+sent to its RCPT TO, e.g. ``'550 No such user'`` or ``'451 Try again later'``.
+"""
+import email
+import socketserver
+import threading
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode('ascii'))
+
+    def handle(self):
+        server = self.server.stub
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost SMTP stub')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif verb in ('HELO', 'NOOP'):
+                self.reply('250 OK')
+            elif verb in ('MAIL', 'RSET'):
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                reply = server.replies.get(address, '250 OK')
+                if reply.startswith('2'):
+                    recipients.append(address)
+                self.reply(reply)
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b'.\r\n', b''):
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                with server.lock:
+                    server.messages.append((recipients, email.message_from_bytes(b''.join(lines))))
+                self.reply('250 OK queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+class SMTPStub:
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.replies = {}
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,89 @@
+"""
+Admin purges: the panel's fallback when no job worker is running, stats after a purge and their refresh, and purging group admins.
+"""
+import pytest
+
+from factories import create_stockvel, create_member, create_contribution
+from models.job import Job
+from models.stats_snapshot import StatsSnapshot
+from models.stockvel import StockvelMember, Contribution
+from models.user import User
+from services import admin_service, stats_service
+
+def test_unclaimed_purge_job_can_be_cancelled_and_run_directly(client, db_session):
+    create_stockvel(members=2)
+
+    queued = client.post('/api/admin/stockvels/delete-all?background=true')
+    assert queued.status_code == 202
+    job_id = queued.get_json()['job_id']
+
+    response = client.post(f'/api/admin/jobs/{job_id}/cancel')
+    assert response.status_code == 200
+    assert response.get_json()['job']['status'] == 'cancelled'
+    # A worker starting later won't run it
+    assert client.post(f'/api/admin/jobs/{job_id}/cancel').status_code == 409
+    assert db_session.get(Job, job_id).status == 'cancelled'
+
+    assert client.post('/api/admin/stockvels/delete-all').status_code == 200
+    assert client.get('/api/admin/stats').get_json()['total_stockvels'] == 0
+
+def test_purge_refreshes_cached_stats(client, db_session):
+    create_stockvel(members=3)
+    assert client.get('/api/admin/stats').get_json()['total_stockvels'] == 1
+
+    client.post('/api/admin/users/delete-all')
+
+    stats = client.get('/api/admin/stats').get_json()
+    assert stats['total_users'] == 0
+    assert stats['total_members'] == 0
+
+def test_stale_stats_are_refreshed_by_one_process(app, client, db_session, monkeypatch):
+    client.get('/api/admin/stats')
+    snapshot = db_session.get(StatsSnapshot, stats_service.SNAPSHOT)
+    monkeypatch.setitem(app.config, 'STATS_CACHE_TTL', -1)
+
+    assert stats_service._claim_refresh(snapshot.computed_at)
+    # Everyone else keeps serving the stored snapshot meanwhile
+    assert not stats_service._claim_refresh(snapshot.computed_at)
+    assert client.get('/api/admin/stats').status_code == 200
+
+def test_failed_refresh_releases_its_claim(app, client, db_session, monkeypatch):
+    client.get('/api/admin/stats')
+    computed_at = db_session.get(StatsSnapshot, stats_service.SNAPSHOT).computed_at
+    claimed_at = stats_service._claim_refresh(computed_at)
+
+    def broken():
+        raise RuntimeError('database went away')
+    monkeypatch.setattr(stats_service, 'compute_stats', broken)
+    stats_service._refresh_in_background(app, claimed_at)
+
+    # The next stale read can claim it again instead of waiting out STATS_REFRESH_TIMEOUT
+    db_session.expire_all()
+    assert db_session.get(StatsSnapshot, stats_service.SNAPSHOT).refreshing_since is None
+    assert stats_service._claim_refresh(computed_at)
+
+def test_purging_a_group_admin_is_refused_before_anything_is_deleted(client, db_session):
+    stockvel = create_stockvel(members=1)
+    create_contribution(stockvel)
+    admin_id = stockvel.admin_user_id
+
+    for path in (f'/api/admin/users/{admin_id}', f'/api/admin/users/{admin_id}?background=true'):
+        assert client.delete(path).status_code == 409
+    with pytest.raises(ValueError):
+        admin_service.purge_user(admin_id)
+
+    assert db_session.get(User, admin_id) is not None
+    assert StockvelMember.query.filter_by(user_id=admin_id).count() == 1
+    assert Contribution.query.filter_by(user_id=admin_id).count() == 1
+    assert Job.query.filter_by(name='admin.purge_user').count() == 0
+
+def test_purging_a_member_removes_their_rows(client, db_session):
+    stockvel = create_stockvel()
+    member = create_member(stockvel)
+    create_contribution(stockvel, db_session.get(User, member.user_id))
+    user_id = member.user_id
+
+    assert client.delete(f'/api/admin/users/{user_id}').status_code == 200
+
+    assert db_session.get(User, user_id) is None
+    assert Contribution.query.filter_by(user_id=user_id).count() == 0
@@ -0,0 +1,30 @@
+"""
+Archival picks closed groups only after the grace period.
+"""
+from datetime import datetime, timedelta
+
+from factories import create_stockvel
+from services.archive_service import closed_stockvels_query
+
+def archivable(db_session):
+    return set(db_session.execute(closed_stockvels_query(100)).scalars())
+
+def test_deactivated_groups_get_the_grace_period(app, db_session):
+    just_deactivated = create_stockvel()
+    just_deactivated.is_active = False
+    long_deactivated = create_stockvel(is_active=False)
+    long_deactivated.deactivated_at = datetime.utcnow() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'] + 1)
+    reactivated = create_stockvel(is_active=False)
+    reactivated.is_active = True
+    db_session.commit()
+
+    assert just_deactivated.deactivated_at is not None
+    assert reactivated.deactivated_at is None
+    assert archivable(db_session) == {long_deactivated.id}
+
+def test_ended_groups_get_the_grace_period(app, db_session):
+    days = app.config['ARCHIVE_AFTER_DAYS']
+    create_stockvel(end_date=datetime.utcnow() - timedelta(days=days - 1))
+    ended = create_stockvel(end_date=datetime.utcnow() - timedelta(days=days + 1))
+
+    assert archivable(db_session) == {ended.id}
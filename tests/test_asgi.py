@@ -0,0 +1,66 @@
+"""
+The ASGI read path runs the Flask request hooks: limits, load shedding, logging and compression.
+"""
+import asyncio
+import logging
+import time
+
+import httpx
+import pytest
+from flask_jwt_extended import create_access_token
+
+from factories import create_stockvel
+from asgi import AsyncReadApp
+from main import create_app
+from utils.config import TestingConfig
+
+@pytest.fixture
+def async_app(committed_db, monkeypatch):
+    # Rows must be committed for the async engine's own connections to see them
+    monkeypatch.setattr(TestingConfig, 'RATE_LIMITS', {'list_user': (('stockvels.get_stockvels',), 'user', 2, 60)}, raising=False)
+    monkeypatch.setattr(TestingConfig, 'LOAD_SHED_MAX_QUEUE_MS', 1000, raising=False)
+    flask_app = create_app()
+    app = AsyncReadApp(flask_app)
+    yield app
+    if app.engine is not None:
+        asyncio.run(app.engine.dispose())
+
+def get(app, path, **headers):
+    async def request():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.get(path, headers=headers)
+    return asyncio.run(request())
+
+def token(app, stockvel):
+    with app.flask_app.app_context():
+        return f'Bearer {create_access_token(identity=str(stockvel.admin_user_id))}'
+
+def test_async_routes_are_rate_limited(async_app):
+    stockvel = create_stockvel(members=2)
+    auth = token(async_app, stockvel)
+
+    assert get(async_app, '/api/stockvels/', Authorization=auth).status_code == 200
+    assert get(async_app, '/api/stockvels/', Authorization=auth).status_code == 200
+    response = get(async_app, '/api/stockvels/', Authorization=auth)
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After']
+
+def test_async_routes_shed_requests_that_queued_too_long(async_app):
+    stockvel = create_stockvel()
+
+    response = get(async_app, f'/api/stockvels/{stockvel.id}', Authorization=token(async_app, stockvel), **{'X-Request-Start': f't={time.time() - 5:.3f}'})
+
+    assert response.status_code == 503
+
+def test_async_routes_are_logged_and_compressed(async_app, caplog):
+    stockvel = create_stockvel(members=40)
+    caplog.set_level(logging.INFO)
+
+    response = get(async_app, f'/api/stockvels/{stockvel.id}/members', Authorization=token(async_app, stockvel), **{'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(response.json()['members']) == 41
+    assert f'Request: GET /api/stockvels/{stockvel.id}/members' in caplog.text
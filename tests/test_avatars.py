@@ -0,0 +1,103 @@
+"""
+Profile image uploads: content-addressed storage, thumbnails and caching headers.
+"""
+import hashlib
+import io
+
+import pytest
+from flask_jwt_extended import create_access_token
+from PIL import Image
+
+from factories import create_user
+from models.user import User
+from models.job import Job
+from services import avatar_service
+
+@pytest.fixture
+def upload_folder(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path / 'avatars'
+
+def png(color='red', size=(300, 200)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def upload(client, user, body, content_type='image/png'):
+    return client.post(
+        '/api/users/profile/image',
+        data=body,
+        content_type=content_type,
+        headers={'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+    )
+
+def test_upload_is_stored_by_content_hash(client, db_session, upload_folder):
+    user = create_user()
+    image = png()
+
+    response = upload(client, user, image)
+
+    assert response.status_code == 200
+    name = f'{hashlib.sha256(image).hexdigest()}.png'
+    assert response.get_json()['user']['profile_image'] == f'/api/users/avatars/{name}'
+    assert (upload_folder / name).read_bytes() == image
+    assert db_session.get(User, user.id).profile_image.endswith(name)
+    assert Job.query.filter_by(name='avatars.thumbnails').count() == 1
+
+def test_identical_uploads_share_one_file(client, db_session, upload_folder):
+    image = png('blue')
+    upload(client, create_user(), image)
+    avatar_service.make_thumbnails(f'{hashlib.sha256(image).hexdigest()}.png')
+
+    response = upload(client, create_user(), image)
+
+    assert response.status_code == 200
+    assert len([path for path in upload_folder.iterdir() if '_' not in path.name]) == 1
+    # Thumbnails already exist, so no second job
+    assert Job.query.filter_by(name='avatars.thumbnails').count() == 1
+
+def test_rejects_non_images_and_oversized_uploads(client, db_session, upload_folder, monkeypatch):
+    user = create_user()
+    assert upload(client, user, b'<html></html>', 'text/html').status_code == 400
+
+    monkeypatch.setitem(client.application.config, 'AVATAR_MAX_BYTES', 1000)
+    assert upload(client, user, png(size=(800, 800))).status_code == 413
+    assert not [path for path in upload_folder.iterdir()]
+
+def test_thumbnails_are_served_with_long_lived_cache_headers(client, db_session, upload_folder):
+    image = png()
+    upload(client, create_user(), image)
+    name = f'{hashlib.sha256(image).hexdigest()}.png'
+    thumbnail = avatar_service.thumbnail_name(name, 64)
+
+    # Until the job runs the original stands in, briefly cached
+    response = client.get(f'/api/users/avatars/{thumbnail}')
+    assert response.status_code == 200
+    assert response.cache_control.max_age == 60
+
+    avatar_service.make_thumbnails(name)
+    response = client.get(f'/api/users/avatars/{thumbnail}')
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.data)).size == (64, 64)
+    assert response.cache_control.max_age == 365 * 24 * 3600
+    assert response.cache_control.immutable
+
+def test_accel_redirect_leaves_the_file_to_nginx(client, db_session, upload_folder, monkeypatch):
+    image = png()
+    upload(client, create_user(), image)
+    name = f'{hashlib.sha256(image).hexdigest()}.png'
+    monkeypatch.setitem(client.application.config, 'AVATAR_ACCEL_REDIRECT', '/_avatars/')
+
+    response = client.get(f'/api/users/avatars/{name}')
+
+    assert response.headers['X-Accel-Redirect'] == f'/_avatars/{name}'
+    assert response.data == b''
+
+def test_profile_only_accepts_uploaded_images(client, db_session, upload_folder):
+    user = create_user()
+    headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+    url = upload(client, user, png()).get_json()['user']['profile_image']
+
+    assert client.put('/api/auth/profile', headers=headers, json={'profile_image': 'https://example.com/me.png'}).status_code == 400
+    assert client.put('/api/auth/profile', headers=headers, json={'profile_image': url}).status_code == 200
+    assert client.put('/api/auth/profile', headers=headers, json={'profile_image': None}).get_json()['user']['profile_image'] is None
@@ -0,0 +1,72 @@
+"""
+Activity events reach this worker's streams on commit, and a member's stream closes when they leave.
+"""
+from datetime import datetime
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from factories import create_stockvel, create_member, create_user, create_contribution
+from models.user import User
+from services.event_service import CLOSED, QueueSubscription, get_broker
+
+def auth(user):
+    return {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+
+@pytest.fixture
+def subscribe(app):
+    broker = get_broker()
+    subscriptions = []
+
+    def subscribe(**fields):
+        subscription = QueueSubscription(**fields)
+        broker.subscribe(subscription)
+        subscriptions.append(subscription)
+        return subscription
+
+    yield subscribe
+    for subscription in subscriptions:
+        broker.unsubscribe(subscription)
+
+def drain(subscription):
+    events = []
+    while (event := subscription.get(timeout=0)) is not None:
+        events.append(event)
+    return events
+
+def test_committed_contribution_is_dispatched(client, db_session, subscribe):
+    stockvel = create_stockvel(members=1)
+    admin = db_session.get(User, stockvel.admin_user_id)
+    subscription = subscribe(stockvel_ids=[stockvel.id], viewer_id=admin.id)
+
+    response = client.post(
+        f'/api/stockvels/{stockvel.id}/contribute',
+        headers=auth(admin),
+        json={'amount': str(stockvel.contribution_amount)}
+    )
+
+    assert response.status_code == 201
+    assert [event['type'] for event in drain(subscription)] == ['contribution.created']
+
+def test_leaving_closes_the_members_stream(client, db_session, subscribe):
+    stockvel = create_stockvel()
+    leaving = create_user()
+    create_member(stockvel, leaving)
+    # Paid up, so they may leave
+    create_contribution(stockvel, leaving, amount=stockvel.contribution_amount * stockvel.max_members, contribution_date=datetime.utcnow())
+    stays = subscribe(stockvel_ids=[stockvel.id], viewer_id=stockvel.admin_user_id)
+    left = subscribe(stockvel_ids=[stockvel.id], viewer_id=leaving.id)
+
+    assert client.delete(f'/api/stockvels/{stockvel.id}/leave', headers=auth(leaving)).status_code == 200
+
+    events = drain(left)
+    assert events[-1] is CLOSED
+    assert [event['type'] for event in events[:-1]] == ['member.left']
+    assert left.closed and not stays.closed
+    assert [event['type'] for event in drain(stays)] == ['member.left']
+
+    # Later activity no longer reaches the closed stream
+    admin = db_session.get(User, stockvel.admin_user_id)
+    client.post(f'/api/stockvels/{stockvel.id}/contribute', headers=auth(admin), json={'amount': str(stockvel.contribution_amount)})
+    assert drain(left) == []
+    assert len(drain(stays)) == 1
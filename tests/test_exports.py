@@ -0,0 +1,37 @@
+"""
+Contribution exports: CSV cells are safe to open in a spreadsheet, and the size check counts what is exported.
+"""
+import csv
+import io
+
+from flask_jwt_extended import create_access_token
+
+from factories import create_stockvel, create_member, create_contribution
+from models.user import User
+from services.export_service import count_rows
+
+def auth(user_id):
+    return {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+
+def test_csv_cells_are_not_formulas(client, db_session):
+    stockvel = create_stockvel()
+    create_contribution(stockvel, description='=HYPERLINK("http://example.com","pay here")')
+    create_contribution(stockvel, description='-2+3')
+    create_contribution(stockvel, description='Monthly')
+
+    response = client.get(f'/api/stockvels/{stockvel.id}/ledger/export?format=csv', headers=auth(stockvel.admin_user_id))
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert sorted(row['description'] for row in rows) == ["'-2+3", '\'=HYPERLINK("http://example.com","pay here")', 'Monthly']
+
+def test_count_matches_the_exported_rows(db_session):
+    stockvel = create_stockvel()
+    other = create_stockvel()
+    user = db_session.get(User, create_member(stockvel).user_id)
+    create_member(other, user)
+    for group in (stockvel, stockvel, other):
+        create_contribution(group, user)
+
+    assert count_rows('ledger', stockvel.id) == 2
+    assert count_rows('history', user.id) == 3
@@ -0,0 +1,73 @@
+"""
+Idempotency-Key: the view's writes and the stored response commit together.
+"""
+from datetime import datetime
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from factories import create_stockvel
+from models.idempotency_key import IdempotencyKey
+from models.stockvel import Contribution
+from services import idempotency_service
+
+class Crash(BaseException):
+    """The worker dying mid-request: nothing after it runs"""
+
+def payment(stockvel):
+    """What the admin's contribution needs, read once: requests end the session ``stockvel`` lives in"""
+    return {
+        'id': stockvel.id,
+        'amount': str(stockvel.contribution_amount),
+        'token': create_access_token(identity=str(stockvel.admin_user_id))
+    }
+
+def contribute(client, payment, key):
+    return client.post(
+        f"/api/stockvels/{payment['id']}/contribute",
+        headers={'Authorization': f"Bearer {payment['token']}", idempotency_service.HEADER: key},
+        json={'amount': payment['amount']}
+    )
+
+def contributions(stockvel_id):
+    return Contribution.query.filter_by(stockvel_id=stockvel_id).count()
+
+def test_retry_replays_the_stored_response(client, db_session):
+    stockvel = payment(create_stockvel())
+
+    first = contribute(client, stockvel, 'pay-1')
+    retry = contribute(client, stockvel, 'pay-1')
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert contributions(stockvel['id']) == 1
+
+def test_retry_after_a_crash_runs_the_request_once(app, committed_db, monkeypatch):
+    # Committed rows and the app's own connections, as in production
+    stockvel = payment(create_stockvel())
+    stockvel_id = stockvel['id']
+    client = app.test_client()
+
+    def crash(key_id, response):
+        raise Crash()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(idempotency_service, 'complete_key', crash)
+        with pytest.raises(Crash):
+            contribute(client, stockvel, 'pay-1')
+
+    # The contribution went with the response that was never stored
+    assert contributions(stockvel_id) == 0
+    key = IdempotencyKey.query.filter_by(key='pay-1').one()
+    assert key.status == idempotency_service.IN_PROGRESS
+
+    # Once the dead request's claim lapses the retry takes it over
+    key.locked_until = datetime.utcnow()
+    committed_db.session.commit()
+    response = contribute(client, stockvel, 'pay-1')
+    assert response.status_code == 201
+    assert contributions(stockvel_id) == 1
+
+    assert contribute(client, stockvel, 'pay-1').headers['Idempotent-Replayed'] == 'true'
+    assert contributions(stockvel_id) == 1
@@ -0,0 +1,39 @@
+"""
+Identity cache invalidations published by one process and applied by the others.
+"""
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+
+from factories import create_stockvel, create_user
+from models.identity_invalidation import IdentityInvalidation
+from models.stockvel import StockvelMember
+from services import identity_service
+
+def profile(client, user_id):
+    return client.get('/api/auth/profile', headers={'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'})
+
+def test_invalidation_from_another_process_reaches_this_cache(client, db_session):
+    stockvel = create_stockvel(members=1)
+    member = stockvel.members[-1]
+    user_id = member.user_id
+    assert stockvel.id in profile(client, user_id).get_json()['joined_group_ids']
+
+    # Another process (e.g. the job worker archiving the group) changes the
+    # membership and publishes the invalidation; this cache was not touched
+    db_session.execute(StockvelMember.__table__.delete().where(StockvelMember.__table__.c.id == member.id))
+    db_session.execute(insert(IdentityInvalidation), [{'user_id': None}])
+    db_session.commit()
+
+    assert stockvel.id not in profile(client, user_id).get_json()['joined_group_ids']
+
+def test_invalidations_are_applied_once(app, db_session):
+    user = create_user()
+    cache = identity_service.get_cache()
+    identity_service.sync_invalidations(force=True)
+    identity_service.invalidate_user(user.id)
+
+    identity_service.load_current_user(user.id)
+    assert cache.get(user.id) is not None
+    # Re-read inside the overlap window, but not applied again
+    identity_service.sync_invalidations(force=True)
+    assert cache.get(user.id) is not None
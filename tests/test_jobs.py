@@ -0,0 +1,43 @@
+"""
+Stale running jobs: a live worker's heartbeat keeps its jobs, a dead one's are requeued or failed.
+"""
+from datetime import datetime, timedelta
+
+from services import job_service
+from services.database_service import db
+
+TIMEOUT = 900
+
+def running(attempts=1, max_attempts=3, locked_by='dead-host:1:0', silent_for=TIMEOUT + 60):
+    job = job_service.enqueue('partitions.maintain', max_attempts=max_attempts)
+    job.status = 'running'
+    job.attempts = attempts
+    job.locked_by = locked_by
+    job.locked_at = datetime.utcnow() - timedelta(seconds=silent_for)
+    db.session.commit()
+    return job.id
+
+def status(job_id):
+    db.session.expire_all()
+    return job_service.get_job(job_id).status
+
+def test_stale_jobs_are_requeued_until_out_of_attempts(db_session):
+    retried = running(attempts=1)
+    exhausted = running(attempts=3)
+
+    assert job_service.requeue_stale_jobs(TIMEOUT) == 1
+
+    assert status(retried) == 'queued'
+    assert status(exhausted) == 'failed'
+    assert job_service.get_job(exhausted).finished_at is not None
+
+def test_heartbeats_keep_long_jobs_running(db_session, monkeypatch):
+    beating = running(locked_by='live-host:1:0')
+    reporting = running(locked_by='live-host:1:1')
+
+    job_service.heartbeat(['live-host:1:0'])
+    monkeypatch.setattr(job_service._current, 'job_id', reporting, raising=False)
+    job_service.report_progress(done=10)
+
+    assert job_service.requeue_stale_jobs(TIMEOUT) == 0
+    assert status(beating) == status(reporting) == 'running'
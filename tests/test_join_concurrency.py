@@ -0,0 +1,123 @@
+"""
+Concurrency stress test for joining a stockvel.
+
+Many users join the same group at once through the real routes; exactly
+max_members memberships may exist afterwards. Runs against TEST_DATABASE_URL
+(use PostgreSQL to exercise the row lock), or a temporary SQLite file (see
+conftest.py). The rows are committed, so the joining threads can see them.
+"""
+import os
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from main import app
+from services.database_service import db
+from models.user import User
+from models.stockvel import Stockvel, StockvelMember
+from flask_jwt_extended import create_access_token
+
+JOINERS = int(os.getenv('JOIN_STRESS_USERS', 40))
+MAX_MEMBERS = 5
+
+@pytest.fixture
+def group(committed_db):
+    """A stockvel with its admin as the only member, plus JOINERS users with tokens"""
+    with app.app_context():
+        admin = User(email='admin@example.com', display_name='Admin')
+        admin.set_password('password123')
+        users = [User(email=f'joiner{i}@example.com') for i in range(JOINERS)]
+        for user in users:
+            user.password_hash = admin.password_hash
+        db.session.add_all([admin] + users)
+        db.session.flush()
+
+        stockvel = Stockvel(
+            name='Stress group',
+            contribution_amount=Decimal('100.00'),
+            frequency='Monthly',
+            max_members=MAX_MEMBERS,
+            start_date=datetime(2024, 1, 1),
+            admin_user_id=admin.id
+        )
+        db.session.add(stockvel)
+        db.session.flush()
+        db.session.add(StockvelMember(stockvel_id=stockvel.id, user_id=admin.id, is_admin=True, position=0))
+        db.session.commit()
+
+        tokens = [create_access_token(identity=str(user.id)) for user in users]
+        yield stockvel.id, stockvel.invite_code, tokens
+
+def run_concurrently(requests):
+    """Fire all requests at once from separate threads; returns their status codes"""
+    barrier = threading.Barrier(len(requests))
+    statuses = [None] * len(requests)
+
+    def worker(index, request):
+        client = app.test_client()
+        barrier.wait()
+        statuses[index] = request(client).status_code
+
+    threads = [threading.Thread(target=worker, args=(i, request)) for i, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+def member_count(stockvel_id):
+    with app.app_context():
+        return StockvelMember.query.filter_by(stockvel_id=stockvel_id).count()
+
+def positions(stockvel_id):
+    with app.app_context():
+        return sorted(member.position for member in StockvelMember.query.filter_by(stockvel_id=stockvel_id))
+
+def test_concurrent_joins_never_overfill(group):
+    stockvel_id, _, tokens = group
+
+    statuses = run_concurrently([
+        lambda client, token=token: client.post(
+            f'/api/stockvels/{stockvel_id}/join',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        for token in tokens
+    ])
+
+    assert statuses.count(201) == MAX_MEMBERS - 1
+    assert statuses.count(400) == JOINERS - (MAX_MEMBERS - 1)
+    assert member_count(stockvel_id) == MAX_MEMBERS
+    # Each joiner takes the next payout position
+    assert positions(stockvel_id) == list(range(MAX_MEMBERS))
+
+def test_concurrent_invite_code_joins_never_overfill(group):
+    stockvel_id, invite_code, tokens = group
+
+    statuses = run_concurrently([
+        lambda client, token=token: client.post(
+            '/api/stockvels/join',
+            headers={'Authorization': f'Bearer {token}'},
+            json={'invite_code': invite_code}
+        )
+        for token in tokens
+    ])
+
+    assert statuses.count(201) == MAX_MEMBERS - 1
+    assert member_count(stockvel_id) == MAX_MEMBERS
+
+def test_same_user_joining_concurrently_joins_once(group):
+    stockvel_id, _, tokens = group
+
+    statuses = run_concurrently([
+        lambda client: client.post(
+            f'/api/stockvels/{stockvel_id}/join',
+            headers={'Authorization': f'Bearer {tokens[0]}'}
+        )
+        for _ in range(10)
+    ])
+
+    assert statuses.count(201) == 1
+    assert statuses.count(400) == 9
+    assert member_count(stockvel_id) == 2
@@ -0,0 +1,125 @@
+"""
+Outbound mail against a local SMTP stand-in: receipts, pooled delivery, retries and reminders.
+"""
+from datetime import date, datetime
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+
+from factories import create_stockvel
+from smtp_stub import SMTPStub
+from models.job import Job
+from models.outbound_email import OutboundEmail
+from models.user import User
+from services import job_service, mail_service, serialization_service
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    with SMTPStub() as stub:
+        for key, value in {'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': stub.port, 'MAIL_USE_TLS': False,
+                           'MAIL_USERNAME': None, 'MAIL_CONCURRENCY': 2}.items():
+            monkeypatch.setitem(app.config, key, value)
+        mail_service.close_pool()
+        yield stub
+        mail_service.close_pool()
+
+def queue(db_session, *recipients):
+    db_session.execute(insert(OutboundEmail.__table__), [
+        {'kind': 'test', 'recipient': recipient, 'subject': 'Hello', 'body': 'Test message'}
+        for recipient in recipients
+    ])
+    db_session.commit()
+
+def test_contribution_queues_a_receipt_for_the_worker(client, db_session, smtp):
+    stockvel = create_stockvel()
+    admin = db_session.get(User, stockvel.admin_user_id)
+
+    response = client.post(
+        f'/api/stockvels/{stockvel.id}/contribute',
+        headers={'Authorization': f'Bearer {create_access_token(identity=str(admin.id))}'},
+        json={'amount': str(stockvel.contribution_amount)}
+    )
+
+    assert response.status_code == 201
+    assert smtp.messages == []  # Nothing is sent on the request thread
+    assert Job.query.filter_by(name='mail.deliver', status='queued').count() == 1
+
+    assert mail_service.deliver()['sent'] == 1
+    [(recipients, message)] = smtp.messages
+    assert recipients == [admin.email]
+    assert stockvel.name in message['Subject']
+    assert OutboundEmail.query.one().status == 'sent'
+
+def test_kicks_share_one_queued_delivery_job(db_session):
+    for _ in range(3):
+        mail_service.kick(delay=0)
+    db_session.commit()
+    assert Job.query.filter_by(name='mail.deliver').count() == 1
+
+    # Once a worker has it, mail queued meanwhile needs another run
+    assert job_service.claim_next_job('test-worker') is not None
+    mail_service.kick(delay=0)
+    mail_service.kick(delay=0)
+    db_session.commit()
+    assert Job.query.filter_by(name='mail.deliver', status='queued').count() == 1
+    assert Job.query.filter_by(name='mail.deliver').count() == 2
+
+def test_delivery_reuses_a_bounded_number_of_connections(app, db_session, smtp, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAIL_BATCH_SIZE', 20)
+    queue(db_session, *[f'member{i}@example.com' for i in range(60)])
+
+    assert mail_service.deliver() == {'sent': 60, 'retrying': 0, 'failed': 0}
+    assert len(smtp.messages) == 60
+    # Three batches over at most MAIL_CONCURRENCY connections, kept open between them
+    assert smtp.connections <= 2
+
+def test_temporary_failures_are_retried_and_permanent_ones_are_not(db_session, smtp):
+    smtp.replies = {'gone@example.com': '550 No such user', 'busy@example.com': '451 Try again later'}
+    queue(db_session, 'gone@example.com', 'busy@example.com', 'ok@example.com')
+
+    assert mail_service.deliver() == {'sent': 1, 'retrying': 1, 'failed': 1}
+
+    gone = OutboundEmail.query.filter_by(recipient='gone@example.com').one()
+    busy = OutboundEmail.query.filter_by(recipient='busy@example.com').one()
+    assert gone.status == 'failed' and '550' in gone.last_error
+    assert busy.status == 'queued' and busy.attempts == 1 and busy.send_after > datetime.utcnow()
+
+    # Not due yet, so the next run leaves it alone
+    assert mail_service.deliver()['retrying'] == 0
+
+def test_payout_reminders_go_to_every_member_once(db_session):
+    today = date(2025, 3, 10)
+    stockvel = create_stockvel(members=3, frequency='Monthly', start_date=datetime(2025, 1, 11))
+    create_stockvel(members=2, frequency='Monthly', start_date=datetime(2025, 1, 25))  # Not due for two weeks
+
+    assert mail_service.queue_payout_reminders(today) == 4
+    assert mail_service.queue_payout_reminders(today) == 0
+
+    reminders = OutboundEmail.query.filter_by(kind='payout_reminder').all()
+    assert {email.user_id for email in reminders} == {
+        member.user_id for member in stockvel.members
+    }
+    # Third round (0-based 2): the member at position 2 is paid out
+    payee = next(member for member in stockvel.members if member.position == 2)
+    assert 'payout goes to you' in next(email.body for email in reminders if email.user_id == payee.user_id)
+
+def test_payout_reminders_follow_the_roster_order(db_session):
+    # A member without a position (joined before positions existed) heads the roster, and so the rotation
+    stockvel = create_stockvel(members=3, frequency='Monthly', start_date=datetime(2025, 3, 11))
+    unplaced = next(member for member in stockvel.members if member.position == 2)
+    unplaced.position = None
+    db_session.commit()
+
+    mail_service.queue_payout_reminders(date(2025, 3, 10))  # The first round
+
+    roster = db_session.execute(serialization_service.roster_query(stockvel.id)).all()
+    assert roster[0].StockvelMember.user_id == unplaced.user_id
+    reminder = OutboundEmail.query.filter_by(kind='payout_reminder', user_id=unplaced.user_id).one()
+    assert 'payout goes to you' in reminder.body
+
+def test_next_due_date():
+    assert mail_service.next_due_date(date(2025, 1, 31), 'Monthly', date(2025, 2, 10)) == (date(2025, 2, 28), 1)
+    assert mail_service.next_due_date(date(2025, 1, 1), 'Weekly', date(2025, 1, 8)) == (date(2025, 1, 8), 1)
+    assert mail_service.next_due_date(date(2025, 1, 1), 'Bi-Weekly', date(2025, 1, 9)) == (date(2025, 1, 15), 1)
+    assert mail_service.next_due_date(date(2025, 6, 1), 'Monthly', date(2025, 1, 9)) == (date(2025, 6, 1), 0)
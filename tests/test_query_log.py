@@ -0,0 +1,29 @@
+"""
+Which slow statements SLOW_QUERY_EXPLAIN='analyze' may run again.
+"""
+import pytest
+
+from services.query_log_service import analyzable
+
+@pytest.mark.parametrize('statement', [
+    'SELECT stockvels.id FROM stockvels WHERE stockvels.id IN (%(id_1_1)s, %(id_1_2)s)',
+    'SELECT coalesce(sum(contributions.amount), %(param_1)s) AS total FROM contributions GROUP BY contributions.stockvel_id',
+    'SELECT CAST(amount AS NUMERIC(10, 2)), row_number() OVER (PARTITION BY stockvel_id ORDER BY joined_at) FROM stockvel_members',
+    "SELECT id FROM users WHERE email = 'pg_notify(1)'",
+])
+def test_read_only_selects_are_analyzed(statement):
+    assert analyzable(statement)
+
+@pytest.mark.parametrize('statement', [
+    'UPDATE jobs SET status = %(status)s',
+    'SELECT jobs.id FROM jobs WHERE jobs.status = %(status_1)s FOR UPDATE SKIP LOCKED',
+    'SELECT id FROM stockvels FOR KEY SHARE',
+    'WITH gone AS (DELETE FROM jobs RETURNING id) SELECT count(*) FROM gone',
+    'SELECT pg_notify(%(channel)s, %(payload)s)',
+    'SELECT pg_advisory_lock(%(key)s)',
+    "SELECT nextval('contributions_id_seq')",
+    "SELECT '--', pg_advisory_lock(1)",
+    'SELECT id INTO copy FROM users',
+])
+def test_statements_with_side_effects_are_not(statement):
+    assert not analyzable(statement)
@@ -0,0 +1,33 @@
+"""
+A request rejected by one rate limit rule is not charged to its other rules.
+"""
+import pytest
+from flask import Flask
+
+from middleware.rate_limit import init_rate_limiting
+
+@pytest.fixture(params=['local', 'shared'])
+def limited(request, tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        RATE_LIMIT_STORAGE=request.param,
+        RATE_LIMIT_SHARED_PATH=str(tmp_path / 'buckets'),
+        RATE_LIMITS={
+            'burst': (['ping'], 'ip', 1, 60),  # One a minute per client
+            'route': (['ping'], 'route', 2, 3600)  # Two an hour in total
+        }
+    )
+    app.add_url_rule('/ping', 'ping', lambda: 'pong')
+    init_rate_limiting(app)
+    return app.test_client()
+
+def ping(client, ip):
+    return client.get('/ping', environ_base={'REMOTE_ADDR': ip}).status_code
+
+def test_rejected_requests_leave_the_other_buckets_alone(limited):
+    assert ping(limited, '10.0.0.1') == 200
+    # Rejected by the client's burst rule, which must not drain the route's bucket
+    assert [ping(limited, '10.0.0.1') for _ in range(5)] == [429] * 5
+
+    assert ping(limited, '10.0.0.2') == 200
+    assert ping(limited, '10.0.0.3') == 429  # Now the route's bucket is empty
@@ -0,0 +1,37 @@
+"""
+Revoke-all cutoffs against tokens issued in the same second, and the stdlib JSON fallback.
+"""
+import json
+from decimal import Decimal
+
+from flask_jwt_extended import create_access_token
+
+from factories import create_user, PASSWORD
+from utils import json_provider
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+def test_revoke_all_covers_tokens_from_the_same_second(client, db_session):
+    user = create_user()
+    token = create_access_token(identity=str(user.id))
+
+    assert client.post('/api/auth/revoke-all-sessions', headers=auth(token)).status_code == 200
+    assert client.get('/api/auth/profile', headers=auth(token)).status_code == 401
+
+def test_password_change_keeps_only_the_fresh_token(client, db_session):
+    user = create_user()
+    old = create_access_token(identity=str(user.id))
+
+    response = client.post('/api/auth/change-password', headers=auth(old), json={
+        'old_password': PASSWORD, 'new_password': 'a-new-password'
+    })
+
+    assert response.status_code == 200
+    assert client.get('/api/auth/profile', headers=auth(old)).status_code == 401
+    assert client.get('/api/auth/profile', headers=auth(response.get_json()['access_token'])).status_code == 200
+
+def test_stdlib_fallback_writes_decimal_exactly(app, monkeypatch):
+    monkeypatch.setattr(json_provider, 'orjson', None)
+    body = json.loads(app.json.dumps({'amount': Decimal('10.50')}))
+    assert body == {'amount': '10.50'}
@@ -0,0 +1,102 @@
+"""
+Query-count regression tests for the stockvel routes, plus checks that each
+test's rows are rolled back and that ledger totals include every contribution.
+"""
+from datetime import timedelta
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from factories import create_user, create_stockvel, create_member, create_contribution
+from models.user import User
+from models.stockvel import Contribution
+
+def auth(user):
+    return {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+
+@pytest.mark.parametrize('run', [1, 2])
+def test_rows_are_rolled_back_between_tests(db_session, run):
+    # Both runs commit the same email; the second would find the first's row if it leaked
+    assert User.query.filter_by(email='rollback@example.com').count() == 0
+    create_user(email='rollback@example.com')
+    assert User.query.filter_by(email='rollback@example.com').count() == 1
+
+def test_commits_in_routes_stay_inside_the_test(client, db_session):
+    stockvel = create_stockvel(members=2)
+    admin = db_session.get(User, stockvel.admin_user_id)
+
+    response = client.post(
+        f'/api/stockvels/{stockvel.id}/contribute',
+        headers=auth(admin),
+        json={'amount': str(stockvel.contribution_amount)}
+    )
+
+    assert response.status_code == 201
+    assert Contribution.query.filter_by(stockvel_id=stockvel.id).count() == 1
+
+def count_queries(client, query_count, path, user):
+    """Statements run by a GET of ``path``, after a first request has warmed per-process caches"""
+    client.get(path, headers=auth(user))
+    with query_count:
+        response = client.get(path, headers=auth(user))
+    assert response.status_code == 200
+    return len(query_count), response.get_json()
+
+def test_listing_stockvels_does_not_query_per_group(client, db_session, query_count):
+    counts = []
+    for groups in (1, 6):
+        user = create_user()
+        for _ in range(groups):
+            stockvel = create_stockvel(members=3)
+            create_member(stockvel, user)
+            create_contribution(stockvel, user)
+
+        count, body = count_queries(client, query_count, '/api/stockvels/', user)
+        assert len(body['stockvels']) == groups
+        counts.append(count)
+
+    assert counts[0] == counts[1], query_count.statements
+
+def test_stockvel_detail_does_not_query_per_member(client, db_session, query_count):
+    counts = []
+    for members in (1, 8):
+        stockvel = create_stockvel(members=members)
+        admin = db_session.get(User, stockvel.admin_user_id)
+
+        count, body = count_queries(client, query_count, f'/api/stockvels/{stockvel.id}', admin)
+        assert len(body['stockvel']['members']) == members + 1
+        counts.append(count)
+
+    assert counts[0] == counts[1], query_count.statements
+
+def test_contributions_dated_before_the_group_count(client, db_session):
+    # e.g. payments collected before the group was set up in the app
+    stockvel = create_stockvel()
+    admin = db_session.get(User, stockvel.admin_user_id)
+    create_contribution(stockvel, admin, amount=100, contribution_date=stockvel.created_at - timedelta(days=60))
+    create_contribution(stockvel, admin, amount=50)
+
+    body = client.get(f'/api/stockvels/{stockvel.id}', headers=auth(admin)).get_json()['stockvel']
+    assert float(body['current_total']) == 150
+    assert len(client.get(f'/api/stockvels/{stockvel.id}/contributions', headers=auth(admin)).get_json()['contributions']) == 2
+
+def test_ledger_start_follows_rows_written_outside_the_orm(client, db_session):
+    # An import writing straight to the table; the ledger bound must still cover it
+    stockvel = create_stockvel()
+    admin = db_session.get(User, stockvel.admin_user_id)
+    create_contribution(stockvel, admin, amount=50, contribution_date=stockvel.created_at)
+    imported = stockvel.created_at - timedelta(days=400)
+    db_session.execute(Contribution.__table__.insert().values(
+        stockvel_id=stockvel.id, user_id=admin.id, amount=100, contribution_date=imported, status='confirmed'
+    ))
+    db_session.refresh(stockvel)
+    assert stockvel.ledger_starts_at == imported
+
+    # Moving a row earlier moves the start with it
+    moved = imported - timedelta(days=30)
+    db_session.execute(Contribution.__table__.update().where(Contribution.amount == 50).values(contribution_date=moved))
+    db_session.refresh(stockvel)
+    assert stockvel.ledger_starts_at == moved
+
+    body = client.get(f'/api/stockvels/{stockvel.id}', headers=auth(admin)).get_json()['stockvel']
+    assert float(body['current_total']) == 150
@@ -0,0 +1,72 @@
+"""
+Write-behind of last_login: coalescing, bulk flushes, and the login route.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from factories import PASSWORD, create_user
+from models.user import User
+from services import write_behind_service
+from services.write_behind_service import WriteBehindBuffer
+
+@pytest.fixture
+def buffer(app, committed_db, monkeypatch):
+    # Long enough that only the test flushes
+    monkeypatch.setitem(app.config, 'WRITE_BEHIND_INTERVAL', 3600)
+    monkeypatch.setitem(app.config, 'WRITE_BEHIND_BATCH_SIZE', 2)
+    buffer = WriteBehindBuffer(app)
+    yield buffer
+    buffer.close()
+
+def last_login(user_id):
+    return User.query.filter_by(id=user_id).with_entities(User.last_login).scalar()
+
+def test_updates_coalesce_into_bulk_statements(app, buffer, query_count):
+    users = [create_user() for _ in range(3)]
+    start = datetime(2025, 5, 1, 12)
+    for minute in range(10):
+        for user in users:
+            buffer.record(user.id, 'last_login', start + timedelta(minutes=minute))
+
+    assert buffer.pending() == 3
+    with query_count:
+        assert buffer.flush() == 3
+    # 30 logins, three users, two per statement
+    assert len([sql for sql in query_count.statements if sql.lstrip().upper().startswith('UPDATE')]) == 2
+    assert {last_login(user.id) for user in users} == {start + timedelta(minutes=9)}
+    assert buffer.pending() == 0
+
+def test_flush_never_moves_a_timestamp_backwards(app, buffer):
+    newer = datetime(2025, 5, 2)
+    user = create_user(last_login=newer)  # e.g. written by another process since
+
+    buffer.record(user.id, 'last_login', newer - timedelta(hours=1))
+    buffer.flush()
+
+    assert last_login(user.id) == newer
+
+def test_close_writes_what_is_buffered(app, buffer):
+    user = create_user()
+    buffer.record(user.id, 'last_login', datetime(2025, 5, 3))
+
+    buffer.close()
+
+    assert last_login(user.id) == datetime(2025, 5, 3)
+
+def test_login_defers_the_write(app, committed_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'WRITE_BEHIND_INTERVAL', 3600)
+    monkeypatch.setattr(write_behind_service, '_buffer', None)
+    user = create_user()
+    user_id, email = user.id, user.email
+
+    # Not the client fixture, which runs in the rolled-back db_session
+    response = app.test_client().post('/api/auth/login', json={'email': email, 'password': PASSWORD})
+
+    assert response.status_code == 200
+    assert response.get_json()['user']['last_login'] is not None
+    assert last_login(user_id) is None
+
+    assert write_behind_service.flush_pending() == 1
+    assert last_login(user_id) is not None
+    write_behind_service._buffer.close()